@@ -0,0 +1,51 @@
+"""
+Compares the latency of uncached TongaClient.get calls against a local stand-in server when opening a new connection
+per request (the client behaviour prior to pooled transports) and when using the pooled keep-alive transport
+
+Run from the repository root: python -m benchmarks.bench_transport
+"""
+from timeit import default_timer
+
+import requests
+
+from tonga import TongaClient, TongaClientOptions
+from tonga.transport import PooledSessionTransport, TongaTransport
+from tests.stand_in_server import StandInTongaServer
+
+
+class PerRequestTransport(TongaTransport):
+    """
+    Issues every request through the module level requests.get, paying a new connection per request
+    """
+
+    def get(self, url, headers, timeout=None):
+        return requests.get(url, headers=headers)
+
+
+def measure_get_latency(server_url, transport, iterations):
+    """
+    Measures the average latency of an uncached get call
+    :rtype: float
+    """
+    client = TongaClient(server_url, options=TongaClientOptions(transport=transport))
+    client.get("flag")
+    start = default_timer()
+    for _ in range(iterations):
+        client.clear_state()
+        client.get("flag")
+    return (default_timer() - start) / iterations
+
+
+def main(iterations=500):
+    with StandInTongaServer(flags=dict(flag=True)) as server:
+        per_request = measure_get_latency(server.url, PerRequestTransport(), iterations)
+        pooled_transport = PooledSessionTransport()
+        pooled = measure_get_latency(server.url, pooled_transport, iterations)
+        pooled_transport.close()
+    print("per request connection: {:.1f}us per get".format(per_request * 1e6))
+    print("pooled keep-alive:      {:.1f}us per get".format(pooled * 1e6))
+    print("speedup:                {:.2f}x".format(per_request / pooled))
+
+
+if __name__ == "__main__":
+    main()
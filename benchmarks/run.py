@@ -0,0 +1,344 @@
+"""
+Benchmark suite of the client hot paths, fetching benchmarks run against an in-process stand-in server
+
+Run from the repository root:
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --filter get_ --compare results.json
+
+Results are written as json, comparing against a previous result file reports the ratio of each benchmark to its
+baseline and exits with a non zero status if any benchmark regressed by more than the threshold
+"""
+import argparse
+import json
+import platform
+import sys
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Thread
+from time import time
+from timeit import default_timer
+
+import requests
+
+from tonga import TongaClient, TongaClientOptions, RetryPolicy
+from tonga.transport import PooledSessionTransport
+from tests.stand_in_server import StandInTongaServer
+
+BENCHMARKS = OrderedDict()
+
+CONCURRENT_THREADS = 8
+
+
+def benchmark(name, number):
+    """
+    Registers a benchmark. The decorated function is a context manager yielding the operation to measure, anything
+    before the yield is setup and is not measured
+    :param name: Benchmark name
+    :type name: str
+    :param number: Number of operations per measured round
+    :type number: int
+    """
+
+    def register(setup):
+        BENCHMARKS[name] = (contextmanager(setup), number)
+        return setup
+
+    return register
+
+
+def nested_flags(namespaces, flags_per_namespace):
+    """
+    Builds a two level flag tree
+    :rtype: dict[str, Any]
+    """
+    return {
+        "ns{}".format(namespace): {"flag{}".format(flag): flag for flag in range(flags_per_namespace)}
+        for namespace in range(namespaces)
+    }
+
+
+def deep_flags(depth, fan_out):
+    """
+    Builds a flag tree of the given depth where every inner node has fan_out children
+    :rtype: dict[str, Any]
+    """
+    if depth == 0:
+        return 1
+    return {"n{}".format(child): deep_flags(depth - 1, fan_out) for child in range(fan_out)}
+
+
+@contextmanager
+def stand_in_client(flags, options=None, **server_kwargs):
+    """
+    Starts a stand-in server and yields a client of it using a dedicated pooled transport
+    """
+    transport = PooledSessionTransport()
+    options = options or TongaClientOptions()
+    options.transport = transport
+    with StandInTongaServer(flags=flags, **server_kwargs) as server:
+        yield TongaClient(server.url, context_attributes=dict(user="benchmark"), options=options)
+    transport.close()
+
+
+def run_concurrently(func, threads=CONCURRENT_THREADS):
+    workers = [Thread(target=func) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+@benchmark("get_cached", number=100000)
+def get_cached():
+    client = TongaClient("http://server_url", options=TongaClientOptions(offline_mode=True))
+    client.set_state({"flag{}".format(flag): flag for flag in range(1000)})
+    yield lambda: client.get("flag500")
+
+
+@benchmark("get_cached_frozen_view", number=100000)
+def get_cached_frozen_view():
+    client = TongaClient("http://server_url", options=TongaClientOptions(offline_mode=True))
+    client.set_state({"flag{}".format(flag): flag for flag in range(1000)})
+    view = client.frozen_view()
+    yield lambda: view.get("flag500")
+
+
+@benchmark("get_bool_frozen_view", number=100000)
+def get_bool_frozen_view():
+    client = TongaClient("http://server_url", options=TongaClientOptions(offline_mode=True))
+    client.set_state({"flag{}".format(flag): "true" for flag in range(1000)})
+    view = client.frozen_view()
+    yield lambda: view.get_bool("flag500")
+
+
+@benchmark("get_cached_with_ttl", number=100000)
+def get_cached_with_ttl():
+    with stand_in_client(dict(flag=True), TongaClientOptions(cache_ttl=3600)) as client:
+        client.get("flag")
+        yield lambda: client.get("flag")
+
+
+@benchmark("get_many_cached", number=10000)
+def get_many_cached():
+    client = TongaClient("http://server_url", options=TongaClientOptions(offline_mode=True))
+    client.set_state({"flag{}".format(flag): flag for flag in range(1000)})
+    flags = ["flag{}".format(flag) for flag in range(0, 1000, 50)]
+    yield lambda: client.get_many(flags)
+
+
+@benchmark("get_uncached", number=300)
+def get_uncached():
+    with stand_in_client(dict(flag=True)) as client:
+
+        def get():
+            client.clear_state()
+            client.get("flag")
+
+        yield get
+
+
+@benchmark("get_uncached_server_latency_5ms", number=50)
+def get_uncached_server_latency():
+    with stand_in_client(dict(flag=True), latency=0.005) as client:
+
+        def get():
+            client.clear_state()
+            client.get("flag")
+
+        yield get
+
+
+@benchmark("get_uncached_server_errors_20pct", number=300)
+def get_uncached_server_errors():
+    options = TongaClientOptions(retry_policy=RetryPolicy.constant(10, 0))
+    with stand_in_client(dict(flag=True), options, error_rate=0.2) as client:
+
+        def get():
+            client.clear_state()
+            client.get("flag")
+
+        yield get
+
+
+@benchmark("pre_fetch_10k_flags", number=20)
+def pre_fetch_10k_flags():
+    with stand_in_client(nested_flags(100, 100), TongaClientOptions(pre_fetch=True)) as client:
+
+        def get():
+            client.clear_state()
+            client.get("ns50.flag50")
+
+        yield get
+
+
+@benchmark("pre_fetch_10k_flags_unchanged_refresh", number=50)
+def pre_fetch_10k_flags_unchanged_refresh():
+    with stand_in_client(nested_flags(100, 100), TongaClientOptions(pre_fetch=True)) as client:
+        client.get("ns50.flag50")
+        # A refresh of an existing pre-fetch is a conditional request
+        yield client._pre_fetch_and_populate_cache  # pylint: disable=protected-access
+
+
+@benchmark("decode_all_flags_10k_flags", number=20)
+def decode_all_flags_10k_flags():
+    response = requests.Response()
+    response.status_code = 200
+    response.headers["Content-Type"] = "application/json"
+    response._content = json.dumps(nested_flags(100, 100)).encode("utf-8")  # pylint: disable=protected-access
+    client = TongaClient("http://server_url")
+    yield lambda: client._decode_flat_tree(response)  # pylint: disable=protected-access
+
+
+@benchmark("squash_deep_tree", number=20)
+def squash_deep_tree():
+    client = TongaClient("http://server_url")
+    # 6 levels with a fan out of 5, 15625 leaf flags
+    tree = deep_flags(6, 5)
+    yield lambda: client._recursive_squash_response_dict(tree)  # pylint: disable=protected-access
+
+
+@benchmark("build_query_string_and_headers", number=100000)
+def build_query_string_and_headers():
+    client = TongaClient(
+        "http://server_url",
+        context_attributes={"attribute{}".format(index): "value {}".format(index) for index in range(10)},
+        request_attributes={"attribute{}".format(index): "value {}".format(index) for index in range(5)},
+    )
+
+    def build():
+        client._build_query_string()  # pylint: disable=protected-access
+        client._build_headers()  # pylint: disable=protected-access
+
+    yield build
+
+
+@benchmark("build_flag_value_request", number=100000)
+def build_flag_value_request():
+    client = TongaClient(
+        "http://server_url",
+        context_attributes={"attribute{}".format(index): "value {}".format(index) for index in range(10)},
+        request_attributes={"attribute{}".format(index): "value {}".format(index) for index in range(5)},
+    )
+    yield lambda: client._flag_value_request("namespace.flag")  # pylint: disable=protected-access
+
+
+@benchmark("concurrent_get_cached_8_threads", number=20)
+def concurrent_get_cached():
+    client = TongaClient("http://server_url", options=TongaClientOptions(offline_mode=True))
+    client.set_state({"flag{}".format(flag): flag for flag in range(1000)})
+
+    def get_many_times():
+        for _ in range(1000):
+            client.get("flag500")
+
+    yield lambda: run_concurrently(get_many_times)
+
+
+@benchmark("concurrent_cold_get_8_threads", number=50)
+def concurrent_cold_get():
+    with stand_in_client(nested_flags(10, 10), TongaClientOptions(pre_fetch=True)) as client:
+
+        def cold_get():
+            client.clear_state()
+            run_concurrently(lambda: client.get("ns5.flag5"))
+
+        yield cold_get
+
+
+@benchmark("dump_state_10k_flags", number=200)
+def dump_state():
+    client = TongaClient("http://server_url", options=TongaClientOptions(offline_mode=True))
+    client.set_state({"flag{}".format(flag): dict(value=flag) for flag in range(10000)})
+    yield client.dump_state
+
+
+@benchmark("with_state_override_10k_flags", number=10000)
+def with_state_override():
+    client = TongaClient("http://server_url", options=TongaClientOptions(offline_mode=True))
+    client.set_state({"flag{}".format(flag): dict(value=flag) for flag in range(10000)})
+    override = dict(flag1=dict(value=-1))
+
+    def override_state():
+        with client.with_state(override):
+            client.get("flag1")
+
+    yield override_state
+
+
+def run_benchmark(setup, number, repeat):
+    """
+    Measures a benchmark, returning statistics of the time per operation in seconds over the measured rounds
+    :rtype: dict[str, float]
+    """
+    with setup() as operation:
+        # Warm up connections and caches
+        operation()
+        timings = []
+        for _ in range(repeat):
+            start = default_timer()
+            for _ in range(number):
+                operation()
+            timings.append((default_timer() - start) / number)
+    timings.sort()
+    return OrderedDict([
+        ("number", number),
+        ("repeat", repeat),
+        ("min", timings[0]),
+        ("median", timings[len(timings) // 2]),
+        ("max", timings[-1]),
+    ])
+
+
+def compare(results, baseline, threshold):
+    """
+    Compares the median of each benchmark to a baseline result
+    :return: Ratio to the baseline of each benchmark found in both, and the names of the regressed benchmarks
+    :rtype: tuple[dict[str, float], list[str]]
+    """
+    ratios = OrderedDict()
+    for name, result in results["benchmarks"].items():
+        baseline_result = baseline["benchmarks"].get(name)
+        if baseline_result:
+            ratios[name] = result["median"] / baseline_result["median"]
+    return ratios, [name for name, ratio in ratios.items() if ratio > threshold]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this string")
+    parser.add_argument("--repeat", type=int, default=5, help="number of measured rounds per benchmark")
+    parser.add_argument("--scale", type=float, default=1, help="factor applied to the operations per round")
+    parser.add_argument("--label", default="", help="label stored in the results, e.g. a version")
+    parser.add_argument("--output", help="file to write the json results to, standard output if not given")
+    parser.add_argument("--compare", help="json results of a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=1.2, help="ratio to the baseline considered a regression")
+    args = parser.parse_args(argv)
+
+    results = OrderedDict([
+        ("label", args.label),
+        ("timestamp", time()),
+        ("python", platform.python_version()),
+        ("platform", platform.platform()),
+        ("benchmarks", OrderedDict()),
+    ])
+    for name, (setup, number) in BENCHMARKS.items():
+        if args.filter in name:
+            sys.stderr.write("running {}\n".format(name))
+            results["benchmarks"][name] = run_benchmark(setup, max(1, int(number * args.scale)), args.repeat)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            ratios, regressed = compare(results, json.load(baseline_file), args.threshold)
+        results["comparison"] = OrderedDict([("baseline", args.compare), ("ratios", ratios), ("regressed", regressed)])
+
+    serialized = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(serialized + "\n")
+    else:
+        print(serialized)
+    return 1 if results.get("comparison", {}).get("regressed") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -22,6 +22,8 @@ setuptools.setup(
         'requests>=2.24; python_version > "3.0"',
     ],
     extras_require={
+        "async": ['aiohttp>=3.7; python_version > "3.0"'],
+        "msgpack": ["msgpack>=1.0"],
         "dev": [
             "mock==2.0.0",
             "requests-mock==1.9.3",
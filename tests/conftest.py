@@ -0,0 +1,4 @@
+import six
+
+# The asynchronous client relies on python 3 syntax
+collect_ignore = ["test_async_client.py"] if six.PY2 else []
@@ -0,0 +1,411 @@
+import gzip
+import hashlib
+import io
+import json
+import random
+import re
+from copy import deepcopy
+from threading import Lock, Thread
+from time import sleep
+
+import six
+from six.moves import BaseHTTPServer, queue, socketserver
+from six.moves.urllib.parse import parse_qs, unquote, urlparse
+
+from tonga.wire import msgpack
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def handle_error(self, request, client_address):
+        # Clients giving up on a slow response (timeouts) are expected, do not spam the output
+        pass
+
+
+class StandInTongaServer(object):
+    """
+    A minimal in-process HTTP server imitating the Tonga server endpoints, used by tests and benchmarks
+    """
+
+    def __init__(self, flags=None, latency=0, error_rate=0, seed=0, rules=None, compress=False):
+        """
+        :param flags: Nested flag tree as returned by the all_flags_values endpoint
+        :type flags: dict[str, Any]
+        :param rules: Optional flag rules document served by the flags_rules endpoint, when given flag values are
+        evaluated from the rules for the context of each request instead of taken from the flag tree
+        :type rules: dict[str, Any]
+        :param latency: Artificial latency in seconds added to each response
+        :type latency: float
+        :param error_rate: Fraction of requests answered with a 503 error
+        :type error_rate: float
+        :param seed: Seed of the random choice of failing requests, so runs are reproducible
+        :type seed: int
+        :param compress: Whether to gzip response bodies for clients accepting it
+        :type compress: bool
+        """
+        self.flags = flags or {}
+        self.rules = rules
+        self.latency = latency
+        self.error_rate = error_rate
+        self.compress = compress
+        self._random = random.Random(seed)
+        self.requests = []
+        self.connections = set()
+        self.bytes_sent = 0
+        # Flag stream state, each update bumps the version and is kept in the history so streams can resume
+        self.streaming = True
+        self.heartbeat_interval = 0.1
+        self.version = 0
+        self.stream_last_event_ids = []
+        self._history = []
+        self._streams = []
+        self._lock = Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return "http://{host}:{port}".format(host=host, port=port)
+
+    @property
+    def request_count(self):
+        return len(self.requests)
+
+    def start(self):
+        self._server = _ThreadingHTTPServer(("127.0.0.1", 0), self._build_handler())
+        self._thread = Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.disconnect_streams()
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def should_fail(self):
+        """
+        Decides whether to inject an error into the current request
+        :rtype: bool
+        """
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def find_flag(self, flag):
+        """
+        Resolves a dotted flag name against the nested flag tree
+        :return: Tuple of whether the flag exists and its value
+        :rtype: tuple[bool, Any]
+        """
+        node = self.flags
+        for part in flag.split("."):
+            if not isinstance(node, dict) or part not in node:
+                return False, None
+            node = node[part]
+        if isinstance(node, dict):
+            return False, None
+        return True, node
+
+    def filter_flags(self, flags, context=None):
+        """
+        Builds the nested flag tree containing only the given dotted flag names, evaluated from the rules for the given
+        context when rules are set
+        :rtype: dict[str, Any]
+        """
+        filtered = {}
+        for flag in flags:
+            if self.rules is not None:
+                found, value = self.evaluate_rules(flag, context or {})
+            else:
+                found, value = self.find_flag(flag)
+            if not found:
+                continue
+            parts = flag.split(".")
+            node = filtered
+            for part in parts[:-1]:
+                node = node.setdefault(part, {})
+            node[parts[-1]] = value
+        return filtered
+
+    def filter_prefixes(self, prefixes):
+        """
+        Builds the nested flag tree containing only the flags nested under the given dotted namespace prefixes
+        :rtype: dict[str, Any]
+        """
+        filtered = {}
+        for prefix in prefixes:
+            parts = prefix.split(".")
+            node = self.flags
+            for part in parts:
+                if not isinstance(node, dict) or part not in node:
+                    break
+                node = node[part]
+            else:
+                target = filtered
+                for part in parts[:-1]:
+                    target = target.setdefault(part, {})
+                target[parts[-1]] = node
+        return filtered
+
+    def push_update(self, set_flags=None, unset=None):
+        """
+        Changes the flag tree and pushes the diff to the open flag streams
+        :param set_flags: Nested tree of changed values merged into the flag tree
+        :type set_flags: dict[str, Any]
+        :param unset: Dotted names of removed flags (or flag subtrees)
+        :type unset: list[str]
+        """
+        diff = dict(set=set_flags or {}, unset=list(unset or ()))
+        with self._lock:
+            for name in diff["unset"]:
+                parts = name.split(".")
+                node = self.flags
+                for part in parts[:-1]:
+                    node = node.get(part, {})
+                node.pop(parts[-1], None)
+            _merge(self.flags, diff["set"])
+            self.version += 1
+            self._history.append((self.version, diff))
+            for stream in self._streams:
+                stream.put((self.version, "diff", diff))
+
+    def push_event(self, event_type, data):
+        """
+        Pushes an arbitrary event to the open flag streams without changing the flag tree
+        :param event_type: Event type
+        :type event_type: str
+        :param data: JSON serializable event payload
+        :type data: Any
+        """
+        with self._lock:
+            for stream in self._streams:
+                stream.put((self.version, event_type, data))
+
+    def disconnect_streams(self):
+        """
+        Ends all open flag streams
+        """
+        with self._lock:
+            for stream in self._streams:
+                stream.put(None)
+
+    def serve_stream(self, handler):
+        """
+        Serves the server-sent events flag stream, resuming from the Last-Event-ID header if possible and otherwise
+        starting with a snapshot of all flags. Events are written as separate chunks and heartbeats are sent while idle
+        :type handler: BaseHTTPServer.BaseHTTPRequestHandler
+        """
+        last_event_id = handler.headers.get("Last-Event-ID")
+        stream = queue.Queue()
+        with self._lock:
+            self.stream_last_event_ids.append(last_event_id)
+            if last_event_id is not None and last_event_id.isdigit() and int(last_event_id) <= self.version:
+                for version, diff in self._history[int(last_event_id):]:
+                    stream.put((version, "diff", diff))
+            else:
+                stream.put((self.version, "snapshot", deepcopy(self.flags)))
+            self._streams.append(stream)
+
+        handler.close_connection = True
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+        try:
+            while True:
+                try:
+                    event = stream.get(timeout=self.heartbeat_interval)
+                except queue.Empty:
+                    _write_chunk(handler, b": heartbeat\n\n")
+                    continue
+                if event is None:
+                    break
+                version, event_type, data = event
+                _write_chunk(handler, six.ensure_binary(
+                    u"id: {}\nevent: {}\ndata: {}\n\n".format(version, event_type, json.dumps(data))
+                ))
+            _write_chunk(handler, b"")
+        except EnvironmentError:
+            # The client went away
+            pass
+        finally:
+            with self._lock:
+                self._streams.remove(stream)
+
+    def etag(self, content=None):
+        """
+        Version marker of the given content, the current flag tree by default
+        :rtype: str
+        """
+        serialized = six.ensure_binary(json.dumps(self.flags if content is None else content, sort_keys=True))
+        return u'"{}"'.format(hashlib.sha1(serialized).hexdigest())
+
+    def evaluate_rules(self, flag, context):
+        """
+        Evaluates a flag from the rules document for a context, written as plainly as possible to serve as the reference
+        behaviour of local rule evaluation
+        :param context: Context attributes of the request
+        :type context: dict[str, str]
+        :return: Tuple of whether the flag is defined for the context and its value
+        :rtype: tuple[bool, Any]
+        """
+        definition = self.rules["flags"].get(flag)
+        if definition is None:
+            return False, None
+        for rule in definition.get("rules", []):
+            if all(_condition_matches(condition, context) for condition in rule.get("conditions", [])):
+                return True, rule.get("value")
+        return "value" in definition, definition.get("value")
+
+    def handle(self, path, query, headers):
+        """
+        Builds the response for a request
+        :return: Tuple of status code, response headers and json body
+        :rtype: tuple[int, dict[str, str], Any]
+        """
+        if path == "/all_flags_values":
+            if "flags" in query:
+                context = {key: values[0] for key, values in query.items() if key != "flags"}
+                return 200, {}, self.filter_flags(query["flags"], context)
+            if "prefix" in query:
+                return 200, {}, self.filter_prefixes(query["prefix"])
+            etag = self.etag()
+            if headers.get("If-None-Match") == etag:
+                return 304, {"ETag": etag}, None
+            return 200, {"ETag": etag}, self.flags
+        if path == "/flags_rules":
+            if self.rules is None:
+                return 404, {}, None
+            etag = self.etag(self.rules)
+            if headers.get("If-None-Match") == etag:
+                return 304, {"ETag": etag}, None
+            return 200, {"ETag": etag}, self.rules
+        if path.startswith("/flag_value/") and self.rules is not None:
+            context = {key: values[0] for key, values in query.items()}
+            found, value = self.evaluate_rules(unquote(path[len("/flag_value/"):]), context)
+            if not found:
+                return 404, {}, None
+            return 200, {}, dict(value=value)
+        if path.startswith("/flag_value/"):
+            found, value = self.find_flag(unquote(path[len("/flag_value/"):]))
+            if not found:
+                return 404, {}, None
+            return 200, {}, dict(value=value)
+        return 404, {}, None
+
+    def encode(self, body, headers):
+        """
+        Encodes a response body the way the request accepts it, msgpack if accepted (and installed) and otherwise json,
+        gzipped if enabled and accepted
+        :param body: Json body
+        :type body: Any
+        :param headers: Request headers
+        :return: Tuple of the payload and its content headers
+        :rtype: tuple[bytes, dict[str, str]]
+        """
+        if body is None:
+            return b"", {"Content-Type": "application/json"}
+        if msgpack is not None and "application/msgpack" in (headers.get("Accept") or ""):
+            payload, content_headers = msgpack.packb(body, use_bin_type=True), {"Content-Type": "application/msgpack"}
+        else:
+            payload, content_headers = six.ensure_binary(json.dumps(body)), {"Content-Type": "application/json"}
+        if self.compress and "gzip" in (headers.get("Accept-Encoding") or ""):
+            buffer = io.BytesIO()
+            with gzip.GzipFile(fileobj=buffer, mode="wb") as gzip_file:
+                gzip_file.write(payload)
+            payload = buffer.getvalue()
+            content_headers["Content-Encoding"] = "gzip"
+        return payload, content_headers
+
+    def _build_handler(self):
+        stand_in = self
+
+        class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately, avoid the delayed ack stall on kept alive connections
+            disable_nagle_algorithm = True
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                parsed = urlparse(self.path)
+                with stand_in._lock:  # pylint: disable=protected-access
+                    stand_in.requests.append(self.path)
+                    stand_in.connections.add(self.client_address)
+                if parsed.path == "/flags_stream" and stand_in.streaming:
+                    stand_in.serve_stream(self)
+                    return
+                if stand_in.latency:
+                    sleep(stand_in.latency)
+                if stand_in.should_fail():
+                    status, headers, body = 503, {}, None
+                else:
+                    status, headers, body = stand_in.handle(parsed.path, parse_qs(parsed.query), self.headers)
+                payload, content_headers = stand_in.encode(body, self.headers)
+                self.send_response(status)
+                for key, value in list(headers.items()) + list(content_headers.items()):
+                    self.send_header(key, value)
+                with stand_in._lock:  # pylint: disable=protected-access
+                    stand_in.bytes_sent += len(payload)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+        return _Handler
+
+
+def _condition_matches(condition, context):
+    """
+    Checks a single rule condition against a context
+    """
+    operator = condition.get("operator", "in")
+    operands = condition["values"] if "values" in condition else [condition.get("value")]
+    operands = [six.text_type(operand) for operand in operands]
+    value = context.get(condition["attribute"])
+    if value is None:
+        return operator == "not_in"
+    if operator == "in":
+        return value in operands
+    if operator == "not_in":
+        return value not in operands
+    if operator == "starts_with":
+        return any(value.startswith(operand) for operand in operands)
+    if operator == "matches":
+        return any(re.match(operand, value) for operand in operands)
+    try:
+        number, operand = float(value), float(operands[0])
+    except ValueError:
+        return False
+    return dict(lt=number < operand, lte=number <= operand, gt=number > operand, gte=number >= operand)[operator]
+
+
+def _merge(target, source):
+    """
+    Deep merges the source tree into the target tree
+    """
+    for key, value in source.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = deepcopy(value)
+
+
+def _write_chunk(handler, data):
+    """
+    Writes a single chunk of a chunked transfer encoded response, an empty chunk ends the response
+    """
+    handler.wfile.write(six.ensure_binary("{:X}\r\n".format(len(data))) + data + b"\r\n")
+    handler.wfile.flush()
@@ -0,0 +1,285 @@
+import asyncio
+import unittest
+from collections import Counter
+from time import time
+
+import requests
+import requests_mock
+from mock import Mock
+
+from tonga import (
+    AsyncTongaClient, AsyncTongaTransport, CircuitBreaker, FlagManifest, LocalFlagRules, RetryPolicy,
+    TongaClientOptions,
+)
+from tests.stand_in_server import StandInTongaServer
+
+try:
+    import aiohttp  # noqa: F401  pylint: disable=unused-import
+    from tonga import AiohttpTransport
+except ImportError:
+    AiohttpTransport = None
+
+
+class SlowCountingAsyncTransport(AsyncTongaTransport):
+    """
+    Responds after a non blocking delay, counting requests per path and optionally failing the first requests
+    """
+
+    def __init__(self, delay=0.05, failures=0):
+        self.delay = delay
+        self.failures = failures
+        self.calls = Counter()
+
+    async def get(self, url, headers, timeout=None):
+        path = url.split("?")[0]
+        self.calls[path] += 1
+        await asyncio.sleep(self.delay)
+        if self.failures:
+            self.failures -= 1
+            raise requests.exceptions.ConnectionError("error")
+        response = Mock()
+        response.status_code = 200
+        response.headers = {}
+        if path.endswith("/all_flags_values"):
+            response.json.return_value = dict(features=dict(flag1=True, flag2=2))
+        else:
+            response.json.return_value = dict(value=path.rsplit("/", 1)[-1])
+        return response
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+class TestAsyncClient(unittest.TestCase):
+    def setUp(self):
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        self.addCleanup(asyncio.get_event_loop().close)
+
+    @requests_mock.Mocker()
+    def test_get_and_cache(self, m):
+        server_url = "http://server_url"
+        m.get("{}/flag_value/flag_name?user=some+user1".format(server_url), json=dict(value=True))
+        m.get("{}/flag_value/missing".format(server_url), status_code=404)
+        client = AsyncTongaClient(server_url, context_attributes=dict(user="some user1"))
+        self.assertEqual(True, run(client.get("flag_name")))
+        self.assertEqual(True, run(client.get("flag_name")))
+        self.assertIsNone(run(client.get("missing")))
+        self.assertEqual(2, m.call_count)
+        self.assertDictEqual({"flag_name": True, "missing": None}, client.dump_state())
+
+    @requests_mock.Mocker()
+    def test_get_many(self, m):
+        server_url = "http://server_url"
+        m.get("{}/flag_value/flag_name1".format(server_url), json=dict(value=True))
+        m.get("{}/all_flags_values".format(server_url), json=dict(features=dict(flag_name2=2)))
+        client = AsyncTongaClient(server_url)
+        run(client.get("flag_name1"))
+        values = run(client.get_many(["flag_name1", "features.flag_name2", "missing"]))
+        self.assertDictEqual({"flag_name1": True, "features.flag_name2": 2, "missing": None}, values)
+        self.assertEqual(["features.flag_name2", "missing"], m.last_request.qs["flags"])
+        self.assertEqual(2, m.call_count)
+
+    @requests_mock.Mocker()
+    def test_pre_fetch(self, m):
+        server_url = "http://server_url"
+        m.get("{}/all_flags_values".format(server_url), json=dict(features=dict(flags=dict(name1=True), other="value")))
+        client = AsyncTongaClient(server_url, options=TongaClientOptions(pre_fetch=True))
+        self.assertEqual(True, run(client.get("features.flags.name1")))
+        self.assertEqual("value", run(client.get("features.other")))
+        self.assertIsNone(run(client.get("features.missing")))
+        all_flags = run(client.get_all_flags_from_server())
+        self.assertDictEqual({"features.flags.name1": True, "features.other": "value"}, all_flags)
+        self.assertEqual(2, m.call_count)
+
+    @requests_mock.Mocker()
+    def test_offline_mode_and_state(self, m):
+        client = AsyncTongaClient("http://server_url", options=TongaClientOptions(offline_mode=True))
+        self.assertEqual(False, run(client.get("flag_name", offline_value=False)))
+        client.set_state(dict(flag_name=True))
+        with client.with_state(dict(flag_name=1)):
+            self.assertEqual(1, run(client.get("flag_name")))
+        self.assertEqual(True, run(client.get("flag_name")))
+        values = run(client.get_many(["flag_name", "other"], offline_values=dict(other=2)))
+        self.assertDictEqual({"flag_name": True, "other": 2}, values)
+        self.assertFalse(m.called)
+
+    def test_concurrent_awaits_coalesced(self):
+        transport = SlowCountingAsyncTransport()
+        client = AsyncTongaClient("http://server_url", options=TongaClientOptions(async_transport=transport))
+
+        async def get_concurrently():
+            return await asyncio.gather(*[client.get("flag{}".format(index % 4)) for index in range(64)])
+
+        self.assertEqual(["flag{}".format(index % 4) for index in range(64)], run(get_concurrently()))
+        self.assertEqual(
+            Counter({"http://server_url/flag_value/flag{}".format(index): 1 for index in range(4)}), transport.calls
+        )
+
+    def test_concurrent_pre_fetch_coalesced(self):
+        transport = SlowCountingAsyncTransport()
+        options = TongaClientOptions(async_transport=transport, pre_fetch=True)
+        client = AsyncTongaClient("http://server_url", options=options)
+
+        async def get_concurrently():
+            return await asyncio.gather(*[client.get("features.flag{}".format(index % 3)) for index in range(64)])
+
+        self.assertEqual([[None, True, 2][index % 3] for index in range(64)], run(get_concurrently()))
+        self.assertEqual(Counter({"http://server_url/all_flags_values": 1}), transport.calls)
+
+    def test_retries_do_not_block_event_loop(self):
+        transport = SlowCountingAsyncTransport(delay=0, failures=3)
+        options = TongaClientOptions(async_transport=transport, retries=3, retry_delay=0.1)
+        client = AsyncTongaClient("http://server_url", options=options)
+        ticks = []
+
+        async def tick():
+            while len(ticks) < 20:
+                ticks.append(1)
+                await asyncio.sleep(0.01)
+
+        async def get_while_ticking():
+            ticker = asyncio.ensure_future(tick())
+            value = await client.get("flag_name")
+            ticker.cancel()
+            return value
+
+        self.assertEqual("flag_name", run(get_while_ticking()))
+        self.assertGreater(len(ticks), 10)
+        self.assertAlmostEqual(0.3, client.accumulated_latency, delta=0.1)
+
+    def test_retries_exhausted(self):
+        transport = SlowCountingAsyncTransport(delay=0, failures=3)
+        options = TongaClientOptions(async_transport=transport, retries=2, retry_delay=0.01)
+        client = AsyncTongaClient("http://server_url", options=options)
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            run(client.get("flag_name"))
+
+    def test_slow_attempt_times_out_at_deadline(self):
+        with StandInTongaServer(flags=dict(flag=True), latency=1) as server:
+            policy = RetryPolicy(retries=3, base_delay=0, jitter=0, deadline=0.3)
+            client = AsyncTongaClient(server.url, options=TongaClientOptions(retry_policy=policy))
+            start_time = time()
+            with self.assertRaises(requests.exceptions.Timeout):
+                run(client.get("flag"))
+            self.assertLess(time() - start_time, 0.5)
+
+    def test_open_circuit_breaker_fails_fast(self):
+        transport = SlowCountingAsyncTransport(delay=0, failures=1)
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        options = TongaClientOptions(async_transport=transport, retry_policy=RetryPolicy(retries=0),
+                                     circuit_breaker=breaker)
+        client = AsyncTongaClient("http://server_url", options=options)
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            run(client.get("flag1"))
+        self.assertEqual("offline", run(client.get("flag2", offline_value="offline")))
+        self.assertDictEqual({"flag3": 3}, run(client.get_many(["flag3"], dict(flag3=3))))
+        self.assertEqual(1, sum(transport.calls.values()))
+
+    def test_cancelled_probe_is_released(self):
+        transport = SlowCountingAsyncTransport(delay=0, failures=1)
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        options = TongaClientOptions(async_transport=transport, retry_policy=RetryPolicy(retries=0),
+                                     circuit_breaker=breaker)
+        client = AsyncTongaClient("http://server_url", options=options)
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            run(client.get_all_flags_from_server())
+        self.assertEqual(CircuitBreaker.OPEN, breaker.state)
+        run(asyncio.sleep(0.1))
+        transport.delay = 1
+        with self.assertRaises(asyncio.TimeoutError):
+            run(asyncio.wait_for(client.get_all_flags_from_server(), 0.05))
+        self.assertEqual(CircuitBreaker.HALF_OPEN, breaker.state)
+        self.assertTrue(breaker.allow_request())
+
+    def test_prefix_pre_fetch(self):
+        flags = dict(routing=dict(eu=dict(timeout=5), enabled=True), billing=dict(currency="EUR"))
+        with StandInTongaServer(flags=flags) as server:
+            client = AsyncTongaClient(server.url, options=TongaClientOptions(pre_fetch_prefix_depth=1))
+
+            async def fetch():
+                return await asyncio.gather(
+                    client.get("routing.eu.timeout"), client.get("routing.enabled"), client.get("routing.missing")
+                )
+
+            self.assertListEqual([5, True, None], run(fetch()))
+            self.assertEqual(1, server.request_count)
+            self.assertDictEqual({"billing.currency": "EUR"}, run(client.get_many(["billing.currency"])))
+            self.assertEqual(2, server.request_count)
+
+    def test_get_many_cache_ttl_expires(self):
+        with StandInTongaServer(flags=dict(a=1)) as server:
+            client = AsyncTongaClient(server.url, options=TongaClientOptions(cache_ttl=0.05))
+            self.assertDictEqual(dict(a=1), run(client.get_many(["a"])))
+            server.flags["a"] = 10
+            run(asyncio.sleep(0.06))
+            self.assertDictEqual(dict(a=10), run(client.get_many(["a"])))
+            self.assertEqual(2, server.request_count)
+
+    def test_negative_cache(self):
+        with StandInTongaServer() as server:
+            client = AsyncTongaClient(server.url, options=TongaClientOptions(negative_cache_ttl=0.05))
+            self.assertIsNone(run(client.get("new_flag")))
+            self.assertDictEqual({"new_flag": None}, run(client.get_many(["new_flag"])))
+            self.assertEqual(1, server.request_count)
+
+            server.flags["new_flag"] = True
+            run(asyncio.sleep(0.06))
+            self.assertEqual(True, run(client.get("new_flag")))
+            self.assertEqual(2, server.request_count)
+
+    def test_local_rules(self):
+        rules = {"flags": {"flag": {"value": 1, "rules": [
+            {"conditions": [{"attribute": "region", "values": ["eu"]}], "value": 2}
+        ]}}}
+        with StandInTongaServer(rules=rules) as server:
+            options = TongaClientOptions(local_rules=LocalFlagRules())
+            clients = [AsyncTongaClient(server.url, context_attributes=dict(region=region), options=options)
+                       for region in ("eu", "us")]
+
+            async def fetch():
+                return await asyncio.gather(*[client.get("flag") for client in clients])
+
+            self.assertListEqual([2, 1], run(fetch()))
+            self.assertDictEqual({"flag": 1, "missing": None}, run(clients[1].get_many(["flag", "missing"])))
+            self.assertEqual(1, server.request_count)
+
+    def test_warm_up(self):
+        flags = dict(routing=dict(eu=dict(timeout=5), enabled=True), billing=dict(currency="EUR"))
+        manifest = FlagManifest(flags=["billing.currency", "billing.missing"], prefixes=["routing"])
+        with StandInTongaServer(flags=flags) as server:
+            client = AsyncTongaClient(server.url, options=TongaClientOptions(manifest=manifest))
+            report = run(client.warm_up())
+            self.assertTrue(report.complete)
+            self.assertListEqual(["billing.missing"], report.missing_flags)
+            self.assertEqual(2, server.request_count)
+            self.assertEqual(5, run(client.get("routing.eu.timeout")))
+            self.assertEqual(2, server.request_count)
+            run(client.get("search.boost"))
+        self.assertDictEqual({"search.boost": 1}, manifest.undeclared_reads)
+
+    def test_warm_up_empty_manifest(self):
+        client = AsyncTongaClient("http://server_url")
+        self.assertTrue(run(client.warm_up(FlagManifest())).complete)
+        with self.assertRaises(ValueError):
+            run(client.warm_up())
+
+    @unittest.skipIf(AiohttpTransport is None, "aiohttp is not installed")
+    def test_aiohttp_transport(self):
+        with StandInTongaServer(flags=dict(features=dict(flag1=True, flag2=2))) as server:
+            transport = AiohttpTransport()
+            options = TongaClientOptions(async_transport=transport)
+            client = AsyncTongaClient(server.url, options=options)
+
+            async def fetch():
+                values = await client.get_many(["features.flag1", "features.flag2"])
+                missing = await client.get("features.missing")
+                await transport.close()
+                return values, missing
+
+            self.assertEqual(({"features.flag1": True, "features.flag2": 2}, None), run(fetch()))
+        self.assertEqual(1, len(server.connections))
+
+
+if __name__ == "__main__":
+    unittest.main()
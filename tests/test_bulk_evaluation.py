@@ -0,0 +1,100 @@
+import unittest
+
+from mock import patch
+
+from tonga import TongaClient, TongaClientOptions, LocalFlagRules, SharedFlagCache
+from tests.stand_in_server import StandInTongaServer
+
+RULES = {
+    "flags": {
+        "routing.timeout": {
+            "value": 5,
+            "rules": [{"conditions": [{"attribute": "region", "values": ["eu"]}], "value": 7}],
+        },
+        "routing.enabled": {
+            "value": False,
+            "rules": [{"conditions": [{"attribute": "vehicle", "operator": "starts_with", "value": "bus"}],
+                       "value": True}],
+        },
+    },
+}
+
+
+def vehicle_contexts(count):
+    for index in range(count):
+        yield dict(vehicle="bus-{}".format(index % 3), region="eu" if index % 2 else "us")
+
+
+class TestBulkEvaluation(unittest.TestCase):
+    def test_values_streamed_in_order(self):
+        with StandInTongaServer(rules=RULES) as server:
+            client = TongaClient(server.url)
+            contexts = list(vehicle_contexts(20))
+            results = list(client.get_many_for_contexts(["routing.timeout", "routing.enabled"], contexts, batch_size=7))
+            self.assertListEqual(contexts, [context for context, _ in results])
+            for context, values in results:
+                expected_timeout = 7 if context["region"] == "eu" else 5
+                self.assertDictEqual({"routing.timeout": expected_timeout, "routing.enabled": True}, values)
+            # Identical contexts are resolved once, across batches as well
+            self.assertEqual(6, server.request_count)
+
+    def test_contexts_read_lazily(self):
+        read = []
+
+        def contexts():
+            for context in vehicle_contexts(10):
+                read.append(context)
+                yield context
+
+        with StandInTongaServer(rules=RULES) as server:
+            results = TongaClient(server.url).get_for_contexts("routing.timeout", contexts(), batch_size=4)
+            self.assertEqual(5, next(results)[1])
+            self.assertEqual(4, len(read))
+            self.assertListEqual([7, 5, 7, 5, 7, 5, 7, 5, 7], [value for _, value in results])
+            self.assertEqual(10, len(read))
+
+    def test_contexts_merged_over_client_context(self):
+        with StandInTongaServer(rules=RULES) as server:
+            client = TongaClient(server.url, context_attributes=dict(region="eu", vehicle="car"))
+            results = list(client.get_for_contexts("routing.enabled", [{}, dict(vehicle="bus-1"), dict(region="us")]))
+            self.assertListEqual([False, True, False], [value for _, value in results])
+            self.assertEqual(3, server.request_count)
+            # The client itself is unaffected
+            self.assertDictEqual(dict(region="eu", vehicle="car"), dict(client.context_attributes))
+            self.assertDictEqual({}, client.dump_state())
+
+    def test_worker_pool(self):
+        with StandInTongaServer(rules=RULES, latency=0.01) as server:
+            client = TongaClient(server.url, options=TongaClientOptions(cache_ttl=60, background_refresh=True))
+            self.addCleanup(client.close)
+            contexts = [dict(vehicle="car-{}".format(index)) for index in range(40)]
+            results = client.get_for_contexts("routing.enabled", contexts, batch_size=20, max_workers=8)
+            self.assertListEqual([False] * 40, [value for _, value in results])
+            self.assertEqual(40, server.request_count)
+            # Contexts were resolved concurrently over several pooled connections
+            self.assertGreater(len(server.connections), 1)
+
+    def test_local_rules(self):
+        with StandInTongaServer(rules=RULES) as server:
+            client = TongaClient(server.url, options=TongaClientOptions(local_rules=LocalFlagRules()))
+            results = list(client.get_for_contexts("routing.timeout", vehicle_contexts(1000), max_workers=4))
+            self.assertListEqual([5, 7] * 500, [value for _, value in results])
+            self.assertEqual(1, server.request_count)
+
+    def test_resolved_contexts_bounded(self):
+        with StandInTongaServer(rules=RULES) as server:
+            shared_cache = SharedFlagCache()
+            client = TongaClient(server.url, options=TongaClientOptions(shared_cache=shared_cache))
+            contexts = [dict(vehicle=vehicle) for vehicle in ["a", "b", "c", "a", "b", "c"]]
+            with patch("tonga.client._MAX_RESOLVED_CONTEXTS", 2):
+                results = list(client.get_for_contexts("routing.timeout", contexts, batch_size=3))
+            self.assertListEqual([5] * 6, [value for _, value in results])
+            # Only the least recently seen context was evicted after the first batch
+            self.assertEqual(4, server.request_count)
+            # Per context values are kept out of the shared cache of the client
+            self.assertEqual(0, len(shared_cache))
+
+    def test_offline_mode(self):
+        client = TongaClient("http://server_url", options=TongaClientOptions(offline_mode=True))
+        results = client.get_for_contexts("flag", vehicle_contexts(3), offline_value="offline")
+        self.assertListEqual(["offline"] * 3, [value for _, value in results])
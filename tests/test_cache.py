@@ -0,0 +1,106 @@
+import unittest
+from time import sleep
+
+import requests_mock
+
+from tonga import SharedFlagCache, TongaClient, TongaClientOptions
+
+
+class TestSharedFlagCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = SharedFlagCache(max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(1, cache.get("a"))
+        cache.set("c", 3)
+        self.assertEqual(2, len(cache))
+        self.assertEqual(1, cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(3, cache.get("c"))
+
+    def test_ttl_eviction(self):
+        cache = SharedFlagCache(ttl=0.05)
+        cache.set("a", None)
+        self.assertIsNone(cache.get("a", default=1))
+        sleep(0.06)
+        self.assertEqual(1, cache.get("a", default=1))
+        self.assertEqual(0, len(cache))
+
+    @requests_mock.Mocker()
+    def test_clients_with_same_context_share_values(self, m):
+        server_url = "http://server_url"
+        m.get("{}/flag_value/flag_name?user=user1&team=1".format(server_url), json=dict(value=True))
+        m.get("{}/flag_value/flag_name?user=user2&team=1".format(server_url), json=dict(value=False))
+        options = TongaClientOptions(shared_cache=SharedFlagCache())
+
+        def get_flag(context_attributes):
+            return TongaClient(server_url, context_attributes, options=options).get("flag_name")
+
+        for _ in range(3):
+            # Attribute order does not affect the shared key
+            self.assertEqual(True, get_flag(dict(user="user1", team=1)))
+            self.assertEqual(True, get_flag(dict(team=1, user="user1")))
+            self.assertEqual(False, get_flag(dict(user="user2", team=1)))
+        self.assertEqual(2, m.call_count)
+
+    @requests_mock.Mocker()
+    def test_get_many_uses_shared_values(self, m):
+        server_url = "http://server_url"
+        m.get("{}/flag_value/flag_name1".format(server_url), json=dict(value=True))
+        m.get("{}/all_flags_values".format(server_url), json=dict(flag_name2=2))
+        options = TongaClientOptions(shared_cache=SharedFlagCache())
+        TongaClient(server_url, options=options).get("flag_name1")
+        client = TongaClient(server_url, options=options)
+        self.assertDictEqual({"flag_name1": True, "flag_name2": 2}, client.get_many(["flag_name1", "flag_name2"]))
+        self.assertEqual(["flag_name2"], m.last_request.qs["flags"])
+        client = TongaClient(server_url, options=options)
+        self.assertDictEqual({"flag_name1": True, "flag_name2": 2}, client.get_many(["flag_name1", "flag_name2"]))
+        self.assertEqual(2, m.call_count)
+
+    @requests_mock.Mocker()
+    def test_pre_fetch_shared_between_clients(self, m):
+        server_url = "http://server_url"
+        m.get("{}/all_flags_values?user=user1".format(server_url), json=dict(features=dict(name1=True, name2=2)))
+        options = TongaClientOptions(pre_fetch=True, shared_cache=SharedFlagCache())
+        for _ in range(3):
+            client = TongaClient(server_url, dict(user="user1"), options=options)
+            self.assertEqual(True, client.get("features.name1"))
+            self.assertEqual(2, client.get("features.name2"))
+            self.assertIsNone(client.get("features.name3"))
+        self.assertEqual(1, m.call_count)
+
+    @requests_mock.Mocker()
+    def test_shared_values_respect_client_ttl(self, m):
+        server_url = "http://server_url"
+        m.get("{}/flag_value/flag_name".format(server_url), [dict(json=dict(value=1)), dict(json=dict(value=2))])
+        m.get("{}/all_flags_values".format(server_url), [dict(json=dict(flag_name=3))])
+        options = TongaClientOptions(cache_ttl=0.05, shared_cache=SharedFlagCache())
+        client = TongaClient(server_url, options=options)
+        self.assertEqual(1, client.get("flag_name"))
+        self.assertEqual(1, TongaClient(server_url, options=options).get("flag_name"))
+        self.assertEqual(1, m.call_count)
+        sleep(0.06)
+        self.assertEqual(2, client.get("flag_name"))
+        sleep(0.06)
+        self.assertDictEqual({"flag_name": 3}, TongaClient(server_url, options=options).get_many(["flag_name"]))
+        self.assertEqual(3, m.call_count)
+
+    @requests_mock.Mocker()
+    def test_shared_pre_fetch_respects_client_ttl(self, m):
+        server_url = "http://server_url"
+        m.get("{}/all_flags_values".format(server_url), [dict(json=dict(name=1)), dict(json=dict(name=2))])
+        options = TongaClientOptions(pre_fetch=True, cache_ttl=0.05, shared_cache=SharedFlagCache())
+        self.assertEqual(1, TongaClient(server_url, options=options).get("name"))
+        sleep(0.06)
+        self.assertEqual(2, TongaClient(server_url, options=options).get("name"))
+        self.assertEqual(2, m.call_count)
+
+    def test_query_string_normalized(self):
+        client = TongaClient("http://server_url", dict(user="some user", attribute=2))
+        self.assertEqual("?attribute=2&user=some+user", client._build_query_string())
+        client.context_attributes = dict(other=1)
+        self.assertEqual("?other=1&flags=a", client._build_query_string(extra_params=[("flags", "a")]))
+
+
+if __name__ == "__main__":
+    unittest.main()
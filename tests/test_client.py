@@ -1,6 +1,8 @@
 # coding=utf-8
 
 import unittest
+from time import sleep
+
 from mock import patch, Mock
 
 import requests_mock
@@ -8,6 +10,7 @@ import requests
 import six
 
 from tonga import TongaClient, TongaClientOptions
+from tests.stand_in_server import StandInTongaServer
 
 
 class TestClient(unittest.TestCase):
@@ -159,6 +162,32 @@ class TestClient(unittest.TestCase):
 
         self.assertEqual(2, client.get("flag_name2"))
 
+    def test_nested_with_state(self):
+        client = TongaClient("http://server_url", options=TongaClientOptions(offline_mode=True))
+        client.set_state(dict(flag_name1=1, flag_name2=2))
+        with client.with_state(dict(flag_name1=10)):
+            with client.with_state(dict(flag_name2=20)):
+                self.assertIsNone(client.get("flag_name1"))
+                self.assertEqual(20, client.get("flag_name2"))
+            self.assertEqual(10, client.get("flag_name1"))
+            self.assertIsNone(client.get("flag_name2"))
+            client.update_state(dict(flag_name2=200))
+        self.assertDictEqual(dict(flag_name1=1, flag_name2=2), client.dump_state())
+
+    def test_state_values_are_not_copied(self):
+        client = TongaClient("http://server_url", options=TongaClientOptions(offline_mode=True))
+        value = dict(nested=list(range(1000)))
+        client.set_state(dict(flag_name=value))
+        cache = client._flag_cache
+        self.assertIs(value, client.get("flag_name"))
+        self.assertIs(value, client.dump_state()["flag_name"])
+        with client.with_state(dict(flag_name=1)):
+            self.assertEqual(1, client.get("flag_name"))
+        self.assertIs(cache, client._flag_cache)
+        # The dump itself is detached from the cache
+        client.dump_state()["flag_name"] = 1
+        self.assertIs(value, client.get("flag_name"))
+
     @requests_mock.Mocker()
     def test_with_unicode_header_value(self, m):
         server_url = "http://server_url"
@@ -187,6 +216,191 @@ class TestClient(unittest.TestCase):
         self.assertNotIn("X-Tonga-attr1", m.last_request.headers)
         self.assertEqual("val2", m.last_request.headers["X-Tonga-attr2"])
 
+    @requests_mock.Mocker()
+    def test_changed_attributes_are_sent(self, m):
+        server_url = "http://server_url"
+        m.get("{}/flag_value/flag_name?user=user1".format(server_url), json=dict(value=1))
+        m.get("{}/flag_value/flag_name?user=user2".format(server_url), json=dict(value=2))
+        client = TongaClient(server_url, context_attributes=dict(user="user1"), request_attributes=dict(attr1="val1"))
+        self.assertEqual(1, client.get("flag_name"))
+        client.clear_state()
+        client.context_attributes = dict(user="user2")
+        client.request_attributes = dict(attr2="val2")
+        self.assertEqual(2, client.get("flag_name"))
+        self.assertNotIn("X-Tonga-attr1", m.last_request.headers)
+        self.assertEqual("val2", m.last_request.headers["X-Tonga-attr2"])
+        # Callers extending the built headers do not affect later requests
+        client._build_headers()["If-None-Match"] = "etag"  # pylint: disable=protected-access
+        self.assertNotIn("If-None-Match", client._build_headers())  # pylint: disable=protected-access
+
+    @requests_mock.Mocker()
+    def test_attributes_are_copied_and_read_only(self, m):
+        server_url = "http://server_url"
+        m.get("{}/flag_value/flag_name?user=user1".format(server_url), json=dict(value=1))
+        context_attributes = dict(user="user1")
+        request_attributes = dict(attr1="val1")
+        client = TongaClient(server_url, context_attributes, request_attributes)
+        context_attributes["user"] = "user2"
+        request_attributes["attr1"] = "val2"
+        self.assertEqual(1, client.get("flag_name"))
+        self.assertEqual("val1", m.last_request.headers["X-Tonga-attr1"])
+        self.assertDictEqual(dict(user="user1"), dict(client.context_attributes))
+        if six.PY3:
+            with self.assertRaises(TypeError):
+                client.context_attributes["user"] = "user2"
+            with self.assertRaises(TypeError):
+                client.request_attributes["attr1"] = "val2"
+
+    @requests_mock.Mocker()
+    def test_flag_names_are_escaped(self, m):
+        server_url = "http://server_url"
+        m.get("{}/flag_value/team%2Frouting%20v2%3F?user=user1".format(server_url), json=dict(value=True))
+        client = TongaClient(server_url, context_attributes=dict(user="user1"))
+        self.assertEqual(True, client.get("team/routing v2?"))
+        self.assertEqual(True, client.get("team/routing v2?"))
+        self.assertEqual(1, m.call_count)
+
+    @requests_mock.Mocker()
+    def test_get_many_single_request(self, m):
+        server_url = "http://server_url"
+        m.get(
+            "{}/all_flags_values?user=some+user1".format(server_url),
+            json=dict(features=dict(flags=dict(name1=True, name2=2)), other="value"),
+        )
+        client = TongaClient(server_url, context_attributes=dict(user="some user1"))
+        values = client.get_many(["features.flags.name1", "features.flags.name2", "missing", "features.flags.name1"])
+        self.assertDictEqual({"features.flags.name1": True, "features.flags.name2": 2, "missing": None}, values)
+        self.assertEqual(1, m.call_count)
+        self.assertEqual(
+            ["features.flags.name1", "features.flags.name2", "missing"], m.last_request.qs["flags"]
+        )
+        # Only the requested flags are cached even if the server returned more
+        self.assertDictEqual(
+            {"features.flags.name1": True, "features.flags.name2": 2, "missing": None}, client.dump_state()
+        )
+
+    @requests_mock.Mocker()
+    def test_get_many_skips_cached_flags(self, m):
+        server_url = "http://server_url"
+        m.get("{}/flag_value/flag_name1".format(server_url), json=dict(value=True))
+        m.get("{}/all_flags_values".format(server_url), json=dict(flag_name2=2))
+        client = TongaClient(server_url)
+        client.get("flag_name1")
+        self.assertDictEqual({"flag_name1": True, "flag_name2": 2}, client.get_many(["flag_name1", "flag_name2"]))
+        self.assertEqual(["flag_name2"], m.last_request.qs["flags"])
+        self.assertDictEqual({"flag_name1": True, "flag_name2": 2}, client.get_many(["flag_name1", "flag_name2"]))
+        self.assertEqual(2, m.call_count)
+
+    @requests_mock.Mocker()
+    def test_get_many_pre_fetch(self, m):
+        server_url = "http://server_url"
+        m.get("{}/all_flags_values".format(server_url), json=dict(flag_name1=True, flag_name2=2))
+        client = TongaClient(server_url, options=TongaClientOptions(pre_fetch=True))
+        self.assertDictEqual({"flag_name1": True, "missing": None}, client.get_many(["flag_name1", "missing"]))
+        self.assertEqual(2, client.get("flag_name2"))
+        self.assertEqual(1, m.call_count)
+        self.assertNotIn("flags", m.last_request.qs)
+
+    @requests_mock.Mocker()
+    def test_get_many_offline_mode(self, m):
+        client = TongaClient("http://server_url", options=TongaClientOptions(offline_mode=True))
+        client.update_state(dict(flag_name1=True))
+        values = client.get_many(["flag_name1", "flag_name2"], offline_values=dict(flag_name1=False, flag_name2=2))
+        self.assertDictEqual({"flag_name1": True, "flag_name2": 2}, values)
+        self.assertFalse(m.called)
+
+    @requests_mock.Mocker()
+    def test_cache_ttl_expires(self, m):
+        server_url = "http://server_url"
+        m.get("{}/flag_value/flag_name".format(server_url), [dict(json=dict(value=True)), dict(json=dict(value=False))])
+        client = TongaClient(server_url, options=TongaClientOptions(cache_ttl=0.05))
+        self.assertEqual(True, client.get("flag_name"))
+        self.assertEqual(True, client.get("flag_name"))
+        self.assertEqual(1, m.call_count)
+        sleep(0.06)
+        self.assertEqual(False, client.get("flag_name"))
+        self.assertEqual(2, m.call_count)
+
+    @requests_mock.Mocker()
+    def test_get_many_cache_ttl_expires(self, m):
+        server_url = "http://server_url"
+        m.get("{}/all_flags_values".format(server_url), [dict(json=dict(a=1, b=2)), dict(json=dict(a=10, b=20))])
+        client = TongaClient(server_url, options=TongaClientOptions(cache_ttl=0.05))
+        self.assertDictEqual(dict(a=1, b=2), client.get_many(["a", "b"]))
+        self.assertDictEqual(dict(a=1, b=2), client.get_many(["a", "b"]))
+        self.assertEqual(1, m.call_count)
+        sleep(0.06)
+        self.assertDictEqual(dict(a=10, b=20), client.get_many(["a", "b"]))
+        self.assertEqual(2, m.call_count)
+
+    @requests_mock.Mocker()
+    def test_pre_fetch_get_many_cache_ttl_expires(self, m):
+        server_url = "http://server_url"
+        m.get("{}/all_flags_values".format(server_url), [dict(json=dict(a=1)), dict(json=dict(a=10))])
+        client = TongaClient(server_url, options=TongaClientOptions(pre_fetch=True, cache_ttl=0.05))
+        self.assertDictEqual(dict(a=1), client.get_many(["a"]))
+        sleep(0.06)
+        self.assertDictEqual(dict(a=10), client.get_many(["a"]))
+        self.assertEqual(2, m.call_count)
+
+    @requests_mock.Mocker()
+    def test_flag_ttls_override_cache_ttl(self, m):
+        server_url = "http://server_url"
+        m.get("{}/flag_value/flag_name1".format(server_url), json=dict(value=True))
+        m.get("{}/flag_value/flag_name2".format(server_url), json=dict(value=2))
+        client = TongaClient(server_url, options=TongaClientOptions(flag_ttls=dict(flag_name1=0)))
+        for _ in range(3):
+            self.assertEqual(True, client.get("flag_name1"))
+            self.assertEqual(2, client.get("flag_name2"))
+        self.assertEqual(4, m.call_count)
+
+    def test_pre_fetch_flag_ttls(self):
+        for cache_ttl in (None, 60):
+            with StandInTongaServer(flags=dict(a=1, b=2)) as server:
+                options = TongaClientOptions(pre_fetch=True, cache_ttl=cache_ttl, flag_ttls={"a": 0.05})
+                client = TongaClient(server.url, options=options)
+                self.assertEqual(1, client.get("a"))
+                server.flags["a"] = 10
+                sleep(0.06)
+                self.assertEqual(10, client.get("a"))
+                self.assertEqual(2, client.get("b"))
+                self.assertEqual(2, server.request_count)
+
+    @requests_mock.Mocker()
+    def test_pre_fetch_cache_ttl_expires(self, m):
+        server_url = "http://server_url"
+        m.get("{}/all_flags_values".format(server_url), [dict(json=dict(name1=True)), dict(json=dict(name2=2))])
+        client = TongaClient(server_url, options=TongaClientOptions(pre_fetch=True, cache_ttl=0.05))
+        self.assertEqual(True, client.get("name1"))
+        self.assertIsNone(client.get("name2"))
+        self.assertEqual(1, m.call_count)
+        sleep(0.06)
+        self.assertEqual(2, client.get("name2"))
+        self.assertEqual(2, m.call_count)
+
+    @requests_mock.Mocker()
+    def test_pre_fetch_after_clear_state(self, m):
+        server_url = "http://server_url"
+        m.get("{}/all_flags_values".format(server_url), [dict(json=dict(name1=True)), dict(json=dict(name1=False))])
+        client = TongaClient(server_url, options=TongaClientOptions(pre_fetch=True))
+        self.assertEqual(True, client.get("name1"))
+        client.clear_state()
+        self.assertEqual(False, client.get("name1"))
+        self.assertEqual(2, m.call_count)
+
+    @requests_mock.Mocker()
+    def test_with_state_keeps_ttl(self, m):
+        server_url = "http://server_url"
+        m.get("{}/flag_value/flag_name".format(server_url), [dict(json=dict(value=True)), dict(json=dict(value=False))])
+        client = TongaClient(server_url, options=TongaClientOptions(cache_ttl=0.05))
+        client.get("flag_name")
+        with client.with_state(dict(flag_name=1)):
+            sleep(0.06)
+            # Explicitly set state never expires
+            self.assertEqual(1, client.get("flag_name"))
+        self.assertEqual(False, client.get("flag_name"))
+        self.assertEqual(2, m.call_count)
+
     def test_retry_upon_get_exception(self):
         server_url = "http://server_url"
         good_response = Mock()
@@ -194,7 +408,7 @@ class TestClient(unittest.TestCase):
         good_response.json.return_value = dict(value=True)
         # Raise error 5 times, retry is set to 5 so it should work
         with patch(
-            "tonga.client.requests.get",
+            "tonga.transport.requests.Session.get",
             side_effect=[requests.exceptions.ConnectionError("error")] * 5 + [good_response],
         ):
             client = TongaClient(server_url, options=TongaClientOptions(retry_delay=0.1, retries=5))
@@ -204,7 +418,7 @@ class TestClient(unittest.TestCase):
 
         # Raise error 5 times, retry is set to 4 so it should fail
         with patch(
-            "tonga.client.requests.get",
+            "tonga.transport.requests.Session.get",
             side_effect=[requests.exceptions.ConnectionError("error")] * 5 + [good_response],
         ):
             client = TongaClient(server_url, options=TongaClientOptions(retry_delay=0.1, retries=4))
@@ -221,13 +435,13 @@ class TestClient(unittest.TestCase):
         good_response.status_code = 200
         good_response.json.return_value = dict(value=True)
         # Raise error 5 times, retry is set to 5 so it should work
-        with patch("tonga.client.requests.get", side_effect=[error_response] * 5 + [good_response]):
+        with patch("tonga.transport.requests.Session.get", side_effect=[error_response] * 5 + [good_response]):
             client = TongaClient(server_url, options=TongaClientOptions(retry_delay=0.01, retries=5))
             flag_value = client.get("flag_name")
             self.assertEqual(True, flag_value)
 
         # Raise error 5 times, retry is set to 4 so it should fail
-        with patch("tonga.client.requests.get", side_effect=[error_response] * 5 + [good_response]):
+        with patch("tonga.transport.requests.Session.get", side_effect=[error_response] * 5 + [good_response]):
             client = TongaClient(server_url, options=TongaClientOptions(retry_delay=0.01, retries=4))
             with self.assertRaises(requests.exceptions.ConnectionError):
                 client.get("flag_name")
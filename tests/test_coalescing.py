@@ -0,0 +1,115 @@
+import unittest
+from collections import Counter
+from threading import Event, Lock, Thread
+from time import sleep
+
+from mock import Mock
+
+from tonga import TongaClient, TongaClientOptions, TongaTransport
+from tonga.coalescing import SingleFlight
+
+THREADS = 64
+
+
+class SlowCountingTransport(TongaTransport):
+    """
+    Responds to every request after a delay, counting requests per path
+    """
+
+    def __init__(self, delay=0.1):
+        self.delay = delay
+        self.calls = Counter()
+        self._lock = Lock()
+
+    def get(self, url, headers, timeout=None):
+        path = url.split("?")[0]
+        with self._lock:
+            self.calls[path] += 1
+        sleep(self.delay)
+        response = Mock()
+        response.status_code = 200
+        response.headers = {}
+        if path.endswith("/all_flags_values"):
+            response.json.return_value = dict(features=dict(flag1=True, flag2=2))
+        else:
+            response.json.return_value = dict(value=path.rsplit("/", 1)[-1])
+        return response
+
+
+def run_concurrently(func, threads=THREADS):
+    """
+    Runs the given function in many threads released at the same moment, returns the results of all threads
+    """
+    start = Event()
+    results = [None] * threads
+
+    def run(index):
+        start.wait()
+        results[index] = func(index)
+
+    workers = [Thread(target=run, args=(index,)) for index in range(threads)]
+    for worker in workers:
+        worker.start()
+    start.set()
+    for worker in workers:
+        worker.join()
+    return results
+
+
+class TestCoalescing(unittest.TestCase):
+    def test_single_flight_shares_result(self):
+        single_flight = SingleFlight()
+        calls = []
+
+        def slow_call():
+            calls.append(1)
+            sleep(0.1)
+            return "result"
+
+        results = run_concurrently(lambda _: single_flight.do("key", slow_call))
+        self.assertEqual(["result"] * THREADS, results)
+        self.assertEqual(1, len(calls))
+
+    def test_single_flight_shares_error(self):
+        single_flight = SingleFlight()
+
+        def failing_call():
+            sleep(0.1)
+            raise ValueError("error")
+
+        def call(_):
+            try:
+                single_flight.do("key", failing_call)
+            except ValueError as ex:
+                return str(ex)
+
+        self.assertEqual(["error"] * THREADS, run_concurrently(call))
+
+    def test_concurrent_get_single_server_call_per_flag(self):
+        transport = SlowCountingTransport()
+        client = TongaClient("http://server_url", options=TongaClientOptions(transport=transport))
+        results = run_concurrently(lambda index: client.get("flag{}".format(index % 4)))
+        self.assertEqual(["flag{}".format(index % 4) for index in range(THREADS)], results)
+        self.assertEqual(
+            Counter({"http://server_url/flag_value/flag{}".format(index): 1 for index in range(4)}), transport.calls
+        )
+
+    def test_concurrent_pre_fetch_single_server_call(self):
+        transport = SlowCountingTransport()
+        options = TongaClientOptions(transport=transport, pre_fetch=True)
+        client = TongaClient("http://server_url", options=options)
+        flags = ["features.flag1", "features.flag2", "features.missing"]
+        results = run_concurrently(lambda index: client.get(flags[index % 3]))
+        self.assertEqual([[True, 2, None][index % 3] for index in range(THREADS)], results)
+        self.assertEqual(Counter({"http://server_url/all_flags_values": 1}), transport.calls)
+
+    def test_concurrent_get_many_single_server_call(self):
+        transport = SlowCountingTransport()
+        client = TongaClient("http://server_url", options=TongaClientOptions(transport=transport))
+        results = run_concurrently(lambda _: client.get_many(["features.flag1", "features.flag2"]))
+        self.assertEqual([{"features.flag1": True, "features.flag2": 2}] * THREADS, results)
+        self.assertEqual(Counter({"http://server_url/all_flags_values": 1}), transport.calls)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+from time import sleep, time
+
+from mock import patch
+
+from tonga import TongaClient, TongaClientOptions
+from tonga.wire import decode_flat_tree
+from tests.stand_in_server import StandInTongaServer
+
+
+class DecodeRecorder(object):
+    """
+    Wraps the decoding of all flags responses to record how many times and for how long responses were parsed
+    """
+
+    def __init__(self):
+        self.parse_times = []
+
+    def __call__(self, response):
+        start = time()
+        try:
+            return decode_flat_tree(response)
+        finally:
+            self.parse_times.append(time() - start)
+
+
+class TestConditionalFetch(unittest.TestCase):
+    def setUp(self):
+        self.recorder = DecodeRecorder()
+        patcher = patch("tonga.client.decode_flat_tree", side_effect=self.recorder)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_unchanged_refresh_skips_transfer_and_parse(self):
+        flags = {"ns{}".format(i): {"flag{}".format(j): j for j in range(50)} for i in range(20)}
+        with StandInTongaServer(flags=flags) as server:
+            client = TongaClient(server.url, options=TongaClientOptions(pre_fetch=True, cache_ttl=0.05))
+            self.assertEqual(3, client.get("ns1.flag3"))
+            full_response_bytes = server.bytes_sent
+            self.assertGreater(full_response_bytes, 0)
+            self.assertEqual(1, len(self.recorder.parse_times))
+
+            sleep(0.06)
+            self.assertEqual(4, client.get("ns1.flag4"))
+            self.assertEqual(2, server.request_count)
+            self.assertEqual(full_response_bytes, server.bytes_sent)
+            self.assertEqual(1, len(self.recorder.parse_times))
+            # Expiration was extended, no further requests until the ttl passes again
+            self.assertEqual(5, client.get("ns1.flag5"))
+            self.assertEqual(2, server.request_count)
+
+            server.flags["ns1"]["flag4"] = -4
+            sleep(0.06)
+            self.assertEqual(-4, client.get("ns1.flag4"))
+            self.assertEqual(3, server.request_count)
+            self.assertGreater(server.bytes_sent, full_response_bytes)
+            self.assertEqual(2, len(self.recorder.parse_times))
+
+    def test_clear_state_fetches_unconditionally(self):
+        with StandInTongaServer(flags=dict(a=dict(b=1))) as server:
+            client = TongaClient(server.url, options=TongaClientOptions(pre_fetch=True))
+            self.assertEqual(1, client.get("a.b"))
+            client.clear_state()
+            self.assertEqual(1, client.get("a.b"))
+            self.assertEqual(2, len(self.recorder.parse_times))
+            self.assertEqual(2, server.request_count)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from time import sleep
+
+from mock import patch
+
+from tonga import TongaClient, TongaClientOptions, FlagManifest, LocalFlagRules, RetryPolicy
+from tests.stand_in_server import StandInTongaServer
+
+FLAGS = dict(
+    routing=dict(eu=dict(timeout=5, retries=2), enabled=True),
+    billing=dict(currency="EUR", limit=None),
+    search=dict(boost=1.5),
+)
+
+
+class TestFlagManifest(unittest.TestCase):
+    def test_declares(self):
+        manifest = FlagManifest(flags=["billing.currency", "search.boost"], prefixes=["routing"])
+        self.assertTrue(manifest.declares("billing.currency"))
+        self.assertTrue(manifest.declares("routing.eu.timeout"))
+        self.assertFalse(manifest.declares("routing"))
+        self.assertFalse(manifest.declares("routingx.flag"))
+        self.assertFalse(manifest.declares("billing.limit"))
+
+    def test_from_file(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "flags.json")
+        with open(path, "w") as manifest_file:
+            json.dump(dict(flags=["b", "a", "a"], prefixes=["routing"]), manifest_file)
+        manifest = FlagManifest.from_file(path)
+        self.assertListEqual(["a", "b"], manifest.flags)
+        self.assertListEqual(["routing"], manifest.prefixes)
+
+        with open(path, "w") as manifest_file:
+            json.dump(dict(flags="a"), manifest_file)
+        with self.assertRaises(ValueError):
+            FlagManifest.from_file(path)
+
+    def test_undeclared_reads_are_reported(self):
+        manifest = FlagManifest(flags=["billing.currency"], prefixes=["routing"])
+        with StandInTongaServer(flags=FLAGS) as server:
+            client = TongaClient(server.url, options=TongaClientOptions(manifest=manifest, pre_fetch=True))
+            client.get("routing.eu.timeout")
+            client.get("billing.limit")
+            client.get("billing.limit")
+            client.get_many(["billing.currency", "search.boost", "search.boost"])
+        self.assertDictEqual({"billing.limit": 2, "search.boost": 1}, manifest.undeclared_reads)
+
+
+class TestWarmUp(unittest.TestCase):
+    def setUp(self):
+        self.manifest = FlagManifest(
+            flags=["billing.currency", "billing.limit", "search.boost", "search.missing"], prefixes=["routing", "ads"]
+        )
+
+    def assert_warmed_up(self, client, report):
+        self.assertTrue(report.complete)
+        self.assertListEqual(["billing.limit", "search.missing"], report.missing_flags)
+        self.assertListEqual(["ads"], report.missing_prefixes)
+        self.assertListEqual([], report.errors)
+        state = client.dump_state()
+        for flag in ("billing.currency", "search.boost", "routing.eu.timeout", "routing.eu.retries", "routing.enabled"):
+            self.assertIn(flag, state)
+
+    def test_on_demand_client(self):
+        with StandInTongaServer(flags=FLAGS) as server:
+            client = TongaClient(server.url)
+            report = client.warm_up(self.manifest, batch_size=2)
+            self.assert_warmed_up(client, report)
+            # Two batches of flags and one request for the prefixes, all reads are then served from the cache
+            self.assertEqual(3, server.request_count)
+            self.assertEqual(5, client.get("routing.eu.timeout"))
+            self.assertEqual(3, server.request_count)
+
+    def test_pre_fetch_client(self):
+        with StandInTongaServer(flags=FLAGS) as server:
+            client = TongaClient(server.url, options=TongaClientOptions(pre_fetch=True, manifest=self.manifest))
+            self.assert_warmed_up(client, client.warm_up())
+            self.assertEqual(1, server.request_count)
+
+    def test_prefix_pre_fetch_client(self):
+        with StandInTongaServer(flags=FLAGS) as server:
+            client = TongaClient(server.url, options=TongaClientOptions(pre_fetch_prefix_depth=1))
+            self.assert_warmed_up(client, client.warm_up(self.manifest))
+
+    def test_local_rules_client(self):
+        rules = {"flags": {
+            "billing.currency": {"value": "EUR"}, "search.boost": {"value": 1.5}, "routing.eu.timeout": {"value": 5},
+            "routing.eu.retries": {"value": 2}, "routing.enabled": {"value": True},
+        }}
+        with StandInTongaServer(rules=rules) as server:
+            client = TongaClient(server.url, options=TongaClientOptions(local_rules=LocalFlagRules()))
+            self.assert_warmed_up(client, client.warm_up(self.manifest))
+            self.assertEqual(1, server.request_count)
+
+    def test_deadline(self):
+        with StandInTongaServer(flags=FLAGS, latency=0.3) as server:
+            client = TongaClient(server.url)
+            report = client.warm_up(self.manifest, timeout=0.05)
+            self.assertFalse(report.complete)
+            self.assertLess(report.elapsed, 0.2)
+            self.assertListEqual(self.manifest.flags, report.unresolved_flags)
+            self.assertListEqual(self.manifest.prefixes, report.unresolved_prefixes)
+            self.assertListEqual([], report.missing_flags)
+
+    def test_unit_finishing_after_deadline(self):
+        with StandInTongaServer(flags=FLAGS) as server:
+            handle = server.handle
+
+            def handle_prefixes_slowly(path, query, headers):
+                if "prefix" in query:
+                    sleep(0.2)
+                return handle(path, query, headers)
+
+            with patch.object(server, "handle", side_effect=handle_prefixes_slowly):
+                client = TongaClient(server.url)
+                report = client.warm_up(self.manifest, timeout=0.1)
+                self.assertFalse(report.complete)
+                self.assertListEqual([], report.unresolved_flags)
+                self.assertListEqual(self.manifest.prefixes, report.unresolved_prefixes)
+                self.assertListEqual(["billing.limit", "search.missing"], report.missing_flags)
+                # The prefixes keep being fetched into the cache in the background
+                sleep(0.2)
+            self.assertEqual(5, client.get("routing.eu.timeout"))
+            self.assertEqual(2, server.request_count)
+
+    def test_failed_requests(self):
+        with StandInTongaServer(flags=FLAGS, error_rate=1) as server:
+            options = TongaClientOptions(retry_policy=RetryPolicy(retries=0))
+            report = TongaClient(server.url, options=options).warm_up(self.manifest, batch_size=2)
+            self.assertFalse(report.complete)
+            self.assertEqual(3, len(report.errors))
+            self.assertListEqual(self.manifest.flags, report.unresolved_flags)
+
+    def test_no_manifest(self):
+        with self.assertRaises(ValueError):
+            TongaClient("http://server_url").warm_up()
@@ -0,0 +1,84 @@
+import unittest
+
+import requests
+import requests_mock
+
+from tonga import TongaClient, TongaClientOptions, TongaMetrics, RetryPolicy, CircuitBreaker
+from tonga.metrics import LatencyHistogram
+from tests.stand_in_server import StandInTongaServer
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram(self):
+        histogram = LatencyHistogram(buckets=(0.01, 0.1))
+        for value in (0.005, 0.01, 0.05, 1):
+            histogram.observe(value)
+        self.assertListEqual([2, 1, 1], histogram.counts)
+        self.assertEqual(4, histogram.count)
+        self.assertAlmostEqual(0.26625, histogram.mean)
+        self.assertDictEqual({0.01: 2, 0.1: 1, None: 1}, histogram.as_dict()["buckets"])
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(TongaClient("http://server_url").metrics)
+
+    def test_cache_hits_and_misses(self):
+        metrics = TongaMetrics()
+        with StandInTongaServer(flags=dict(flag1=True, flag2=2, flag3=3)) as server:
+            client = TongaClient(server.url, options=TongaClientOptions(metrics=metrics))
+            client.get("flag1")
+            client.get("flag1")
+            client.get("flag1")
+            client.get_many(["flag1", "flag2", "flag2", "flag3"])
+            client.get("flag2")
+        self.assertIs(metrics, client.metrics)
+        self.assertDictEqual({"flag1": 3, "flag2": 1}, dict(metrics.hits))
+        self.assertDictEqual({"flag1": 1, "flag2": 1, "flag3": 1}, dict(metrics.misses))
+        self.assertAlmostEqual(4.0 / 7, metrics.hit_rate)
+
+    def test_requests_per_endpoint(self):
+        metrics = TongaMetrics()
+        hook_calls = []
+        metrics.add_hook(lambda name, value, tags: hook_calls.append((name, tags)))
+        with StandInTongaServer(flags=dict(a=dict(b=1, c=2))) as server:
+            client = TongaClient(server.url, options=TongaClientOptions(metrics=metrics))
+            client.get("a.b")
+            client.get("missing")
+            TongaClient(server.url, options=TongaClientOptions(metrics=metrics, pre_fetch=True)).get("a.c")
+        self.assertDictEqual({"flag_value": 2, "all_flags_values": 1}, dict(metrics.calls))
+        self.assertEqual(2, metrics.latency["flag_value"].count)
+        self.assertEqual(1, metrics.latency["all_flags_values"].count)
+        self.assertEqual(server.bytes_sent, metrics.bytes_received)
+        self.assertGreater(metrics.parse_time, 0)
+        self.assertIn(("request.latency", {"endpoint": "all_flags_values"}), hook_calls)
+        self.assertIn(("cache.miss", {"flag": "missing"}), hook_calls)
+        self.assertIn(("response.parse_time", {}), hook_calls)
+
+    @requests_mock.Mocker()
+    def test_retries_and_failures(self, m):
+        server_url = "http://server_url"
+        m.get(
+            "{}/flag_value/flag_name".format(server_url),
+            [dict(exc=requests.exceptions.ConnectionError), dict(status_code=500), dict(json=dict(value=True))],
+        )
+        metrics = TongaMetrics()
+        options = TongaClientOptions(metrics=metrics, retry_policy=RetryPolicy.constant(2, 0))
+        client = TongaClient(server_url, options=options)
+        self.assertEqual(True, client.get("flag_name"))
+        self.assertDictEqual({"flag_value": 3}, dict(metrics.calls))
+        self.assertDictEqual({"flag_value": 2}, dict(metrics.failures))
+        self.assertDictEqual({"flag_value": 2}, dict(metrics.retries))
+
+    @requests_mock.Mocker()
+    def test_circuit_breaker_transitions(self, m):
+        server_url = "http://server_url"
+        m.get("{}/flag_value/flag_name".format(server_url), exc=requests.exceptions.ConnectionError)
+        metrics = TongaMetrics()
+        breaker = CircuitBreaker(failure_threshold=1)
+        metrics.track_circuit_breaker(breaker)
+        options = TongaClientOptions(metrics=metrics, retry_policy=RetryPolicy(retries=0), circuit_breaker=breaker)
+        client = TongaClient(server_url, options=options)
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            client.get("flag_name")
+        self.assertEqual({"closed->open": 1}, metrics.as_dict()["circuit_breaker_transitions"])
+        # Failures exhausting the retry policy are not counted as retries
+        self.assertDictEqual({}, dict(metrics.retries))
@@ -0,0 +1,132 @@
+import unittest
+from threading import Thread
+from time import sleep
+
+from tonga import TongaClient, TongaClientOptions, TongaMetrics
+from tests.stand_in_server import StandInTongaServer
+
+
+class TestNegativeCache(unittest.TestCase):
+    def test_missing_flag_is_looked_up_again_after_ttl(self):
+        with StandInTongaServer(flags=dict(flag=None)) as server:
+            client = TongaClient(server.url, options=TongaClientOptions(negative_cache_ttl=0.05))
+            for _ in range(3):
+                self.assertIsNone(client.get("new_flag"))
+                # A flag whose value is None is cached like any other value
+                self.assertIsNone(client.get("flag"))
+            self.assertEqual(2, server.request_count)
+            self.assertDictEqual({"flag": None}, client.dump_state())
+            self.assertListEqual(["new_flag"], list(client.negatively_cached_flags))
+
+            server.flags["new_flag"] = True
+            self.assertIsNone(client.get("new_flag"))
+            sleep(0.06)
+            self.assertEqual(True, client.get("new_flag"))
+            self.assertEqual(True, client.get("new_flag"))
+            self.assertEqual(3, server.request_count)
+            self.assertDictEqual({}, client.negatively_cached_flags)
+
+    def test_missing_flags_cached_forever_by_default(self):
+        with StandInTongaServer() as server:
+            client = TongaClient(server.url)
+            self.assertIsNone(client.get("new_flag"))
+            server.flags["new_flag"] = True
+            self.assertIsNone(client.get("new_flag"))
+            self.assertEqual(1, server.request_count)
+            self.assertDictEqual({"new_flag": None}, client.dump_state())
+            self.assertDictEqual({}, client.negatively_cached_flags)
+
+    def test_get_many(self):
+        with StandInTongaServer(flags=dict(flag1=1)) as server:
+            client = TongaClient(server.url, options=TongaClientOptions(negative_cache_ttl=0.05))
+            self.assertDictEqual({"flag1": 1, "flag2": None}, client.get_many(["flag1", "flag2"]))
+            self.assertDictEqual({"flag1": 1, "flag2": None}, client.get_many(["flag1", "flag2"]))
+            self.assertIsNone(client.get("flag2"))
+            self.assertEqual(1, server.request_count)
+            self.assertIn("flag2", client.negatively_cached_flags)
+
+            server.flags["flag2"] = 2
+            sleep(0.06)
+            self.assertDictEqual({"flag1": 1, "flag2": 2}, client.get_many(["flag1", "flag2"]))
+            self.assertEqual(2, server.request_count)
+
+    def test_flag_removed_on_refresh_is_negatively_cached(self):
+        with StandInTongaServer(flags=dict(flag1=1, flag2=2)) as server:
+            options = TongaClientOptions(cache_ttl=0.05, negative_cache_ttl=10, background_refresh=True)
+            client = TongaClient(server.url, options=options)
+            self.addCleanup(client.close)
+            self.assertDictEqual({"flag1": 1, "flag2": 2}, client.get_many(["flag1", "flag2"]))
+            del server.flags["flag2"]
+            sleep(0.2)
+            self.assertDictEqual({"flag1": 1}, client.dump_state())
+            self.assertIn("flag2", client.negatively_cached_flags)
+
+    def test_pre_fetch_revalidates_missing_flags(self):
+        with StandInTongaServer(flags=dict(flag1=1)) as server:
+            client = TongaClient(server.url, options=TongaClientOptions(pre_fetch=True, negative_cache_ttl=0.05))
+            self.assertIsNone(client.get("new_flag"))
+            self.assertIsNone(client.get("new_flag"))
+            self.assertIsNone(client.get("other_new_flag"))
+            self.assertEqual(1, server.request_count)
+
+            server.flags["new_flag"] = True
+            sleep(0.06)
+            self.assertEqual(True, client.get("new_flag"))
+            # The revalidation covered the other missing flag as well
+            self.assertIsNone(client.get("other_new_flag"))
+            self.assertDictEqual(
+                {"new_flag": True, "other_new_flag": None}, client.get_many(["new_flag", "other_new_flag"])
+            )
+            self.assertEqual(2, server.request_count)
+
+    def test_prefix_pre_fetch_revalidates_missing_flags(self):
+        with StandInTongaServer(flags=dict(routing=dict(timeout=5))) as server:
+            options = TongaClientOptions(pre_fetch_prefix_depth=1, negative_cache_ttl=0.05)
+            client = TongaClient(server.url, options=options)
+            self.assertIsNone(client.get("routing.retries"))
+            self.assertIsNone(client.get("routing.retries"))
+            self.assertEqual(1, server.request_count)
+
+            server.flags["routing"]["retries"] = 3
+            sleep(0.06)
+            self.assertEqual(3, client.get("routing.retries"))
+            self.assertEqual(5, client.get("routing.timeout"))
+            self.assertEqual(2, server.request_count)
+
+    def test_renewed_while_readers_store_missing_flags(self):
+        client = TongaClient("http://server_url", options=TongaClientOptions(negative_cache_ttl=10))
+        stopped = []
+
+        def store_missing_flags(reader):
+            count = 0
+            while not stopped:
+                client._store_missing_flags(["reader{}.flag{}".format(reader, count % 1000)])
+                count += 1
+
+        readers = [Thread(target=store_missing_flags, args=(reader,)) for reader in range(4)]
+        for reader in readers:
+            reader.start()
+        try:
+            for _ in range(20):
+                client._renew_negative_cache()
+                client._forget_prefix("reader0")
+        finally:
+            stopped.append(True)
+            for reader in readers:
+                reader.join()
+
+    def test_metrics(self):
+        metrics = TongaMetrics()
+        with StandInTongaServer() as server:
+            options = TongaClientOptions(negative_cache_ttl=10, metrics=metrics)
+            client = TongaClient(server.url, options=options)
+            client.get("missing")
+            client.get("missing")
+            client.get_many(["missing"])
+        self.assertDictEqual({"missing": 1}, dict(metrics.misses))
+        self.assertDictEqual({"missing": 2}, dict(metrics.negative_hits))
+        self.assertAlmostEqual(2.0 / 3, metrics.hit_rate)
+
+
+if __name__ == "__main__":
+    unittest.main()
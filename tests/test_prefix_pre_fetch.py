@@ -0,0 +1,117 @@
+import unittest
+from copy import deepcopy
+from time import sleep
+
+from tonga import TongaClient, TongaClientOptions
+from tests.stand_in_server import StandInTongaServer
+
+FLAGS = dict(
+    routing=dict(eu=dict(timeout=5, retries=2), us=dict(timeout=7), enabled=True),
+    billing=dict(currency="EUR"),
+    top_level=1,
+)
+
+
+class TestPrefixPreFetch(unittest.TestCase):
+    def _build_client(self, server, depth=1, **options):
+        return TongaClient(server.url, options=TongaClientOptions(pre_fetch_prefix_depth=depth, **options))
+
+    def test_pre_fetches_only_the_namespace(self):
+        with StandInTongaServer(flags=deepcopy(FLAGS)) as server:
+            client = self._build_client(server)
+            self.assertEqual(5, client.get("routing.eu.timeout"))
+            self.assertEqual(1, server.request_count)
+            self.assertIn("prefix=routing", server.requests[0])
+            self.assertNotIn("billing.currency", client.dump_state())
+
+            self.assertEqual(7, client.get("routing.us.timeout"))
+            self.assertTrue(client.get("routing.enabled"))
+            # Flags missing from a pre-fetched namespace are not defined on the server
+            self.assertIsNone(client.get("routing.eu.missing"))
+            self.assertIsNone(client.get("routing.asia.timeout", offline_value=0))
+            self.assertEqual(1, server.request_count)
+
+            self.assertEqual("EUR", client.get("billing.currency"))
+            self.assertEqual(1, client.get("top_level"))
+            self.assertEqual(3, server.request_count)
+
+    def test_namespaces_are_flattened_lazily(self):
+        with StandInTongaServer(flags=deepcopy(FLAGS)) as server:
+            client = self._build_client(server)
+            client.get("routing.enabled")
+            # pylint: disable=protected-access
+            self.assertListEqual(["routing"], list(client._fetched_prefixes))
+            self.assertNotIn("routing.eu.timeout", client._flag_cache)
+            self.assertIn("routing.eu", client._pending_subtrees)
+
+            self.assertEqual(2, client.get("routing.eu.retries"))
+            self.assertNotIn("routing.eu", client._pending_subtrees)
+            self.assertIn("routing.us", client._pending_subtrees)
+
+            self.assertDictEqual(
+                {"routing.eu.timeout": 5, "routing.eu.retries": 2, "routing.us.timeout": 7, "routing.enabled": True},
+                client.dump_state(),
+            )
+            self.assertDictEqual({}, client._pending_subtrees)
+
+    def test_get_many_fetches_missing_namespaces_in_a_single_request(self):
+        with StandInTongaServer(flags=deepcopy(FLAGS)) as server:
+            client = self._build_client(server)
+            values = client.get_many(["routing.eu.timeout", "billing.currency", "billing.missing"])
+            self.assertDictEqual(
+                {"routing.eu.timeout": 5, "billing.currency": "EUR", "billing.missing": None}, values
+            )
+            self.assertEqual(1, server.request_count)
+            self.assertIn("prefix=routing", server.requests[0])
+            self.assertIn("prefix=billing", server.requests[0])
+
+    def test_explicit_deeper_prefix(self):
+        with StandInTongaServer(flags=deepcopy(FLAGS)) as server:
+            client = self._build_client(server)
+            client.pre_fetch_prefixes(["routing.eu"])
+            self.assertEqual(5, client.get("routing.eu.timeout"))
+            self.assertEqual(1, server.request_count)
+            # The rest of the namespace was not pre-fetched
+            self.assertEqual(7, client.get("routing.us.timeout"))
+            self.assertEqual(2, server.request_count)
+            # Already covered by the namespace pre-fetch
+            client.pre_fetch_prefixes(["routing.us", "routing"])
+            self.assertEqual(2, server.request_count)
+
+    def test_namespace_is_refetched_after_ttl(self):
+        with StandInTongaServer(flags=deepcopy(FLAGS)) as server:
+            client = self._build_client(server, cache_ttl=0.05)
+            self.assertEqual(5, client.get("routing.eu.timeout"))
+            server.flags["routing"]["eu"]["timeout"] = 6
+            del server.flags["routing"]["us"]
+            self.assertEqual(5, client.get("routing.eu.timeout"))
+            sleep(0.06)
+            self.assertEqual(6, client.get("routing.eu.timeout"))
+            self.assertIsNone(client.get("routing.us.timeout"))
+            self.assertEqual(2, server.request_count)
+
+    def test_flag_ttls_refetch_their_namespace(self):
+        with StandInTongaServer(flags=deepcopy(FLAGS)) as server:
+            client = self._build_client(server, flag_ttls={"routing.eu.timeout": 0.05})
+            self.assertEqual(5, client.get("routing.eu.timeout"))
+            self.assertEqual("EUR", client.get("billing.currency"))
+            server.flags["routing"]["eu"]["timeout"] = 6
+            server.flags["billing"]["currency"] = "USD"
+            sleep(0.06)
+            self.assertEqual(6, client.get("routing.eu.timeout"))
+            # Namespaces without a ttl are never refetched
+            self.assertEqual("EUR", client.get("billing.currency"))
+            self.assertEqual(3, server.request_count)
+
+    def test_clear_state_forgets_namespaces(self):
+        with StandInTongaServer(flags=deepcopy(FLAGS)) as server:
+            client = self._build_client(server)
+            client.get("routing.enabled")
+            client.clear_state()
+            self.assertEqual(5, client.get("routing.eu.timeout"))
+            self.assertEqual(2, server.request_count)
+
+    def test_ignored_when_subscribing(self):
+        options = TongaClientOptions(pre_fetch_prefix_depth=1, subscribe=True)
+        self.assertTrue(options.pre_fetch)
+        self.assertIsNone(options.pre_fetch_prefix_depth)
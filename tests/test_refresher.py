@@ -0,0 +1,100 @@
+import gc
+import unittest
+from time import sleep, time
+
+from mock import patch
+
+from tonga import TongaClient, TongaClientOptions
+from tonga.refresher import FlagRefresher, REFRESH_AHEAD_RATIO
+from tests.stand_in_server import StandInTongaServer
+
+
+class TestRefresher(unittest.TestCase):
+    def test_background_refresh_before_expiry(self):
+        with StandInTongaServer(flags=dict(flag1=1, flag2=True)) as server:
+            options = TongaClientOptions(cache_ttl=0.2, background_refresh=True, refresh_jitter=0)
+            client = TongaClient(server.url, options=options)
+            self.assertEqual(1, client.get("flag1"))
+            self.assertEqual(True, client.get("flag2"))
+            server.flags["flag1"] = 2
+            sleep(0.2 * REFRESH_AHEAD_RATIO + 0.05)
+            # Both flags were refreshed in a single batched request
+            self.assertEqual(3, server.request_count)
+            self.assertEqual(2, client.get("flag1"))
+            self.assertEqual(3, server.request_count)
+            client.close()
+
+    def test_stale_value_served_while_refreshing(self):
+        with StandInTongaServer(flags=dict(flag1=1)) as server:
+            options = TongaClientOptions(cache_ttl=0.1, background_refresh=True, refresh_jitter=0)
+            client = TongaClient(server.url, options=options)
+            self.assertEqual(1, client.get("flag1"))
+            client._refresher.stop()
+            client._refresher = FlagRefresher(client, ttl=10, jitter=0)
+            client._refresher.start()
+            server.flags["flag1"] = 2
+            server.latency = 0.2
+            sleep(0.1)
+            start = time()
+            self.assertEqual(1, client.get("flag1"))
+            self.assertLess(time() - start, 0.1)
+            sleep(0.3)
+            self.assertEqual(2, client.get("flag1"))
+            client.close()
+
+    def test_pre_fetch_background_refresh(self):
+        with StandInTongaServer(flags=dict(a=dict(b=1))) as server:
+            options = TongaClientOptions(pre_fetch=True, cache_ttl=0.2, background_refresh=True, refresh_jitter=0)
+            client = TongaClient(server.url, options=options)
+            self.assertEqual(1, client.get("a.b"))
+            server.flags = dict(a=dict(b=2, c=3))
+            sleep(0.2 * REFRESH_AHEAD_RATIO + 0.05)
+            self.assertEqual(2, client.get("a.b"))
+            self.assertEqual(3, client.get("a.c"))
+            self.assertEqual(2, server.request_count)
+            client.close()
+
+    def test_next_delay_jitter(self):
+        refresher = FlagRefresher(TongaClient("http://server_url"), ttl=10, jitter=0.2)
+        delays = [refresher.next_delay() for _ in range(100)]
+        expected_delay = 10 * REFRESH_AHEAD_RATIO
+        self.assertTrue(all(expected_delay * 0.8 <= delay <= expected_delay * 1.2 for delay in delays))
+        self.assertGreater(len(set(delays)), 1)
+
+    def test_refresher_survives_malformed_response(self):
+        with StandInTongaServer(flags=dict(a=1)) as server:
+            options = TongaClientOptions(cache_ttl=0.1, background_refresh=True, refresh_jitter=0)
+            client = TongaClient(server.url, options=options)
+            self.assertEqual(1, client.get("a"))
+            server.flags["a"] = 10
+            with patch.object(server, "encode", return_value=(b"[1]", {"Content-Type": "application/json"})):
+                sleep(0.1)
+            self.assertTrue(client._refresher.is_alive)
+            sleep(0.1)
+            self.assertEqual(10, client.get("a"))
+            client.close()
+
+    def test_expired_value_fetched_once_refresher_stopped(self):
+        with StandInTongaServer(flags=dict(a=1)) as server:
+            options = TongaClientOptions(cache_ttl=0.05, background_refresh=True, refresh_jitter=0)
+            client = TongaClient(server.url, options=options)
+            self.assertEqual(1, client.get("a"))
+            refresher = client._refresher
+            refresher.stop()
+            sleep(0.06)
+            self.assertFalse(refresher.is_alive)
+            server.flags["a"] = 10
+            self.assertEqual(10, client.get("a"))
+
+    def test_refresher_stops_when_client_collected(self):
+        client = TongaClient("http://server_url")
+        refresher = FlagRefresher(client, ttl=0.01, jitter=0)
+        refresher.start()
+        del client
+        gc.collect()
+        sleep(0.05)
+        self.assertFalse(refresher.is_alive)
+
+
+if __name__ == "__main__":
+    unittest.main()
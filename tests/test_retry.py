@@ -0,0 +1,187 @@
+import unittest
+from time import sleep, time
+
+import requests
+from mock import Mock, patch
+
+from tonga import TongaClient, TongaClientOptions, TongaTransport, RetryPolicy, CircuitBreaker, CircuitOpenError
+from tests.stand_in_server import StandInTongaServer
+
+
+class FlakyTransport(TongaTransport):
+    """
+    Fails with a connection error while failing is set, otherwise responds with the flag name as its value
+    """
+
+    def __init__(self):
+        self.failing = False
+        self.calls = 0
+
+    def get(self, url, headers, timeout=None):
+        self.calls += 1
+        if self.failing:
+            raise requests.exceptions.ConnectionError("server is down")
+        response = Mock()
+        response.status_code = 200
+        response.headers = {}
+        response.json.return_value = dict(value=url.split("?")[0].rsplit("/", 1)[-1])
+        return response
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_exponential_backoff_is_capped(self):
+        policy = RetryPolicy(retries=10, base_delay=1, multiplier=2, max_delay=5, jitter=0)
+        self.assertListEqual([1, 2, 4, 5, 5], [policy.backoff(attempt) for attempt in range(5)])
+
+    def test_jitter_only_shortens_delay(self):
+        policy = RetryPolicy(base_delay=1, multiplier=2, max_delay=30, jitter=0.5)
+        for _ in range(100):
+            delay = policy.backoff(2)
+            self.assertGreaterEqual(delay, 2)
+            self.assertLessEqual(delay, 4)
+
+    def test_gives_up_after_retries(self):
+        policy = RetryPolicy(retries=2, jitter=0)
+        self.assertEqual(1, policy.next_delay(0, 0))
+        self.assertEqual(2, policy.next_delay(1, 0))
+        self.assertIsNone(policy.next_delay(2, 0))
+
+    def test_gives_up_when_delay_passes_deadline(self):
+        policy = RetryPolicy(retries=10, base_delay=1, jitter=0, deadline=5)
+        self.assertEqual(2, policy.next_delay(1, 2))
+        self.assertIsNone(policy.next_delay(2, 2))
+
+    def test_attempt_timeout(self):
+        self.assertIsNone(RetryPolicy().attempt_timeout(2))
+        policy = RetryPolicy(deadline=5)
+        self.assertEqual(3, policy.attempt_timeout(2))
+        self.assertEqual(0, policy.attempt_timeout(6))
+
+    def test_constant_policy(self):
+        policy = RetryPolicy.constant(3, 0.5)
+        self.assertListEqual([0.5, 0.5, 0.5, None], [policy.next_delay(attempt, 0) for attempt in range(4)])
+
+    @patch("tonga.client.sleep")
+    def test_client_sleeps_according_to_policy(self, sleep_mock):
+        transport = FlakyTransport()
+        transport.failing = True
+        policy = RetryPolicy(retries=3, base_delay=0.1, multiplier=3, jitter=0)
+        client = TongaClient("http://server_url", options=TongaClientOptions(transport=transport, retry_policy=policy))
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            client.get("flag")
+        self.assertEqual(4, transport.calls)
+        self.assertListEqual([0.1, 0.3, 0.9], [round(call[0][0], 6) for call in sleep_mock.call_args_list])
+
+    def test_client_stops_retrying_at_deadline(self):
+        transport = FlakyTransport()
+        transport.failing = True
+        policy = RetryPolicy(retries=100, base_delay=0.05, multiplier=1, jitter=0, deadline=0.2)
+        client = TongaClient("http://server_url", options=TongaClientOptions(transport=transport, retry_policy=policy))
+        start_time = time()
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            client.get("flag")
+        self.assertLess(time() - start_time, 0.3)
+        self.assertLessEqual(transport.calls, 4)
+
+    def test_slow_attempt_times_out_at_deadline(self):
+        with StandInTongaServer(flags=dict(flag=True), latency=1) as server:
+            policy = RetryPolicy(retries=3, base_delay=0, jitter=0, deadline=0.3)
+            client = TongaClient(server.url, options=TongaClientOptions(retry_policy=policy))
+            start_time = time()
+            with self.assertRaises(requests.exceptions.Timeout):
+                client.get("flag")
+            self.assertLess(time() - start_time, 0.5)
+
+    def test_injected_server_errors_are_retried(self):
+        with StandInTongaServer(flags=dict(flag=True), error_rate=0.5) as server:
+            options = TongaClientOptions(retry_policy=RetryPolicy.constant(20, 0))
+            client = TongaClient(server.url, options=options)
+            for _ in range(20):
+                client.clear_state()
+                self.assertEqual(True, client.get("flag"))
+        self.assertGreater(server.request_count, 20)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_transitions(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.1)
+        listener = Mock()
+        breaker.add_listener(listener)
+        breaker.record_failure()
+        self.assertEqual(CircuitBreaker.CLOSED, breaker.state)
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertEqual(CircuitBreaker.CLOSED, breaker.state)
+        breaker.record_failure()
+        self.assertEqual(CircuitBreaker.OPEN, breaker.state)
+        self.assertFalse(breaker.allow_request())
+
+        sleep(0.15)
+        self.assertTrue(breaker.allow_request())
+        self.assertEqual(CircuitBreaker.HALF_OPEN, breaker.state)
+        # Only a single probe is let through
+        self.assertFalse(breaker.allow_request())
+        breaker.record_failure()
+        self.assertEqual(CircuitBreaker.OPEN, breaker.state)
+
+        sleep(0.15)
+        self.assertTrue(breaker.allow_request())
+        breaker.record_success()
+        self.assertEqual(CircuitBreaker.CLOSED, breaker.state)
+
+        self.assertEqual(2, breaker.transitions[(CircuitBreaker.CLOSED, CircuitBreaker.OPEN)] +
+                         breaker.transitions[(CircuitBreaker.HALF_OPEN, CircuitBreaker.OPEN)])
+        self.assertEqual(2, breaker.transitions[(CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN)])
+        self.assertEqual(1, breaker.transitions[(CircuitBreaker.HALF_OPEN, CircuitBreaker.CLOSED)])
+        self.assertEqual(5, listener.call_count)
+        listener.assert_any_call(CircuitBreaker.CLOSED, CircuitBreaker.OPEN)
+
+    def _build_client(self, transport, breaker, cache_ttl=None):
+        options = TongaClientOptions(
+            transport=transport, retry_policy=RetryPolicy(retries=0), circuit_breaker=breaker, cache_ttl=cache_ttl
+        )
+        return TongaClient("http://server_url", options=options)
+
+    def test_open_breaker_fails_fast_to_offline_value(self):
+        transport = FlakyTransport()
+        transport.failing = True
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        client = self._build_client(transport, breaker)
+        for flag in ("flag1", "flag2"):
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                client.get(flag)
+        self.assertEqual(CircuitBreaker.OPEN, breaker.state)
+
+        self.assertEqual("offline", client.get("flag3", offline_value="offline"))
+        self.assertDictEqual({"flag3": 3, "flag4": None}, client.get_many(["flag3", "flag4"], dict(flag3=3)))
+        self.assertEqual(2, transport.calls)
+        with self.assertRaises(CircuitOpenError):
+            client.get_all_flags_from_server()
+
+    def test_open_breaker_serves_stale_value(self):
+        transport = FlakyTransport()
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        client = self._build_client(transport, breaker, cache_ttl=0.05)
+        self.assertEqual("flag", client.get("flag"))
+        sleep(0.1)
+
+        transport.failing = True
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            client.get("flag")
+        self.assertEqual(CircuitBreaker.OPEN, breaker.state)
+        self.assertEqual("flag", client.get("flag", offline_value="offline"))
+        self.assertEqual(2, transport.calls)
+
+    def test_half_open_probe_closes_breaker(self):
+        transport = FlakyTransport()
+        transport.failing = True
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        client = self._build_client(transport, breaker)
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            client.get("flag1")
+        self.assertIsNone(client.get("flag1"))
+
+        transport.failing = False
+        sleep(0.1)
+        self.assertEqual("flag1", client.get("flag1"))
+        self.assertEqual(CircuitBreaker.CLOSED, breaker.state)
@@ -0,0 +1,160 @@
+import random
+import unittest
+from time import sleep
+
+import requests
+
+from tonga import TongaClient, TongaClientOptions, FlagRules, LocalFlagRules, RetryPolicy
+from tests.stand_in_server import StandInTongaServer
+
+RULES = {
+    "flags": {
+        "routing.timeout": {
+            "value": 5,
+            "rules": [
+                {"conditions": [{"attribute": "region", "values": ["eu", "uk"]},
+                                {"attribute": "vehicle", "operator": "starts_with", "values": ["bus"]}], "value": 7},
+                {"conditions": [{"attribute": "load", "operator": "gte", "value": 0.5}], "value": 9},
+                {"conditions": [{"attribute": "region", "values": ["us"]}], "value": 11},
+            ],
+        },
+        "routing.enabled": {
+            "rules": [
+                {"conditions": [{"attribute": "vehicle", "operator": "matches", "values": ["bus-[0-9]+$"]}],
+                 "value": True},
+                {"conditions": [{"attribute": "region", "operator": "not_in", "values": ["us"]}], "value": False},
+            ],
+        },
+        "billing.currency": {
+            "value": "USD",
+            "rules": [{"conditions": [{"attribute": "region", "operator": "in", "value": "eu"}], "value": "EUR"}],
+        },
+        "billing.limit": {
+            "value": None,
+            "rules": [{"conditions": [{"attribute": "load", "operator": "lt", "value": 0.1}], "value": 100}],
+        },
+    },
+}
+
+
+def random_context(rand):
+    context = {}
+    if rand.random() < 0.8:
+        context["region"] = rand.choice(["eu", "uk", "us", "jp"])
+    if rand.random() < 0.8:
+        context["vehicle"] = rand.choice(["bus-1", "bus-12x", "car-3", "busy"])
+    if rand.random() < 0.8:
+        context["load"] = rand.choice([0, 0.05, 0.1, 0.5, 0.9, "high"])
+    return context
+
+
+class TestFlagRules(unittest.TestCase):
+    def setUp(self):
+        self.rules = FlagRules(RULES)
+
+    def evaluate(self, flag, **context):
+        return self.rules.evaluate(flag, FlagRules.normalize_context(context), "undefined")
+
+    def test_first_matching_rule_wins(self):
+        self.assertEqual(7, self.evaluate("routing.timeout", region="eu", vehicle="bus-1", load=0.9))
+        self.assertEqual(9, self.evaluate("routing.timeout", region="eu", vehicle="car-1", load=0.9))
+        self.assertEqual(11, self.evaluate("routing.timeout", region="us", load=0.2))
+        self.assertEqual(5, self.evaluate("routing.timeout", region="jp"))
+        self.assertEqual(5, self.evaluate("routing.timeout", load="high"))
+
+    def test_indexed_rules_keep_their_order(self):
+        # The second rule is unindexed and must still win over the indexed third rule
+        self.assertEqual(9, self.evaluate("routing.timeout", region="us", load=0.5))
+        self.assertListEqual([1], self.rules._flags["routing.timeout"].unindexed)  # pylint: disable=protected-access
+
+    def test_flags_without_value(self):
+        self.assertEqual(True, self.evaluate("routing.enabled", vehicle="bus-12", region="us"))
+        self.assertEqual(False, self.evaluate("routing.enabled", vehicle="bus-12x"))
+        self.assertEqual("undefined", self.evaluate("routing.enabled", region="us"))
+        self.assertEqual("undefined", self.evaluate("missing"))
+        self.assertIsNone(self.evaluate("billing.limit", load=0.5))
+
+    def test_evaluate_all(self):
+        context = FlagRules.normalize_context(dict(region="eu", load=0))
+        self.assertDictEqual(
+            {"routing.timeout": 5, "routing.enabled": False, "billing.currency": "EUR", "billing.limit": 100},
+            self.rules.evaluate_all(context),
+        )
+        self.assertNotIn("routing.enabled", self.rules.evaluate_all(FlagRules.normalize_context(dict(region="us"))))
+
+    def test_malformed_rules(self):
+        for document in (
+            {},
+            {"flags": []},
+            {"flags": {"flag": {"rules": [{"conditions": [{"values": ["a"]}]}]}}},
+            {"flags": {"flag": {"rules": [{"conditions": [{"attribute": "a", "operator": "like"}]}]}}},
+            {"flags": {"flag": {"rules": [{"conditions": [{"attribute": "a", "operator": "lt", "value": "x"}]}]}}},
+            {"flags": {"flag": {"rules": [{"conditions": [{"attribute": "a", "operator": "matches", "value": "("}]}]}}},
+        ):
+            with self.assertRaises(ValueError):
+                FlagRules(document)
+
+
+class TestLocalRules(unittest.TestCase):
+    def test_local_values_match_server(self):
+        rand = random.Random(0)
+        with StandInTongaServer(rules=RULES) as server:
+            local_rules = LocalFlagRules()
+            for _ in range(100):
+                context = random_context(rand)
+                remote = TongaClient(server.url, context_attributes=context)
+                local = TongaClient(server.url, context_attributes=context, options=TongaClientOptions(
+                    local_rules=local_rules
+                ))
+                for flag in list(RULES["flags"]) + ["missing"]:
+                    self.assertEqual(remote.get(flag), local.get(flag), (flag, context))
+                self.assertDictEqual(remote.get_many(list(RULES["flags"])), local.get_many(list(RULES["flags"])))
+
+    def test_rules_downloaded_once_for_all_contexts(self):
+        with StandInTongaServer(rules=RULES) as server:
+            options = TongaClientOptions(local_rules=LocalFlagRules())
+            for region in ("eu", "us", "jp"):
+                client = TongaClient(server.url, context_attributes=dict(region=region), options=options)
+                client.get("billing.currency")
+                client.get_many(["routing.timeout", "missing"])
+            self.assertEqual(1, server.request_count)
+            self.assertEqual("EUR", TongaClient(
+                server.url, context_attributes=dict(region="eu"), options=options
+            ).get("billing.currency"))
+
+    def test_rules_refreshed_after_ttl(self):
+        rules = {"flags": {"flag": {"value": 1}}}
+        with StandInTongaServer(rules=rules) as server:
+            local_rules = LocalFlagRules(ttl=0.05)
+            options = TongaClientOptions(local_rules=local_rules, cache_ttl=0.05)
+            client = TongaClient(server.url, options=options)
+            self.assertEqual(1, client.get("flag"))
+            bytes_sent = server.bytes_sent
+            sleep(0.06)
+            self.assertEqual(1, client.get("flag"))
+            # The unchanged rules are revalidated with a conditional request
+            self.assertEqual(2, server.request_count)
+            self.assertEqual(bytes_sent, server.bytes_sent)
+
+            rules["flags"]["flag"]["value"] = 2
+            sleep(0.06)
+            self.assertEqual(2, client.get("flag"))
+            self.assertEqual(3, server.request_count)
+
+    def test_stale_rules_kept_while_server_unavailable(self):
+        with StandInTongaServer(rules={"flags": {"flag": {"value": 1}}}) as server:
+            options = TongaClientOptions(
+                local_rules=LocalFlagRules(ttl=0.05), cache_ttl=0.05, retry_policy=RetryPolicy(retries=0)
+            )
+            client = TongaClient(server.url, options=options)
+            self.assertEqual(1, client.get("flag"))
+            server.error_rate = 1
+            sleep(0.06)
+            self.assertEqual(1, client.get("flag"))
+            self.assertEqual(2, server.request_count)
+
+    def test_server_without_rules(self):
+        with StandInTongaServer(flags=dict(flag=1)) as server:
+            client = TongaClient(server.url, options=TongaClientOptions(local_rules=LocalFlagRules()))
+            with self.assertRaises(requests.exceptions.HTTPError):
+                client.get("flag")
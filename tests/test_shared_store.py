@@ -0,0 +1,113 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from time import sleep, time
+
+from tonga import TongaClient, TongaClientOptions, SharedFlagStore, PooledSessionTransport
+from tests.stand_in_server import StandInTongaServer
+
+
+class TestSharedFlagStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_publish_and_read(self):
+        store = SharedFlagStore(self.directory)
+        self.assertEqual((0, 0.0, None), store.read("http://server_url", "user=a"))
+
+        with store.refresh_lock("http://server_url", "user=a"):
+            self.assertEqual(1, store.publish("http://server_url", "user=a", {"a.b": 1}, '"etag"'))
+        # Another process maps the same files
+        generation, verified_at, snapshot = SharedFlagStore(self.directory).read("http://server_url", "user=a")
+        self.assertEqual(1, generation)
+        self.assertAlmostEqual(time(), verified_at, delta=1)
+        self.assertDictEqual({"a.b": 1}, snapshot.flags)
+        self.assertEqual('"etag"', snapshot.etag)
+        self.assertEqual((0, 0.0, None), store.read("http://server_url", "user=b"))
+
+        sleep(0.01)
+        store.touch("http://server_url", "user=a")
+        touched_generation, touched_at, snapshot = store.read("http://server_url", "user=a", known_generation=1)
+        self.assertEqual(1, touched_generation)
+        self.assertGreater(touched_at, verified_at)
+        self.assertIsNone(snapshot)
+
+    def test_old_generations_are_removed(self):
+        store = SharedFlagStore(self.directory)
+        for value in range(4):
+            store.publish("http://server_url", "", {"flag": value}, None)
+        generation, _, snapshot = store.read("http://server_url", "")
+        self.assertEqual(4, generation)
+        self.assertEqual(3, snapshot.flags["flag"])
+        generation_files = [name for name in os.listdir(self.directory) if name.endswith(".json")]
+        self.assertEqual(2, len(generation_files))
+
+    def test_clients_share_pre_fetch(self):
+        with StandInTongaServer(flags=dict(ns=dict(flag=1))) as server:
+            clients = [
+                TongaClient(server.url, options=TongaClientOptions(
+                    cache_ttl=0.1, shared_store=SharedFlagStore(self.directory)
+                ))
+                for _ in range(3)
+            ]
+            self.assertListEqual([1, 1, 1], [client.get("ns.flag") for client in clients])
+            self.assertEqual(1, server.request_count)
+            full_response_bytes = server.bytes_sent
+
+            # An unchanged refresh by one client extends the pre-fetch of all of them
+            sleep(0.12)
+            self.assertListEqual([1, 1, 1], [client.get("ns.flag") for client in clients])
+            self.assertEqual(2, server.request_count)
+            self.assertEqual(full_response_bytes, server.bytes_sent)
+
+            server.flags["ns"]["flag"] = 2
+            sleep(0.12)
+            self.assertListEqual([2, 2, 2], [client.get("ns.flag") for client in clients])
+            self.assertEqual(3, server.request_count)
+
+    @unittest.skipUnless(hasattr(os, "fork"), "fork is not supported")
+    def test_forked_workers_fetch_once_per_refresh(self):
+        workers = 4
+        ttl = 0.5
+        with StandInTongaServer(flags=dict(flag=1)) as server:
+            start_time = time()
+            pipes = []
+            for _ in range(workers):
+                read_fd, write_fd = os.pipe()
+                pid = os.fork()
+                if pid == 0:
+                    os.close(read_fd)
+                    self._run_worker(server.url, write_fd, ttl, refresh_time=start_time + 2 * ttl)
+                os.close(write_fd)
+                pipes.append((pid, os.fdopen(read_fd)))
+
+            self.assertListEqual([1] * workers, [json.loads(pipe.readline()) for _, pipe in pipes])
+            self.assertEqual(1, server.request_count)
+            server.flags["flag"] = 2
+
+            self.assertListEqual([2] * workers, [json.loads(pipe.readline()) for _, pipe in pipes])
+            for pid, pipe in pipes:
+                pipe.close()
+                self.assertEqual(0, os.waitpid(pid, 0)[1])
+            self.assertEqual(2, server.request_count)
+
+    def _run_worker(self, server_url, write_fd, ttl, refresh_time):
+        exit_code = 1
+        try:
+            options = TongaClientOptions(
+                cache_ttl=ttl, shared_store=SharedFlagStore(self.directory), transport=PooledSessionTransport()
+            )
+            client = TongaClient(server_url, options=options)
+            os.write(write_fd, (json.dumps(client.get("flag")) + "\n").encode("utf-8"))
+            sleep(max(0, refresh_time - time()))
+            os.write(write_fd, (json.dumps(client.get("flag")) + "\n").encode("utf-8"))
+            exit_code = 0
+        finally:
+            os._exit(exit_code)  # pylint: disable=protected-access
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from time import sleep
+
+from tonga import TongaClient, TongaClientOptions, FlagSnapshotStore, RetryPolicy
+from tonga.snapshot import FlagSnapshot
+from tests.stand_in_server import StandInTongaServer
+
+
+class TestSnapshotStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_save_and_load(self):
+        store = FlagSnapshotStore(self.directory)
+        store.save("http://server_url", "user=a", FlagSnapshot({"a.b": 1, "c": [1, 2]}, 100, True, '"etag"'))
+        snapshot = store.load("http://server_url", "user=a")
+        self.assertDictEqual({"a.b": 1, "c": [1, 2]}, snapshot.flags)
+        self.assertEqual(100, snapshot.timestamp)
+        self.assertTrue(snapshot.pre_fetched)
+        self.assertEqual('"etag"', snapshot.etag)
+        # No temporary files are left behind
+        self.assertListEqual([os.path.basename(store.path("http://server_url", "user=a"))], os.listdir(self.directory))
+
+    def test_keyed_by_server_and_context(self):
+        store = FlagSnapshotStore(self.directory)
+        store.save("http://server_url", "user=a", FlagSnapshot({"flag": 1}, 100))
+        store.save("http://server_url", "user=b", FlagSnapshot({"flag": 2}, 100))
+        self.assertEqual(1, store.load("http://server_url", "user=a").flags["flag"])
+        self.assertEqual(2, store.load("http://server_url", "user=b").flags["flag"])
+        self.assertIsNone(store.load("http://other_server_url", "user=a"))
+
+    def test_rejects_stale_snapshot(self):
+        store = FlagSnapshotStore(self.directory, max_age=60)
+        store.save("http://server_url", "", FlagSnapshot({"flag": 1}, 0))
+        self.assertIsNone(store.load("http://server_url", ""))
+
+    def test_rejects_unknown_version_and_corrupt_file(self):
+        store = FlagSnapshotStore(self.directory)
+        path = store.path("http://server_url", "")
+        with open(path, "w") as snapshot_file:
+            json.dump(dict(version=0, timestamp=0, server_url="http://server_url", context="", flags={}), snapshot_file)
+        self.assertIsNone(store.load("http://server_url", ""))
+        with open(path, "w") as snapshot_file:
+            snapshot_file.write("{")
+        self.assertIsNone(store.load("http://server_url", ""))
+
+    def test_creates_missing_directory(self):
+        store = FlagSnapshotStore(os.path.join(self.directory, "nested"))
+        store.save("http://server_url", "", FlagSnapshot({"flag": 1}, 100))
+        self.assertEqual(1, store.load("http://server_url", "").flags["flag"])
+
+
+class TestClientSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.store = FlagSnapshotStore(self.directory)
+
+    def _build_client(self, server_url, **kwargs):
+        options = TongaClientOptions(snapshot_store=self.store, retry_policy=RetryPolicy(retries=0), **kwargs)
+        return TongaClient(server_url, context_attributes=dict(user="a"), options=options)
+
+    def test_starts_from_snapshot_while_server_is_down(self):
+        with StandInTongaServer(flags=dict(flag1=True, flag2=2)) as server:
+            client = self._build_client(server.url)
+            self.assertDictEqual({"flag1": True, "flag2": 2}, client.get_many(["flag1", "flag2"]))
+            self.assertIsNone(client._snapshot_refresh_thread)
+            client.close()
+
+        client = self._build_client(server.url)
+        self.assertEqual(True, client.get("flag1"))
+        self.assertEqual(2, client.get("flag2"))
+        client._snapshot_refresh_thread.join()
+        # Failing to revalidate keeps the snapshot values
+        self.assertEqual(2, client.get("flag2"))
+
+    def test_snapshot_revalidated_in_background(self):
+        with StandInTongaServer(flags=dict(flag1=True, flag2=2)) as server:
+            self.assertEqual(2, self._build_client(server.url).get("flag2"))
+            self.store.flush()
+            server.flags["flag2"] = 3
+            client = self._build_client(server.url)
+            client._snapshot_refresh_thread.join()
+            self.assertEqual(3, client.get("flag2"))
+            client.close()
+        self.assertEqual(3, self.store.load(server.url, "user=a").flags["flag2"])
+
+    def test_pre_fetch_snapshot_revalidated_conditionally(self):
+        with StandInTongaServer(flags=dict(a=dict(b=1), c=2)) as server:
+            self.assertEqual(1, self._build_client(server.url, pre_fetch=True).get("a.b"))
+            self.store.flush()
+            full_response_bytes = server.bytes_sent
+            client = self._build_client(server.url, pre_fetch=True)
+            self.assertEqual(2, client.get("c"))
+            client._snapshot_refresh_thread.join()
+            self.assertIsNone(client.get("missing"))
+        self.assertEqual(2, server.request_count)
+        self.assertEqual(full_response_bytes, server.bytes_sent)
+
+    def test_writes_coalesced_in_background(self):
+        with StandInTongaServer(flags=dict(flag1=1, flag2=2)) as server:
+            store = FlagSnapshotStore(self.directory, save_delay=0.05)
+            client = TongaClient(server.url, options=TongaClientOptions(snapshot_store=store))
+            self.assertEqual(1, client.get("flag1"))
+            self.assertEqual(2, client.get("flag2"))
+            self.assertIsNone(store.load(server.url, ""))
+            sleep(0.1)
+        self.assertDictEqual({"flag1": 1, "flag2": 2}, store.load(server.url, "").flags)
+
+    def test_overridden_state_not_persisted(self):
+        with StandInTongaServer(flags=dict(flag1=1, flag2=2)) as server:
+            client = self._build_client(server.url)
+            client.set_state(dict(flag1=10))
+            self.assertEqual(2, client.get("flag2"))
+            client.close()
+            self.assertIsNone(self.store.load(server.url, "user=a"))
+
+            client.clear_state()
+            with client.with_state(dict(flag1=10)):
+                self.assertEqual(10, client.get("flag1"))
+            self.assertEqual(1, client.get("flag1"))
+            client.close()
+        self.assertDictEqual({"flag1": 1}, self.store.load(server.url, "user=a").flags)
+
+    def test_offline_mode_does_not_revalidate(self):
+        self.store.save("http://server_url", "user=a", FlagSnapshot({"flag": 1}, 100))
+        client = self._build_client("http://server_url", offline_mode=True)
+        self.assertEqual(1, client.get("flag"))
+        self.assertIsNone(client._snapshot_refresh_thread)
+
+    def test_offline_mode_serves_snapshot_past_ttl(self):
+        with StandInTongaServer(flags=dict(flag=2)) as server:
+            self.store.save(server.url, "user=a", FlagSnapshot({"flag": 1}, 100))
+            client = self._build_client(server.url, offline_mode=True, cache_ttl=0.05, background_refresh=True)
+            self.assertEqual(1, client.get("flag"))
+            sleep(0.06)
+            self.assertEqual(1, client.get("flag"))
+            self.assertDictEqual({"flag": 1}, client.get_many(["flag"]))
+            self.assertIsNone(client._refresher)
+        self.assertEqual(0, server.request_count)
@@ -0,0 +1,117 @@
+import gc
+import unittest
+from time import sleep, time
+
+from tonga import TongaClient, TongaClientOptions, RetryPolicy
+from tonga.streaming import iter_events, ServerSentEvent, HEARTBEAT_EVENT
+from tests.stand_in_server import StandInTongaServer
+
+
+def wait_until(predicate, timeout=3):
+    """
+    Waits for the predicate to hold, returns whether it did before the timeout
+    """
+    deadline = time() + timeout
+    while not predicate():
+        if time() > deadline:
+            return False
+        sleep(0.01)
+    return True
+
+
+class TestStreaming(unittest.TestCase):
+    def _build_client(self, server, **kwargs):
+        options = TongaClientOptions(subscribe=True, retry_policy=RetryPolicy.constant(3, 0.05), **kwargs)
+        client = TongaClient(server.url, context_attributes=dict(user="a"), options=options)
+        self.addCleanup(client.close)
+        return client
+
+    def test_iter_events(self):
+        lines = [u": heartbeat", u"", u"id: 1", u"event: diff", u"data: {\"a\":", u"data:1}", u"", u"data: x", u""]
+        self.assertListEqual(
+            [
+                ServerSentEvent(None, HEARTBEAT_EVENT, u""),
+                ServerSentEvent(u"1", u"diff", u"{\"a\":\n1}"),
+                ServerSentEvent(None, u"message", u"x"),
+            ],
+            list(iter_events(lines)),
+        )
+
+    def test_pushed_updates_applied_to_cache(self):
+        with StandInTongaServer(flags=dict(a=dict(b=1, c=2), d=3)) as server:
+            client = self._build_client(server)
+            self.assertEqual(1, client.get("a.b"))
+            self.assertTrue(wait_until(lambda: client._subscriber.connected))
+
+            server.push_update(set_flags=dict(a=dict(b=5), e=dict(f=True)))
+            self.assertTrue(wait_until(lambda: client.get("a.b") == 5))
+            self.assertEqual(True, client.get("e.f"))
+            self.assertEqual(2, client.get("a.c"))
+
+            server.push_update(unset=["a"])
+            self.assertTrue(wait_until(lambda: client.get("a.b") is None))
+            self.assertIsNone(client.get("a.c"))
+            self.assertEqual(3, client.get("d"))
+        # Updates did not trigger any all flags request beyond the first pre-fetch
+        self.assertEqual(1, len([request for request in server.requests if "/all_flags_values" in request]))
+
+    def test_reconnect_resumes_from_last_event(self):
+        with StandInTongaServer(flags=dict(flag=1)) as server:
+            client = self._build_client(server)
+            self.assertTrue(wait_until(lambda: client._subscriber.connected))
+            server.push_update(set_flags=dict(flag=2))
+            self.assertTrue(wait_until(lambda: client.get("flag") == 2))
+
+            server.disconnect_streams()
+            server.push_update(set_flags=dict(flag=3))
+            self.assertTrue(wait_until(lambda: client.get("flag") == 3))
+        self.assertListEqual([None, u"1"], server.stream_last_event_ids[:2])
+
+    def test_malformed_events_reconnect(self):
+        with StandInTongaServer(flags=dict(flag=1)) as server:
+            client = self._build_client(server)
+            self.assertTrue(wait_until(lambda: client._subscriber.connected))
+            server.push_event("diff", {"set": 5})
+            self.assertTrue(wait_until(lambda: len(server.stream_last_event_ids) == 2))
+            self.assertTrue(wait_until(lambda: client._subscriber.connected))
+            server.push_event("snapshot", [1])
+            self.assertTrue(wait_until(lambda: len(server.stream_last_event_ids) == 3))
+            self.assertTrue(wait_until(lambda: client._subscriber.connected))
+
+            server.push_update(set_flags=dict(flag=2))
+            self.assertTrue(wait_until(lambda: client.get("flag") == 2))
+            self.assertTrue(client._subscriber.is_alive)
+
+    def test_falls_back_to_polling(self):
+        with StandInTongaServer(flags=dict(flag=1)) as server:
+            server.streaming = False
+            client = self._build_client(server, poll_interval=0.05)
+            self.assertEqual(1, client.get("flag"))
+            self.assertTrue(wait_until(lambda: not client._subscriber.streaming_supported))
+
+            server.flags["flag"] = 2
+            self.assertTrue(wait_until(lambda: client.get("flag") == 2))
+
+    def test_stream_keeps_pre_fetch_fresh(self):
+        with StandInTongaServer(flags=dict(flag=1)) as server:
+            client = self._build_client(server, cache_ttl=0.2)
+            self.assertEqual(1, client.get("flag"))
+            self.assertTrue(wait_until(lambda: client._subscriber.connected))
+            sleep(0.5)
+            self.assertEqual(1, client.get("flag"))
+        self.assertEqual(1, len([request for request in server.requests if "/all_flags_values" in request]))
+
+    def test_subscriber_stops(self):
+        with StandInTongaServer(flags=dict(flag=1)) as server:
+            client = self._build_client(server)
+            subscriber = client._subscriber
+            self.assertTrue(wait_until(lambda: subscriber.connected))
+            client.close()
+            self.assertTrue(wait_until(lambda: not subscriber.is_alive))
+
+            client = TongaClient(server.url, options=TongaClientOptions(subscribe=True))
+            subscriber = client._subscriber
+            self.assertTrue(wait_until(lambda: subscriber.connected))
+            del client
+            gc.collect()
+            self.assertTrue(wait_until(lambda: not subscriber.is_alive))
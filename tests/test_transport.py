@@ -0,0 +1,58 @@
+import unittest
+
+import requests
+
+from tonga import TongaClient, TongaClientOptions
+from tonga.transport import PooledSessionTransport, get_default_transport
+from tests.stand_in_server import StandInTongaServer
+
+
+class TestTransport(unittest.TestCase):
+    def test_clients_share_default_transport(self):
+        client1 = TongaClient("http://server_url")
+        client2 = TongaClient("http://other_server_url")
+        self.assertIs(get_default_transport(), client1._transport)
+        self.assertIs(client1._transport, client2._transport)
+
+    def test_client_uses_given_transport(self):
+        transport = PooledSessionTransport(pool_size=2)
+        client = TongaClient("http://server_url", options=TongaClientOptions(transport=transport))
+        self.assertIs(transport, client._transport)
+
+    def test_keep_alive_reuses_connection(self):
+        with StandInTongaServer(flags=dict(flag1=True, flag2=2)) as server:
+            transport = PooledSessionTransport()
+            for _ in range(5):
+                client = TongaClient(server.url, options=TongaClientOptions(transport=transport))
+                self.assertEqual(True, client.get("flag1"))
+                self.assertEqual(2, client.get("flag2"))
+            transport.close()
+        self.assertEqual(10, server.request_count)
+        self.assertEqual(1, len(server.connections))
+
+    def test_get_many_against_server(self):
+        with StandInTongaServer(flags=dict(a=dict(b=1, c=2), d=3)) as server:
+            client = TongaClient(server.url)
+            self.assertDictEqual({"a.b": 1, "d": 3, "e": None}, client.get_many(["a.b", "d", "e"]))
+        self.assertEqual(1, server.request_count)
+
+    def test_no_keep_alive_opens_connection_per_request(self):
+        with StandInTongaServer(flags=dict(flag1=True, flag2=2)) as server:
+            transport = PooledSessionTransport(keep_alive=False)
+            client = TongaClient(server.url, options=TongaClientOptions(transport=transport))
+            client.get("flag1")
+            client.get("flag2")
+            transport.close()
+        self.assertEqual(2, len(server.connections))
+
+    def test_read_timeout(self):
+        with StandInTongaServer(flags=dict(flag1=True), latency=0.5) as server:
+            transport = PooledSessionTransport(read_timeout=0.05)
+            client = TongaClient(server.url, options=TongaClientOptions(transport=transport, retries=0))
+            with self.assertRaises(requests.exceptions.Timeout):
+                client.get("flag1")
+            transport.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
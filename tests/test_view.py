@@ -0,0 +1,66 @@
+import unittest
+import weakref
+
+from tonga import TongaClient, TongaClientOptions, FlagView
+from tests.stand_in_server import StandInTongaServer
+
+
+class TestFlagView(unittest.TestCase):
+    def setUp(self):
+        self.view = FlagView({
+            "bool": True, "zero": 0, "int": 3, "float": 2.5, "integral_float": 4.0, "yes": " Yes ", "number": "12",
+            "text": "blue", "none": None, "list": [1],
+        })
+
+    def test_get(self):
+        self.assertEqual(3, self.view.get("int"))
+        self.assertIsNone(self.view.get("none", "default"))
+        self.assertEqual("default", self.view.get("missing", "default"))
+        self.assertIn("none", self.view)
+        self.assertNotIn("missing", self.view)
+        self.assertEqual(10, len(self.view))
+
+    def test_get_bool(self):
+        self.assertListEqual(
+            [True, False, True, True, True, False, False],
+            [self.view.get_bool(flag) for flag in ("bool", "zero", "int", "yes", "float", "text", "missing")],
+        )
+        self.assertIsNone(self.view.get_bool("none", None))
+        self.assertIsNone(self.view.get_bool("number", None))
+
+    def test_get_int(self):
+        self.assertListEqual(
+            [3, 0, 4, 12, -1, -1, -1, -1],
+            [self.view.get_int(flag, -1)
+             for flag in ("int", "zero", "integral_float", "number", "float", "bool", "text", "missing")],
+        )
+
+    def test_get_float_and_str(self):
+        self.assertListEqual([2.5, 3.0, 12.0, None], [
+            self.view.get_float(flag, None) for flag in ("float", "int", "number", "bool")
+        ])
+        self.assertEqual("blue", self.view.get_str("text"))
+        self.assertIsNone(self.view.get_str("int"))
+
+    def test_view_of_client(self):
+        with StandInTongaServer(flags=dict(features=dict(enabled="true", limit=10))) as server:
+            client = TongaClient(server.url, options=TongaClientOptions(pre_fetch=True))
+            self.assertEqual(0, len(client.frozen_view()))
+            client.get("features.enabled")
+            view = client.frozen_view()
+            server.flags["features"]["limit"] = 20
+            client.clear_state()
+            self.assertEqual(20, client.get("features.limit"))
+        # The view does not see later changes of the client
+        self.assertTrue(view.get_bool("features.enabled"))
+        self.assertEqual(10, view.get_int("features.limit"))
+        self.assertEqual(2, server.request_count)
+
+    def test_compact_clients(self):
+        client = TongaClient("http://server_url")
+        for instance in (client, client.options, client.frozen_view()):
+            self.assertFalse(hasattr(instance, "__dict__"))
+        # Background refreshers and subscribers reference their client weakly
+        self.assertIs(client, weakref.ref(client)())
+        with self.assertRaises(AttributeError):
+            client.unknown = True
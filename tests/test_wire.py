@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+
+import requests
+import requests_mock
+from mock import Mock, patch
+
+from tonga import TongaClient, TongaClientOptions
+from tonga.wire import decode_flat_tree, msgpack
+from tests.stand_in_server import StandInTongaServer
+
+FLAGS = {
+    "routing": {
+        "eu": {"timeout": 5, "zones": [{"name": "north", "weights": {"a": 1}}, "south"], "empty": {}},
+        "enabled": True,
+        "label": u"Linha é",
+    },
+    "billing": {"currency": None, "limits": [1, 2]},
+    "top": 1.5,
+}
+
+SQUASHED = {
+    "routing.eu.timeout": 5,
+    "routing.eu.zones": [{"name": "north", "weights": {"a": 1}}, "south"],
+    "routing.enabled": True,
+    "routing.label": u"Linha é",
+    "billing.currency": None,
+    "billing.limits": [1, 2],
+    "top": 1.5,
+}
+
+
+def json_response(body):
+    response = requests.Response()
+    response.status_code = 200
+    response.headers["Content-Type"] = "application/json"
+    response._content = json.dumps(body).encode("utf-8")  # pylint: disable=protected-access
+    return response
+
+
+class TestWire(unittest.TestCase):
+    def test_decode_flat_tree(self):
+        self.assertDictEqual(SQUASHED, decode_flat_tree(json_response(FLAGS)))
+        # Same flattening as squashing a decoded response
+        client = TongaClient("http://server_url")
+        squashed = client._recursive_squash_response_dict(FLAGS)  # pylint: disable=protected-access
+        self.assertDictEqual(squashed, SQUASHED)
+
+    def test_decode_empty_and_invalid_trees(self):
+        self.assertDictEqual({}, decode_flat_tree(json_response(None)))
+        self.assertDictEqual({}, decode_flat_tree(json_response({})))
+        with self.assertRaises(ValueError):
+            decode_flat_tree(json_response([1]))
+
+    def test_decode_response_without_content(self):
+        response = Mock()
+        response.json.return_value = FLAGS
+        self.assertDictEqual(SQUASHED, decode_flat_tree(response))
+
+    def test_compressed_pre_fetch(self):
+        flags = {"ns{}".format(i): {"flag{}".format(j): "value {}".format(j) for j in range(50)} for i in range(20)}
+        with StandInTongaServer(flags=flags, compress=True) as server:
+            client = TongaClient(server.url, options=TongaClientOptions(pre_fetch=True))
+            self.assertEqual("value 3", client.get("ns1.flag3"))
+            self.assertEqual(1000, len(client.dump_state()))
+            self.assertLess(server.bytes_sent * 5, len(json.dumps(flags)))
+
+    @requests_mock.Mocker()
+    def test_compact_encoding_not_requested_without_msgpack(self, m):
+        m.get("http://server_url/all_flags_values", json=FLAGS)
+        with patch("tonga.client.msgpack", None):
+            client = TongaClient("http://server_url", options=TongaClientOptions(pre_fetch=True, compact_encoding=True))
+            self.assertEqual(5, client.get("routing.eu.timeout"))
+        self.assertNotIn("msgpack", m.last_request.headers.get("Accept", ""))
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    def test_compact_encoding(self):
+        with StandInTongaServer(flags=FLAGS) as server:
+            client = TongaClient(server.url, options=TongaClientOptions(pre_fetch=True, compact_encoding=True))
+            self.assertEqual(5, client.get("routing.eu.timeout"))
+            self.assertDictEqual(SQUASHED, client.dump_state())
+            self.assertDictEqual(SQUASHED, client.get_all_flags_from_server())
+            json_client = TongaClient(server.url, options=TongaClientOptions(pre_fetch=True))
+            self.assertDictEqual(SQUASHED, json_client.get_all_flags_from_server())
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    def test_msgpack_response_of_filtered_request(self):
+        with StandInTongaServer(flags=FLAGS) as server:
+            client = TongaClient(server.url, options=TongaClientOptions(compact_encoding=True))
+            self.assertDictEqual(
+                {"routing.enabled": True, "top": 1.5}, client.get_many(["routing.enabled", "top"])
+            )
+
+    def test_decode_errors_are_raised(self):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b"{not json"  # pylint: disable=protected-access
+        with self.assertRaises(ValueError):
+            decode_flat_tree(response)
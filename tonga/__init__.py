@@ -1 +1,16 @@
+import six
+
 from tonga.client import TongaClient, TongaClientOptions  # noqa: F401
+from tonga.cache import SharedFlagCache  # noqa: F401
+from tonga.retry import RetryPolicy, CircuitBreaker, CircuitOpenError  # noqa: F401
+from tonga.snapshot import FlagSnapshotStore  # noqa: F401
+from tonga.shared_store import SharedFlagStore  # noqa: F401
+from tonga.rules import FlagRules, LocalFlagRules  # noqa: F401
+from tonga.metrics import TongaMetrics  # noqa: F401
+from tonga.view import FlagView  # noqa: F401
+from tonga.manifest import FlagManifest, WarmUpReport  # noqa: F401
+from tonga.transport import TongaTransport, PooledSessionTransport  # noqa: F401
+
+if six.PY3:
+    from tonga.async_client import AsyncTongaClient  # noqa: F401
+    from tonga.async_transport import AsyncTongaTransport, ExecutorAsyncTransport, AiohttpTransport  # noqa: F401
@@ -0,0 +1,355 @@
+import asyncio
+from itertools import count
+from time import time
+
+import requests
+
+from tonga.async_transport import ExecutorAsyncTransport
+from tonga.client import BaseTongaClient, _ALL_FLAGS, _MISSING, _PREFIX
+from tonga.retry import CircuitOpenError
+
+
+class AsyncSingleFlight(object):
+    """
+    Collapses concurrent awaits sharing the same key into a single execution, cancelling one of the waiting callers does
+    not cancel the shared execution
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, func):
+        """
+        Executes the given coroutine function unless a call with the same key is already in flight, in which case waits
+        for it
+        :param key: Call key
+        :type key: collections.Hashable
+        :param func: Coroutine function to execute
+        :type func: () -> collections.Awaitable
+        :return: Result of the function
+        :rtype: Any
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(task)
+
+
+# Downloads of local flag rules in flight by event loop and rules, shared by all clients using the same rules
+_rules_in_flight = AsyncSingleFlight()
+
+
+class AsyncTongaClient(BaseTongaClient):
+    """
+    Asynchronous client for asyncio applications, requests and retry delays never block the event loop. Cache and
+    state semantics match TongaClient, except that background refresh is not supported and expired values are fetched
+    again on the next get. Flags loaded from a snapshot are not revalidated until they expire
+    """
+
+    __slots__ = ("_transport", "_in_flight")
+
+    def __init__(self, server_url, context_attributes=None, request_attributes=None, options=None):
+        """
+        :param server_url: Server connection string
+        :type server_url: str
+        :param context_attributes: Optional context attributes to be passed on each query
+        :type context_attributes: dict[str, object]
+        :param request_attributes: Optional request attributes to be passed on each query, they do not affect the
+        selected flag but can be used to add extra logging/monitoring information on the server side about this request
+        :type request_attributes: dict[str, str]
+        :param options: Client optional configuration
+        :type options: tonga.client.TongaClientOptions
+        """
+        super().__init__(server_url, context_attributes, request_attributes, options)
+        self._transport = self.options.async_transport or ExecutorAsyncTransport(self.options.transport)
+        self._in_flight = AsyncSingleFlight()
+        self._load_snapshot()
+
+    async def get(self, flag, offline_value=None):
+        """
+        Gets the value associated to the specified flag
+        at the server
+        :param flag: Flag name
+        :type flag: str
+        :param offline_value: Which value to return if client is in offline mode
+        :type offline_value: Any
+        :return: Flag value if defined, otherwise None
+        :rtype: Any
+        """
+        if self._manifest is not None:
+            self._manifest.record_read(flag)
+        value = self._flag_cache.get(flag, _MISSING)
+        if value is not _MISSING:
+            if self.options.offline_mode or not (self._flag_expiry and self._is_expired(flag)):
+                if self._metrics is not None:
+                    self._metrics.record_hit(flag)
+                return value
+            if self._metrics is not None:
+                self._metrics.record_miss(flag)
+        elif self._negative_cache and self._is_known_missing(flag):
+            if self._metrics is not None:
+                self._metrics.record_negative_hit(flag)
+            return None
+        else:
+            if self._metrics is not None:
+                self._metrics.record_miss(flag)
+            if self.options.offline_mode:
+                return offline_value
+
+        try:
+            return await self._get_flag_value_through_cache(flag)
+        except CircuitOpenError:
+            # The server is failing, fail fast to the last known value
+            return self._flag_cache.get(flag, offline_value)
+
+    async def _get_flag_value_through_cache(self, flag):
+        """
+        Gets the value associated to the specified flag, fetching it (or the flags it is pre-fetched with) from the
+        server unless the current pre-fetch already determines it
+        :param flag: Flag name
+        :type flag: str
+        :return: Flag value if defined, otherwise None
+        :rtype: Any
+        """
+        if self.options.local_rules is not None:
+            await self._update_local_rules_if_needed()
+            self._store_local_values([flag])
+            return self._flag_cache.get(flag)
+        if self.options.pre_fetch_prefix_depth:
+            for prefix in self._prefixes_to_pre_fetch([flag]):
+                await self._in_flight.do((_PREFIX, prefix), lambda prefix=prefix: self._fetch_prefixes([prefix]))
+            return self._get_cached_value(flag)
+        if self.options.pre_fetch:
+            # Flags missing from a valid pre-fetch are not defined on the server, unless they were created since
+            if self._needs_pre_fetch() or self._negative_entry_expired(flag):
+                await self._pre_fetch_once()
+            return self._get_cached_value(flag)
+        return await self._in_flight.do(flag, lambda: self._fetch_flag_value(flag))
+
+    async def _fetch_flag_value(self, flag):
+        """
+        Gets the value associated to the specified flag from the shared cache or else the server and caches it
+        :param flag: Flag name
+        :type flag: str
+        :return: Flag value if defined, otherwise None
+        :rtype: Any
+        """
+        entry = self._get_shared_entry(flag)
+        if entry is not None:
+            self._store_fetched_values({flag: entry[0]}, fetched_at=entry[1])
+            return entry[0]
+
+        response_json = await self._get_from_server_with_retries(*self._flag_value_request(flag))
+        return self._store_flag_value_response(flag, response_json)
+
+    async def get_many(self, flags, offline_values=None):
+        """
+        Gets the values associated to the specified flags, all flags that are not cached yet are fetched from the server
+        in a single request
+        :param flags: Flag names
+        :type flags: list[str]
+        :param offline_values: Which values to return for each flag if client is in offline mode
+        :type offline_values: dict[str, Any]
+        :return: Mapping from each flag to its value if defined, otherwise None
+        :rtype: dict[str, Any]
+        """
+        missing_flags = self._find_missing_flags(flags)
+        if missing_flags:
+            if self.options.offline_mode:
+                return self._get_offline_values(flags, offline_values)
+            try:
+                await self._fetch_missing_flags(missing_flags)
+            except CircuitOpenError:
+                return self._get_offline_values(flags, offline_values)
+        return {flag: self._get_cached_value(flag) for flag in flags}
+
+    async def _fetch_missing_flags(self, missing_flags):
+        """
+        Fetches the given flags missing from the cache, or the flags they are pre-fetched with, in a single request
+        :param missing_flags: Flag names
+        :type missing_flags: list[str]
+        """
+        if self.options.local_rules is not None:
+            await self._update_local_rules_if_needed()
+            self._store_local_values(missing_flags)
+        elif self.options.pre_fetch_prefix_depth:
+            prefixes = self._prefixes_to_pre_fetch(missing_flags)
+            if prefixes:
+                await self._fetch_prefixes(prefixes)
+        elif self.options.pre_fetch:
+            if self._needs_pre_fetch() or any(self._negative_entry_expired(flag) for flag in missing_flags):
+                await self._pre_fetch_once()
+        else:
+            await self._in_flight.do(tuple(missing_flags), lambda: self._fetch_flag_values(missing_flags))
+
+    async def _fetch_flag_values(self, flags):
+        """
+        Populates the cache with the values of the given flags from the shared cache or else the server
+        :param flags: Flag names
+        :type flags: list[str]
+        """
+        missing_flags = self._load_shared_values(flags)
+        if missing_flags:
+            response_json = await self._get_from_server_with_retries(*self._all_flags_request(flags=missing_flags))
+            self._store_flag_values_response(missing_flags, response_json)
+
+    async def _update_local_rules_if_needed(self):
+        """
+        Downloads the flag rules unless they are up to date, while the server is unavailable the previous rules are kept
+        """
+        local_rules = self.options.local_rules
+        if not local_rules.needs_update:
+            return
+        try:
+            await _rules_in_flight.do((asyncio.get_event_loop(), local_rules), self._update_local_rules_from_server)
+        except requests.exceptions.RequestException:
+            if local_rules.rules is None:
+                raise
+
+    async def _update_local_rules_from_server(self):
+        if not self.options.local_rules.needs_update:
+            return
+        request_string, headers = self._rules_request(self.options.local_rules.etag)
+        self._update_local_rules(await self._get_response_from_server_with_retries(request_string, headers))
+
+    async def get_all_flags_from_server(self):
+        """
+        Fetch all flags from the server and return them as a dictionary in a flattened structure (no nested
+        dictionaries)
+        :rtype: dict[str, Any]
+        """
+        request_string, headers = self._all_flags_request()
+        return self._decode_flat_tree(await self._get_response_from_server_with_retries(request_string, headers))
+
+    async def warm_up(self, manifest=None, timeout=None, batch_size=100):
+        """
+        Resolves the flags and prefixes declared by a manifest into the cache before the service takes traffic, see
+        TongaClient.warm_up. All batches are requested concurrently
+        :param manifest: Manifest to warm up, the manifest of the options by default
+        :type manifest: tonga.manifest.FlagManifest
+        :param timeout: Time in seconds to wait for the flags to be resolved, None means waiting until they are
+        :type timeout: float
+        :param batch_size: Number of flags per request
+        :type batch_size: int
+        :return: Report of the declared flags missing on the server and of those not resolved in time
+        :rtype: tonga.manifest.WarmUpReport
+        :raises ValueError: If neither a manifest is given nor one is set in the options
+        """
+        manifest = self._warm_up_manifest(manifest)
+        start_time = time()
+        units = self._warm_up_units(manifest, batch_size)
+        tasks = [asyncio.ensure_future(self._warm_up(*unit)) for unit in units]
+        # Tasks still running at the deadline are not cancelled and keep filling the cache
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+        unresolved_units = []
+        errors = []
+        for unit, task in zip(units, tasks):
+            if task.done() and task.exception() is None:
+                continue
+            if task.done():
+                errors.append(task.exception())
+            unresolved_units.append(unit)
+        return self._warm_up_report(manifest, unresolved_units, errors, start_time)
+
+    async def _warm_up(self, flags, prefixes):
+        """
+        Resolves the given flags and the flags nested under the given prefixes into the cache
+        """
+        if flags:
+            await self.get_many(flags)
+        if not prefixes:
+            return
+        if self.options.local_rules is not None:
+            await self._update_local_rules_if_needed()
+            await self.get_many(self._local_flags_under(prefixes))
+        elif self.options.pre_fetch and not self.options.pre_fetch_prefix_depth:
+            await self._pre_fetch_once()
+        else:
+            await self.pre_fetch_prefixes(prefixes)
+            self._resolve_all_pending()
+
+    async def pre_fetch_prefixes(self, prefixes):
+        """
+        Pre-fetches all flags nested under the given namespace prefixes (e.g. "routing") in a single request, unless
+        they are already pre-fetched
+        :param prefixes: Namespace prefixes
+        :type prefixes: list[str]
+        """
+        missing_prefixes = [prefix for prefix in self._unique(prefixes) if not self._is_prefix_fetched(prefix)]
+        if missing_prefixes:
+            await self._fetch_prefixes(missing_prefixes)
+
+    async def _fetch_prefixes(self, prefixes):
+        """
+        Fetches the flags nested under the given namespace prefixes from the server
+        :param prefixes: Namespace prefixes
+        :type prefixes: list[str]
+        """
+        self._populate_prefixes(
+            prefixes, await self._get_from_server_with_retries(*self._all_flags_request(prefixes=prefixes))
+        )
+
+    async def _pre_fetch_once(self):
+        """
+        Pre-fetches all flags, concurrent callers share a single request
+        """
+        await self._in_flight.do(_ALL_FLAGS, self._pre_fetch_and_populate_cache)
+
+    async def _pre_fetch_and_populate_cache(self):
+        """
+        Populates the cache with the pre-fetched flags, when refreshing an existing pre-fetch the request is conditional
+        and an unchanged response skips decoding, squashing and rewriting the cache
+        """
+        if not self._load_shared_pre_fetch():
+            etag = self._all_flags_etag if self._pre_fetched else None
+            response = await self._get_response_from_server_with_retries(*self._all_flags_request(etag))
+            self._populate_all_flags(response)
+            self._mark_pre_fetched()
+
+    async def _get_from_server_with_retries(self, request_string, headers):
+        """
+        Fetch request data from the server with retries
+        :param request_string: Request string
+        :type request_string: str
+        :param headers: Request headers
+        :type headers: dict[str, str]
+        :return: Flag value if defined, otherwise None
+        :rtype: dict or None
+        """
+        return self._response_json(await self._get_response_from_server_with_retries(request_string, headers))
+
+    async def _get_response_from_server_with_retries(self, request_string, headers):
+        """
+        Issue a request to the server, retrying failures according to the retry policy while waiting between attempts
+        without blocking the event loop
+        :param request_string: Request string
+        :type request_string: str
+        :param headers: Request headers
+        :type headers: dict[str, str]
+        :return: Server response, None if not found
+        :rtype: requests.Response or None
+        """
+        call_start_time = time()
+        for attempt in count():
+            self._before_attempt()
+            start_time = time()
+            try:
+                response = self._checked_response(
+                    await self._transport.get(request_string, headers, **self._transport_options(call_start_time))
+                )
+                self._on_attempt_succeeded(request_string, response, time() - start_time)
+                return response
+            except requests.exceptions.RequestException:
+                delay = self._on_attempt_failed(request_string, attempt, call_start_time, time() - start_time)
+                # Upon last retry, raise original error
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+            except BaseException:
+                self._on_attempt_interrupted()
+                raise
+            finally:
+                self._add_fetch_latency(time() - start_time)
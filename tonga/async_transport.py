@@ -0,0 +1,118 @@
+import asyncio
+from functools import partial
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from tonga.transport import get_default_transport
+
+
+class AsyncTongaTransport(object):
+    """
+    Base class for the HTTP layer used by the asynchronous client, implementations must be safe to share between clients
+    running on the same event loop
+    """
+
+    async def get(self, url, headers, timeout=None):
+        """
+        Issues a GET request
+        :param url: Full request url including the query string
+        :type url: str
+        :param headers: Request headers
+        :type headers: dict[str, str]
+        :param timeout: Optional time in seconds the request may take, when shorter than the transport timeouts. Only
+        passed by clients whose retry policy has a deadline
+        :type timeout: float
+        :return: Server response
+        :rtype: requests.Response
+        :raises requests.exceptions.Timeout: If the request times out
+        """
+        raise NotImplementedError()
+
+    async def close(self):
+        """
+        Releases any resources (open connections) held by the transport
+        """
+        pass
+
+
+class ExecutorAsyncTransport(AsyncTongaTransport):
+    def __init__(self, transport=None, executor=None):
+        """
+        Runs the requests of a synchronous transport in an executor so they do not block the event loop, by default the
+        process wide pooled transport is used so connections are shared with the synchronous clients
+        :param transport: Synchronous transport to run requests with
+        :type transport: tonga.transport.TongaTransport
+        :param executor: Executor to run requests in, None means the default executor of the event loop
+        :type executor: concurrent.futures.Executor
+        """
+        self.transport = transport or get_default_transport()
+        self.executor = executor
+
+    async def get(self, url, headers, timeout=None):
+        loop = asyncio.get_event_loop()
+        get = self.transport.get if timeout is None else partial(self.transport.get, timeout=timeout)
+        return await loop.run_in_executor(self.executor, get, url, headers)
+
+
+class AiohttpTransport(AsyncTongaTransport):
+    def __init__(self, pool_size=100, connect_timeout=5, read_timeout=30, keep_alive=True):
+        """
+        Native asynchronous transport based on aiohttp (installed with the async extra), the underlying connection pool
+        is bound to the event loop it was first used on
+        :param pool_size: Maximal number of connections kept open per server host
+        :type pool_size: int
+        :param connect_timeout: Timeout in seconds for establishing a connection to the server, None means no timeout
+        :type connect_timeout: float
+        :param read_timeout: Timeout in seconds for waiting on server response data, None means no timeout
+        :type read_timeout: float
+        :param keep_alive: Whether to keep connections open between requests
+        :type keep_alive: bool
+        """
+        import aiohttp  # pylint: disable=import-outside-toplevel
+
+        self._aiohttp = aiohttp
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keep_alive = keep_alive
+        self._session = None
+
+    def _get_session(self):
+        """
+        Lazily creates the session, it has to be created while the event loop is running
+        :rtype: aiohttp.ClientSession
+        """
+        if self._session is None:
+            connector = self._aiohttp.TCPConnector(limit_per_host=self.pool_size, force_close=not self.keep_alive)
+            timeout = self._aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+            self._session = self._aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    async def get(self, url, headers, timeout=None):
+        options = {}
+        if timeout is not None:
+            # Bounds the whole request, on top of the connect and read timeouts of the session
+            options["timeout"] = self._aiohttp.ClientTimeout(
+                total=timeout, sock_connect=self.connect_timeout, sock_read=self.read_timeout
+            )
+        try:
+            async with self._get_session().get(url, headers=headers, **options) as aiohttp_response:
+                content = await aiohttp_response.read()
+        except asyncio.TimeoutError as ex:
+            raise requests.exceptions.Timeout(str(ex))
+        except self._aiohttp.ClientError as ex:
+            raise requests.exceptions.ConnectionError(str(ex))
+        # Expose the same response interface as the synchronous transports
+        response = requests.Response()
+        response.url = url
+        response.status_code = aiohttp_response.status
+        response.reason = aiohttp_response.reason
+        response.headers = CaseInsensitiveDict(aiohttp_response.headers)
+        response._content = content  # pylint: disable=protected-access
+        return response
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
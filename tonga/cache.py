@@ -0,0 +1,69 @@
+from collections import OrderedDict
+from threading import Lock
+from time import time
+
+
+class SharedFlagCache(object):
+    """
+    Thread safe LRU cache of resolved flag values that can be shared by all clients in the process through their
+    options, so clients created with the same context (e.g. a client per incoming request) reuse values fetched by each
+    other instead of fetching them again
+    """
+
+    def __init__(self, max_entries=10000, ttl=None):
+        """
+        :param max_entries: Maximal number of entries to hold, least recently used entries are evicted first
+        :type max_entries: int
+        :param ttl: Time in seconds after which an entry is evicted, None means entries are only evicted by size
+        :type ttl: float
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # Maps key to a tuple of value and expiration time, ordered from least to most recently used
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        """
+        Gets the value stored under the given key
+        :param key: Cache key
+        :type key: collections.Hashable
+        :param default: Value to return if the key is not cached or has expired
+        :type default: Any
+        :rtype: Any
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            value, deadline = entry
+            if deadline is not None and deadline <= time():
+                return default
+            # Re-insert to mark the entry as most recently used
+            self._entries[key] = entry
+            return value
+
+    def set(self, key, value):
+        """
+        Stores a value under the given key, evicting the least recently used entries if the cache is full
+        :param key: Cache key
+        :type key: collections.Hashable
+        :param value: Value to store
+        :type value: Any
+        """
+        deadline = time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, deadline)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Removes all entries
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,16 +1,1280 @@
+# pylint: disable=too-many-lines
 from time import sleep, time
 
+from collections import OrderedDict
 from contextlib import contextmanager
-from copy import deepcopy
+from copy import copy
+from itertools import count, islice
+from multiprocessing.pool import ThreadPool
+from operator import itemgetter
+from threading import Lock, Thread
 
 import urllib
 from typing import Dict, Any
 
 import requests
 import six
+from six.moves.urllib.parse import quote
 
+from tonga.coalescing import SingleFlight
+from tonga.manifest import WarmUpReport
+from tonga.refresher import FlagRefresher
+from tonga.retry import CircuitOpenError, RetryPolicy
+from tonga.rules import FlagRules
+from tonga.snapshot import FlagSnapshot
+from tonga.streaming import FlagSubscriber
+from tonga.transport import get_default_transport
+from tonga.view import FlagView
+from tonga.wire import COMPACT_ACCEPT, decode_flat_tree, decode_response, msgpack
+
+try:
+    from types import MappingProxyType
+except ImportError:
+    # Python 2 has no read only mapping view, attributes are exposed as a copy so mutating them has no effect either
+    MappingProxyType = dict
+
+_MISSING = object()
+# Shared cache key slot under which a whole pre-fetch response is stored
+_ALL_FLAGS = None
+# Marks in flight keys of prefix pre-fetches, so they never collide with flag names
+_PREFIX = object()
+# In flight key of downloading the flag rules
+_RULES = object()
+
+# Url escaped flag names, flag names are few and requested over and over so the cache is only cleared if it grows large
+_quoted_flag_names = {}
+_MAX_QUOTED_FLAG_NAMES = 10000
+
+# Number of distinct contexts whose values a bulk evaluation keeps to reuse for identical contexts of later batches
+_MAX_RESOLVED_CONTEXTS = 10000
+
+
+class BaseTongaClient(object):  # pylint: disable=too-many-instance-attributes
+    """
+    Flag cache, state management and request building shared by the synchronous and asynchronous clients, subclasses
+    implement the interaction with the server
+    """
+
+    # Clients are created per request or context in large numbers and read on hot paths, slots keep them compact and
+    # their attribute access fast. Subclasses must declare slots of their own as well
+    __slots__ = (
+        "server_url", "_context_attributes", "_context_key", "_query_string", "_request_attributes", "_headers",
+        "options", "_flag_cache",
+        "_flag_expiry", "_pre_fetched", "_pre_fetch_deadline", "_all_flags_etag", "_shared_store_generation",
+        "_fetched_prefixes", "_pending_subtrees", "_pending_lock", "_negative_cache", "_lock",
+        "_time_spent_fetching_from_server", "_metrics", "_manifest", "_state_overridden", "__weakref__",
+    )
+
+    def __init__(self, server_url, context_attributes=None, request_attributes=None, options=None):
+        """
+        :param server_url: Server connection string
+        :type server_url: str
+        :param context_attributes: Optional context attributes to be passed on each query
+        :type context_attributes: dict[str, object]
+        :param request_attributes: Optional request attributes to be passed on each query, they do not affect the
+        selected flag but can be used to add extra logging/monitoring information on the server side about this request
+        :type request_attributes: dict[str, str]
+        :param options: Client optional configuration
+        :type options: TongaClientOptions
+        """
+        self.server_url = server_url
+        self.context_attributes = context_attributes or {}
+        self.request_attributes = request_attributes or {}
+        self.options = options or TongaClientOptions()
+        self._flag_cache = {}
+        # Expiration time of flags fetched from the server, only populated when a ttl is configured
+        self._flag_expiry = {}
+        self._pre_fetched = False
+        self._pre_fetch_deadline = None
+        # ETag of the last pre-fetched all flags response, used to skip refreshes when nothing changed
+        self._all_flags_etag = None
+        # Generation of the shared store pre-fetch currently cached, 0 if none
+        self._shared_store_generation = 0
+        # Expiration time (None for never) of each namespace prefix pre-fetched so far
+        self._fetched_prefixes = {}
+        # Pre-fetched subtrees not flattened into the cache yet, by their prefix, along with their expiration time
+        self._pending_subtrees = {}
+        self._pending_lock = Lock()
+        # Expiration time of each flag found to be missing on the server, only used when negative caching is enabled
+        self._negative_cache = {}
+        self._lock = Lock()
+        self._time_spent_fetching_from_server = 0
+        self._metrics = self.options.metrics
+        self._manifest = self.options.manifest
+        # Whether the cached flags were overridden by set_state, overridden state is never persisted to snapshots
+        self._state_overridden = False
+
+    @property
+    def context_attributes(self):
+        """
+        Context attributes passed on each query, read only as the query string is encoded when they are set. Assign new
+        attributes to change them
+        :rtype: collections.Mapping[str, object]
+        """
+        return self._context_attributes
+
+    @context_attributes.setter
+    def context_attributes(self, context_attributes):
+        # Copied so later changes to the given dict cannot diverge from the encoded context
+        self._context_attributes = MappingProxyType(dict(context_attributes))
+        # Normalized encoding of the context, used both as the request query string and as the shared cache key
+        self._context_key = self._encode_context(context_attributes)
+        self._query_string = u"?" + self._context_key if self._context_key else ""
+
+    @property
+    def request_attributes(self):
+        """
+        Request attributes passed on each query, read only as the headers are encoded when they are set. Assign new
+        attributes to change them
+        :rtype: collections.Mapping[str, str]
+        """
+        return self._request_attributes
+
+    @request_attributes.setter
+    def request_attributes(self, request_attributes):
+        self._request_attributes = MappingProxyType(dict(request_attributes))
+        # Headers are encoded once rather than on every request and retry attempt
+        self._headers = {
+            u"X-Tonga-{key}".format(key=key): six.ensure_str(six.text_type(value))
+            for key, value in request_attributes.items()
+            if value is not None
+        }
+
+    @classmethod
+    def _encode_context(cls, context_attributes):
+        """
+        Normalized url encoding of the given context attributes, equal for equal contexts
+        :type context_attributes: dict[str, object]
+        :rtype: str
+        """
+        return cls._url_encode(sorted(context_attributes.items(), key=itemgetter(0)))
+
+    def _is_expired(self, flag):
+        """
+        Checks whether the cached value of the given flag has passed its ttl
+        :type flag: str
+        :rtype: bool
+        """
+        deadline = self._flag_expiry.get(flag)
+        return deadline is not None and deadline <= time()
+
+    def _is_fresh(self, flag):
+        """
+        Checks whether the given flag is cached and has not passed its ttl
+        :type flag: str
+        :rtype: bool
+        """
+        return flag in self._flag_cache and not (self._flag_expiry and self._is_expired(flag))
+
+    def _is_known_missing(self, flag):
+        """
+        Checks whether the given flag was found to be missing on the server within the negative cache ttl
+        :type flag: str
+        :rtype: bool
+        """
+        deadline = self._negative_cache.get(flag)
+        return deadline is not None and deadline > time()
+
+    def _negative_entry_expired(self, flag):
+        """
+        Checks whether the given flag was found to be missing on the server and its negative cache ttl has passed, in
+        which case it should be looked up again
+        :type flag: str
+        :rtype: bool
+        """
+        deadline = self._negative_cache.get(flag)
+        return deadline is not None and deadline <= time()
+
+    def _store_missing_flags(self, flags):
+        """
+        Caches the given flags as missing on the server until the negative cache ttl passes, dropping any value
+        previously cached for them
+        :param flags: Flag names
+        :type flags: list[str]
+        """
+        deadline = time() + self.options.negative_cache_ttl
+        for flag in flags:
+            self._flag_cache.pop(flag, None)
+            self._flag_expiry.pop(flag, None)
+            self._negative_cache[flag] = deadline
+
+    def _renew_negative_cache(self):
+        """
+        Restarts the negative cache ttl of the flags still missing after a pre-fetch of all flags
+        """
+        if self._negative_cache:
+            deadline = time() + self.options.negative_cache_ttl
+            # Readers add flags concurrently, iterate over a copy
+            self._negative_cache = {
+                flag: deadline for flag in list(self._negative_cache) if flag not in self._flag_cache
+            }
+
+    def _get_cached_value(self, flag):
+        """
+        Gets a flag value from the cache once it was fetched, a flag that is still not cached is missing on the server
+        and is negatively cached if enabled
+        :param flag: Flag name
+        :type flag: str
+        :return: Flag value if defined, otherwise None
+        :rtype: Any
+        """
+        value = self._resolve_pending_flag(flag)
+        if (
+                value is None and self.options.negative_cache_ttl is not None and flag not in self._negative_cache
+                and flag not in self._flag_cache
+        ):
+            self._store_missing_flags([flag])
+        return value
+
+    def _get_offline_values(self, flags, offline_values):
+        """
+        Gets the values of the given flags in offline mode
+        :param flags: Flag names
+        :type flags: list[str]
+        :param offline_values: Which values to return for each flag that is not in the state
+        :type offline_values: dict[str, Any]
+        :rtype: dict[str, Any]
+        """
+        offline_values = offline_values or {}
+        return {flag: self._flag_cache.get(flag, offline_values.get(flag)) for flag in flags}
+
+    @staticmethod
+    def _unique(flags):
+        """
+        Removes duplicate flags while keeping the original order
+        :type flags: list[str]
+        :rtype: list[str]
+        """
+        seen = set()
+        return [flag for flag in flags if not (flag in seen or seen.add(flag))]
+
+    def _shared_cache_key(self, flag):
+        """
+        Key of the given flag in the shared cache, values are shared between clients of the same server and context
+        :type flag: str
+        :rtype: tuple
+        """
+        return self.server_url, self._context_key, flag
+
+    def _get_shared_entry(self, flag):
+        """
+        Gets the value of the given flag from the shared cache, along with the time it was fetched from the server. A
+        value fetched longer ago than the ttl of this client is ignored, so sharing never extends the ttl
+        :param flag: Flag name
+        :type flag: str
+        :return: Tuple of the value and its fetch time, None if there is no shared cache or no fresh value in it
+        :rtype: tuple[Any, float] or None
+        """
+        if self.options.shared_cache is None:
+            return None
+        entry = self.options.shared_cache.get(self._shared_cache_key(flag))
+        if entry is None:
+            return None
+        ttl = self._pre_fetch_ttl() if flag is _ALL_FLAGS else self._flag_ttl(flag)
+        if ttl is not None and entry[1] + ttl <= time():
+            return None
+        return entry
+
+    def _set_shared_value(self, flag, value):
+        """
+        Stores a value just fetched from the server in the shared cache if there is one
+        :param flag: Flag name
+        :type flag: str
+        :param value: Flag value
+        :type value: Any
+        """
+        if self.options.shared_cache is not None:
+            self.options.shared_cache.set(self._shared_cache_key(flag), (value, time()))
+
+    def _load_shared_values(self, flags):
+        """
+        Populates the cache with the given flags found in the shared cache
+        :param flags: Flag names
+        :type flags: list[str]
+        :return: Flags that are not in the shared cache
+        :rtype: list[str]
+        """
+        if self.options.shared_cache is None:
+            return flags
+        missing_flags = []
+        for flag in flags:
+            entry = self._get_shared_entry(flag)
+            if entry is None:
+                missing_flags.append(flag)
+            else:
+                self._store_fetched_values({flag: entry[0]}, fetched_at=entry[1])
+        return missing_flags
+
+    def _store_server_values(self, values):
+        """
+        Stores flag values fetched from the server in the cache and the shared cache
+        :param values: Flag values
+        :type values: dict[str, Any]
+        """
+        self._store_fetched_values(values)
+        for flag, value in values.items():
+            self._set_shared_value(flag, value)
+        self._save_snapshot(self._pre_fetched)
+
+    def _load_snapshot(self):
+        """
+        Populates the cache from the snapshot of this server and context if there is one
+        :return: Whether a snapshot was loaded
+        :rtype: bool
+        """
+        snapshot_store = self.options.snapshot_store
+        snapshot = snapshot_store.load(self.server_url, self._context_key) if snapshot_store is not None else None
+        if snapshot is None:
+            return False
+        self._store_fetched_values(snapshot.flags)
+        if snapshot.pre_fetched:
+            self._all_flags_etag = snapshot.etag
+            self._mark_pre_fetched()
+        return True
+
+    def _save_snapshot(self, pre_fetched):
+        """
+        Schedules persisting the cached flags as the snapshot of this server and context if a snapshot store is
+        configured. The write is delayed and done in the background, so a burst of cache misses is persisted once
+        :param pre_fetched: Whether the cached flags are a pre-fetch of all flags
+        :type pre_fetched: bool
+        """
+        snapshot_store = self.options.snapshot_store
+        if snapshot_store is not None and not self._state_overridden:
+            snapshot_store.schedule_save(self.server_url, self._context_key, lambda: self._take_snapshot(pre_fetched))
+
+    def _take_snapshot(self, pre_fetched):
+        """
+        Takes a snapshot of the cached flags
+        :param pre_fetched: Whether the cached flags are a pre-fetch of all flags
+        :type pre_fetched: bool
+        :return: The snapshot, None while the state is overridden by set_state as it does not come from the server
+        :rtype: FlagSnapshot or None
+        """
+        if self._state_overridden:
+            return None
+        return FlagSnapshot(dict(self._flag_cache), time(), pre_fetched, self._all_flags_etag)
+
+    def _is_pre_fetch_expired(self):
+        """
+        Checks whether the pre-fetched flags have passed the cache ttl
+        :rtype: bool
+        """
+        return self._pre_fetch_deadline is not None and self._pre_fetch_deadline <= time()
+
+    def _needs_pre_fetch(self):
+        """
+        Checks whether there is no valid pre-fetch of all flags
+        :rtype: bool
+        """
+        return not self._pre_fetched or self._is_pre_fetch_expired()
+
+    def _flag_ttl(self, flag):
+        """
+        Returns the ttl in seconds of the given flag, None if it should be cached forever
+        :type flag: str
+        :rtype: float or None
+        """
+        return self.options.flag_ttls.get(flag, self.options.cache_ttl)
+
+    def _pre_fetch_ttl(self, prefix=None):
+        """
+        Returns the ttl in seconds of a pre-fetch, the shortest ttl of the flags it covers since they are all refreshed
+        by a single request
+        :param prefix: Pre-fetched namespace prefix, None for a pre-fetch of all flags
+        :type prefix: str
+        :rtype: float or None
+        """
+        if prefix is None:
+            return self.options.min_ttl
+        nested_prefix = prefix + u"."
+        ttls = [
+            ttl for flag, ttl in self.options.flag_ttls.items() if flag == prefix or flag.startswith(nested_prefix)
+        ]
+        if self.options.cache_ttl is not None:
+            ttls.append(self.options.cache_ttl)
+        return min(ttls) if ttls else None
+
+    def _store_fetched_values(self, values, fetched_at=None):
+        """
+        Stores flag values fetched from the server in the cache, tracking their expiration if a ttl is configured
+        :param values: Flag values
+        :type values: dict[str, Any]
+        :param fetched_at: Time the values were fetched from the server, defaults to now
+        :type fetched_at: float
+        """
+        self._flag_cache.update(values)
+        if self._negative_cache:
+            for flag in values:
+                self._negative_cache.pop(flag, None)
+        self._track_expiry(values, fetched_at)
+
+    def _track_expiry(self, flags, fetched_at=None):
+        """
+        Sets the expiration of the given flags according to their ttl
+        :param flags: Flag names
+        :type flags: collections.Iterable[str]
+        :param fetched_at: Time the values were fetched from the server, defaults to now
+        :type fetched_at: float
+        """
+        if not self.options.has_ttl:
+            return
+        fetched_at = time() if fetched_at is None else fetched_at
+        for flag in flags:
+            ttl = self._flag_ttl(flag)
+            if ttl is not None:
+                self._flag_expiry[flag] = fetched_at + ttl
+        self._start_refresher_if_needed()
+
+    def _start_refresher_if_needed(self):
+        """
+        Called whenever values with a ttl are cached, clients supporting background refresh start it here
+        """
+        pass
+
+    def _load_shared_pre_fetch(self):
+        """
+        Populates the cache from a pre-fetch of another client with the same context found in the shared cache, marking
+        it pre-fetched as of the time the other client fetched it
+        :return: Whether a shared pre-fetch within the cache ttl was found
+        :rtype: bool
+        """
+        shared_pre_fetch = None if self._pre_fetched else self._get_shared_entry(_ALL_FLAGS)
+        if shared_pre_fetch is None:
+            return False
+        (pre_fetched_flags, self._all_flags_etag), fetched_at = shared_pre_fetch
+        self._store_fetched_values(pre_fetched_flags, fetched_at)
+        self._mark_pre_fetched(fetched_at)
+        return True
+
+    def _mark_pre_fetched(self, fetched_at=None):
+        """
+        Marks that all flags were pre-fetched into the cache
+        :param fetched_at: Time the flags were fetched from the server, defaults to now
+        :type fetched_at: float
+        """
+        self._pre_fetched = True
+        ttl = self._pre_fetch_ttl()
+        if ttl is not None:
+            self._pre_fetch_deadline = (time() if fetched_at is None else fetched_at) + ttl
+
+    def _load_shared_store(self):
+        """
+        Populates the cache from the pre-fetch published to the shared store by any process of the host. A stale
+        pre-fetch is loaded as well, so refreshing it is a conditional request for exactly what the store holds
+        :return: Whether the pre-fetch was verified against the server within the cache ttl
+        :rtype: bool
+        """
+        shared_store = self.options.shared_store
+        if shared_store is None:
+            return False
+        generation, verified_at, snapshot = shared_store.read(
+            self.server_url, self._context_key, self._shared_store_generation
+        )
+        if snapshot is not None:
+            # Swap the cache at once so readers never see a partially replaced state, the snapshot is shared by the
+            # clients of the process so it is copied
+            self._flag_cache = dict(snapshot.flags)
+            self._flag_expiry = {}
+            self._all_flags_etag = snapshot.etag
+            self._shared_store_generation = generation
+        if not generation or generation != self._shared_store_generation:
+            return False
+        self._track_expiry(list(self._flag_cache), verified_at)
+        ttl = self._pre_fetch_ttl()
+        if ttl is not None and verified_at + ttl <= time():
+            return False
+        self._renew_negative_cache()
+        self._mark_pre_fetched(verified_at)
+        return True
+
+    def _publish_shared_store(self, pre_fetched_flags):
+        """
+        Publishes a pre-fetch to the shared store, must be called while holding its refresh lock
+        :param pre_fetched_flags: Flattened pre-fetched flags, None if they did not change since the previous pre-fetch
+        :type pre_fetched_flags: dict[str, Any] or None
+        """
+        shared_store = self.options.shared_store
+        if pre_fetched_flags is None and self._shared_store_generation:
+            shared_store.touch(self.server_url, self._context_key)
+            return
+        if pre_fetched_flags is None:
+            pre_fetched_flags = dict(self._flag_cache)
+        self._shared_store_generation = shared_store.publish(
+            self.server_url, self._context_key, pre_fetched_flags, self._all_flags_etag
+        )
+
+    def _all_flags_request(self, etag=None, flags=None, prefixes=None):
+        """
+        Builds a request for the all flags endpoint
+        :param etag: Optional ETag of a previous response, if the flags did not change since then the server responds
+        with 304 (not modified) and no content
+        :type etag: str
+        :param flags: Optional flag names to filter the response to
+        :type flags: list[str]
+        :param prefixes: Optional namespace prefixes to filter the response to the flags nested under them
+        :type prefixes: list[str]
+        :return: Request string and headers
+        :rtype: tuple[str, dict[str, str]]
+        """
+        extra_params = [("flags", flag) for flag in flags or ()] + [("prefix", prefix) for prefix in prefixes or ()]
+        request_string = u"{server_url}/all_flags_values".format(server_url=self.server_url)
+        request_string += self._build_query_string(extra_params=extra_params)
+        headers = self._build_headers()
+        if etag is not None:
+            headers[u"If-None-Match"] = etag
+        if self.options.compact_encoding and msgpack is not None:
+            headers[u"Accept"] = COMPACT_ACCEPT
+        return request_string, headers
+
+    def _stream_request(self, last_event_id=None):
+        """
+        Builds a request for the server-sent events stream of flag updates
+        :param last_event_id: Id of the last received event to resume the stream from, if the server cannot resume from
+        it the stream starts with a snapshot of all flags
+        :type last_event_id: str
+        :return: Request string and headers
+        :rtype: tuple[str, dict[str, str]]
+        """
+        request_string = u"{server_url}/flags_stream".format(server_url=self.server_url)
+        request_string += self._build_query_string()
+        headers = self._build_headers()
+        headers[u"Accept"] = u"text/event-stream"
+        if last_event_id is not None:
+            headers[u"Last-Event-ID"] = last_event_id
+        return request_string, headers
+
+    def _flag_value_request(self, flag):
+        """
+        Builds a request for the value of a single flag
+        :param flag: Flag name
+        :type flag: str
+        :return: Request string and headers
+        :rtype: tuple[str, dict[str, str]]
+        """
+        quoted_flag = _quoted_flag_names.get(flag)
+        if quoted_flag is None:
+            if len(_quoted_flag_names) >= _MAX_QUOTED_FLAG_NAMES:
+                _quoted_flag_names.clear()
+            quoted_flag = _quoted_flag_names[flag] = quote(six.ensure_str(flag), safe="")
+        return self.server_url + u"/flag_value/" + quoted_flag + self._query_string, dict(self._headers)
+
+    def _rules_request(self, etag=None):
+        """
+        Builds a request for the flag rules endpoint, the rules do not depend on the context
+        :param etag: Optional ETag of the current rules
+        :type etag: str
+        :return: Request string and headers
+        :rtype: tuple[str, dict[str, str]]
+        """
+        headers = self._build_headers()
+        if etag is not None:
+            headers[u"If-None-Match"] = etag
+        return u"{server_url}/flags_rules".format(server_url=self.server_url), headers
+
+    def _update_local_rules(self, response):
+        """
+        Updates the local rules from a flag rules response
+        :param response: Server response, None if not found
+        :type response: requests.Response or None
+        :raises requests.exceptions.HTTPError: If the server does not serve flag rules
+        """
+        local_rules = self.options.local_rules
+        if response is None:
+            raise requests.exceptions.HTTPError(
+                u"{server_url} does not serve flag rules".format(server_url=self.server_url)
+            )
+        if response.status_code == 304:
+            local_rules.update(None)
+        else:
+            local_rules.update(self._response_json(response), response.headers.get("ETag"))
+
+    def _store_local_values(self, flags):
+        """
+        Evaluates the given flags with the local rules for the context of the client and caches them, flags not defined
+        for the context are handled like flags missing on the server
+        :param flags: Flag names
+        :type flags: list[str]
+        """
+        rules = self.options.local_rules.rules
+        context = FlagRules.normalize_context(self._context_attributes)
+        values = {}
+        missing_flags = []
+        for flag in flags:
+            value = rules.evaluate(flag, context, _MISSING)
+            if value is _MISSING:
+                missing_flags.append(flag)
+            else:
+                values[flag] = value
+        if self.options.negative_cache_ttl is not None:
+            self._store_missing_flags(missing_flags)
+        else:
+            values.update(dict.fromkeys(missing_flags))
+        self._store_fetched_values(values)
+
+    def _store_flag_value_response(self, flag, response_json):
+        """
+        Stores the value of a flag out of a flag value response
+        :param flag: Flag name
+        :type flag: str
+        :param response_json: Flag value response, None if the flag was not found
+        :type response_json: dict[str, Any] or None
+        :return: Flag value if defined, otherwise None
+        :rtype: Any
+        """
+        if response_json is None and self.options.negative_cache_ttl is not None:
+            self._store_missing_flags([flag])
+            return None
+        value = response_json.get("value") if response_json else None
+        self._store_server_values({flag: value})
+        return value
+
+    def _store_flag_values_response(self, flags, response_json):
+        """
+        Stores the values of the given flags out of a filtered all flags response, flags missing from the response are
+        negatively cached if enabled and otherwise cached as None
+        :param flags: Flag names
+        :type flags: list[str]
+        :param response_json: Nested all flags response
+        :type response_json: dict[str, Any] or None
+        """
+        squashed_response = self._squash_response(response_json)
+        if self.options.negative_cache_ttl is None:
+            self._store_server_values({flag: squashed_response.get(flag) for flag in flags})
+            return
+        self._store_missing_flags([flag for flag in flags if flag not in squashed_response])
+        self._store_server_values({flag: squashed_response[flag] for flag in flags if flag in squashed_response})
+
+    def _populate_all_flags(self, response):
+        """
+        Populates the cache and the shared cache from an all flags response
+        :param response: Server response, None if not found
+        :type response: requests.Response or None
+        :return: Flattened pre-fetched flags, None if they did not change since the previous pre-fetch
+        :rtype: dict[str, Any] or None
+        """
+        pre_fetched_flags = None
+        if response is not None and response.status_code == 304:
+            # Cached flags are still up to date, only extend their expiration
+            self._track_expiry(list(self._flag_expiry))
+        else:
+            self._all_flags_etag = response.headers.get("ETag") if response is not None else None
+            pre_fetched_flags = self._decode_flat_tree(response)
+            self._store_fetched_values(pre_fetched_flags)
+            self._set_shared_value(_ALL_FLAGS, (pre_fetched_flags, self._all_flags_etag))
+        self._renew_negative_cache()
+        # Saved on 304 as well so the snapshot timestamp reflects the last time the flags were verified
+        self._save_snapshot(pre_fetched=True)
+        return pre_fetched_flags
+
+    @staticmethod
+    def _name_prefixes(flag):
+        """
+        Yields the prefixes of a dotted flag name from the shortest one, ending with the name itself
+        :type flag: str
+        :rtype: collections.Iterator[str]
+        """
+        index = flag.find(u".")
+        while index != -1:
+            yield flag[:index]
+            index = flag.find(u".", index + 1)
+        yield flag
+
+    def _is_prefix_fetched(self, name):
+        """
+        Checks whether the given name is covered by a valid prefix pre-fetch
+        :param name: Flag name or namespace prefix
+        :type name: str
+        :rtype: bool
+        """
+        if not self._fetched_prefixes:
+            return False
+        now = time()
+        for prefix in self._name_prefixes(name):
+            deadline = self._fetched_prefixes.get(prefix, _MISSING)
+            if deadline is not _MISSING and (deadline is None or deadline > now):
+                return True
+        return False
+
+    def _needs_prefix_pre_fetch(self, flag):
+        """
+        Checks whether the namespace of the given flag should be pre-fetched before reading it, either because it was
+        not pre-fetched yet or because the flag was missing from it and its negative cache ttl has passed
+        :type flag: str
+        :rtype: bool
+        """
+        return not self._is_prefix_fetched(flag) or self._negative_entry_expired(flag)
+
+    def _prefixes_to_pre_fetch(self, flags):
+        """
+        Returns the namespace prefixes to pre-fetch before reading the given flags, a prefix is made of the first
+        pre_fetch_prefix_depth parts of the flag name
+        :param flags: Flag names
+        :type flags: list[str]
+        :rtype: list[str]
+        """
+        depth = self.options.pre_fetch_prefix_depth
+        prefixes = (u".".join(flag.split(u".")[:depth]) for flag in flags if self._needs_prefix_pre_fetch(flag))
+        return self._unique(prefixes)
+
+    def _populate_prefixes(self, prefixes, response_json):
+        """
+        Remembers the subtrees of pre-fetched prefixes, their flags are only flattened into the cache once read
+        :param prefixes: Pre-fetched namespace prefixes
+        :type prefixes: list[str]
+        :param response_json: Nested flag tree filtered to the prefixes
+        :type response_json: dict[str, Any] or None
+        """
+        now = time()
+        expiring = False
+        with self._pending_lock:
+            for prefix in prefixes:
+                # Flags under the prefix expire along with it, so its ttl is the shortest ttl of the flags it covers
+                ttl = self._pre_fetch_ttl(prefix)
+                deadline = now + ttl if ttl is not None else None
+                expiring = expiring or deadline is not None
+                subtree = response_json
+                for part in prefix.split(u"."):
+                    subtree = subtree.get(part) if isinstance(subtree, dict) else None
+                self._forget_prefix(prefix)
+                if isinstance(subtree, dict):
+                    self._pending_subtrees[prefix] = subtree, deadline
+                elif subtree is not None:
+                    self._cache_pending_value(prefix, subtree, deadline)
+                self._fetched_prefixes[prefix] = deadline
+        if expiring:
+            self._start_refresher_if_needed()
+
+    def _forget_prefix(self, prefix):
+        """
+        Drops the cached, pending and negatively cached flags under the given prefix, must be called while holding the
+        pending lock
+        :type prefix: str
+        """
+        nested_prefix = prefix + u"."
+        # Readers not holding the lock write to the caches concurrently, iterate over copies
+        for flag in [flag for flag in list(self._flag_cache) if flag == prefix or flag.startswith(nested_prefix)]:
+            self._flag_cache.pop(flag, None)
+            self._flag_expiry.pop(flag, None)
+        for pending_prefix in [name for name in self._pending_subtrees if name.startswith(nested_prefix)]:
+            del self._pending_subtrees[pending_prefix]
+        for flag in [flag for flag in list(self._negative_cache) if flag == prefix or flag.startswith(nested_prefix)]:
+            self._negative_cache.pop(flag, None)
+
+    def _cache_pending_value(self, flag, value, deadline):
+        """
+        Caches a value flattened out of a pending subtree, it expires along with the pre-fetch it came from
+        """
+        self._flag_cache[flag] = value
+        if deadline is not None:
+            self._flag_expiry[flag] = deadline
+
+    def _expand_pending_subtree(self, prefix):
+        """
+        Flattens a single level of a pending subtree, nested subtrees stay pending under their own prefix. Must be
+        called while holding the pending lock
+        :type prefix: str
+        """
+        subtree, deadline = self._pending_subtrees.pop(prefix)
+        for key, value in subtree.items():
+            name = prefix + u"." + key
+            if isinstance(value, dict):
+                self._pending_subtrees[name] = value, deadline
+            else:
+                self._cache_pending_value(name, value, deadline)
+
+    def _resolve_pending_flag(self, flag):
+        """
+        Gets a flag value from the cache, first flattening the pending subtrees on its path if there are any
+        :param flag: Flag name
+        :type flag: str
+        :return: Flag value if defined, otherwise None
+        :rtype: Any
+        """
+        if self._pending_subtrees:
+            with self._pending_lock:
+                for prefix in self._name_prefixes(flag):
+                    if prefix in self._pending_subtrees:
+                        self._expand_pending_subtree(prefix)
+        return self._flag_cache.get(flag)
+
+    def _resolve_all_pending(self):
+        """
+        Flattens all pending subtrees into the cache
+        """
+        if self._pending_subtrees:
+            with self._pending_lock:
+                while self._pending_subtrees:
+                    self._expand_pending_subtree(next(iter(self._pending_subtrees)))
+
+    def _replace_pre_fetch(self, response_json):
+        """
+        Replaces the cached flags with a full flag tree pushed by the server
+        :param response_json: Nested flag tree
+        :type response_json: dict[str, Any]
+        """
+        pre_fetched_flags = self._squash_response(response_json)
+        # Swap the cache at once so readers never see a partially replaced state
+        self._flag_cache = pre_fetched_flags
+        self._flag_expiry = {}
+        self._all_flags_etag = None
+        self._track_expiry(pre_fetched_flags)
+        self._mark_pre_fetched()
+        self._publish_pre_fetch()
+
+    def _apply_flag_diff(self, diff):
+        """
+        Applies an incremental update pushed by the server to the pre-fetched flags. The diff holds a nested tree of
+        changed values under "set" and the dotted names of removed flags under "unset", removing a name removes all
+        flags nested under it as well
+        :param diff: Flag diff
+        :type diff: dict[str, Any]
+        """
+        if not self._pre_fetched:
+            # A diff is meaningless without the state it applies to, the next get pre-fetches all flags
+            return
+        removed = set(diff.get("unset") or ())
+        if removed:
+            removed_prefixes = tuple(name + "." for name in removed)
+            for flag in list(self._flag_cache):
+                if flag in removed or flag.startswith(removed_prefixes):
+                    self._flag_cache.pop(flag, None)
+                    self._flag_expiry.pop(flag, None)
+        changed = diff.get("set")
+        self._store_fetched_values(self._squash_response(changed))
+        # The cache no longer matches the last all flags response
+        self._all_flags_etag = None
+        self._mark_pre_fetched()
+        self._publish_pre_fetch()
+
+    def _extend_pre_fetch(self):
+        """
+        Extends the expiration of the pre-fetched flags, called while the server confirms they are up to date
+        """
+        if self._pre_fetched:
+            self._track_expiry(list(self._flag_expiry))
+            self._mark_pre_fetched()
+
+    def _publish_pre_fetch(self):
+        """
+        Publishes the pre-fetched flags to the shared cache and the snapshot store
+        """
+        self._set_shared_value(_ALL_FLAGS, (dict(self._flag_cache), self._all_flags_etag))
+        self._save_snapshot(pre_fetched=True)
+
+    def _response_json(self, response):
+        """
+        Decodes the json (or msgpack) body of a server response
+        :param response: Server response, None if not found
+        :type response: requests.Response or None
+        :rtype: dict or None
+        """
+        if response is None:
+            return None
+        return self._timed_parse(lambda: decode_response(response))
+
+    def _decode_flat_tree(self, response):
+        """
+        Decodes an all flags response straight into flattened flag values
+        :param response: Server response, None if not found
+        :type response: requests.Response or None
+        :rtype: dict[str, Any]
+        """
+        if response is None:
+            return {}
+        return self._timed_parse(lambda: decode_flat_tree(response))
+
+    def _squash_response(self, response_json):
+        """
+        Flattens a nested flag tree response
+        :param response_json: Nested flag tree
+        :type response_json: dict[str, Any] or None
+        :rtype: dict[str, Any]
+        """
+        if not response_json:
+            return {}
+        return self._timed_parse(lambda: self._recursive_squash_response_dict(response_json))
+
+    def _timed_parse(self, parse):
+        """
+        Runs the given parsing function, recording its duration when metrics are enabled
+        :type parse: () -> Any
+        :rtype: Any
+        """
+        if self._metrics is None:
+            return parse()
+        start_time = time()
+        try:
+            return parse()
+        finally:
+            self._metrics.record_parse(time() - start_time)
+
+    def _find_missing_flags(self, flags, include_expired=True):
+        """
+        Finds which of the given flags are not cached, recording the cache hits and misses if metrics are enabled and
+        the reads if a manifest is given
+        :param flags: Flag names, may contain duplicates
+        :type flags: list[str]
+        :param include_expired: Whether flags whose cached value has passed its ttl count as missing
+        :type include_expired: bool
+        :return: Unique flags missing from the cache
+        :rtype: list[str]
+        """
+        unique_flags = self._unique(flags)
+        if self._manifest is not None:
+            for flag in unique_flags:
+                self._manifest.record_read(flag)
+        is_cached = self._is_fresh if include_expired else self._flag_cache.__contains__
+        missing_flags = [flag for flag in unique_flags if not is_cached(flag) and not self._is_known_missing(flag)]
+        if self._metrics is not None:
+            missing_set = set(missing_flags)
+            for flag in unique_flags:
+                if flag in missing_set:
+                    self._metrics.record_miss(flag)
+                elif flag in self._flag_cache:
+                    self._metrics.record_hit(flag)
+                else:
+                    self._metrics.record_negative_hit(flag)
+        return missing_flags
+
+    def _recursive_squash_response_dict(
+            self,
+            flag_response,  # type: Dict[str, Any]
+            prefix="",  # type: str
+    ):  # type: (...) -> Dict[str, Any]
+        """
+        Squash a nested response dictionary into a single level dictionary with the full flag names
+        """
+        squashed_dict = {}
+        # The pre-fetched is a dictionary with any depth, so we need to recursively populate the cache and add the
+        # prefix to the keys in order to flatten the structure into a single level dictionary with the full flag names
+        for key, value in flag_response.items():
+            if not isinstance(value, dict):
+                squashed_dict[prefix + key] = value
+            else:
+                # Recursively populate the cache
+                squashed_dict.update(self._recursive_squash_response_dict(value, prefix + key + "."))
+        return squashed_dict
+
+    @staticmethod
+    def _checked_response(response):
+        """
+        Validates a server response
+        :param response: Server response
+        :type response: requests.Response
+        :return: The response, None if not found
+        :rtype: requests.Response or None
+        :raises requests.exceptions.HTTPError: If the response has an error status
+        """
+        if response.status_code == 404:
+            return None
+        # Check for error code
+        response.raise_for_status()
+        return response
+
+    def _before_attempt(self):
+        """
+        Called before each request attempt
+        :raises CircuitOpenError: If the circuit breaker does not allow issuing the request
+        """
+        breaker = self.options.circuit_breaker
+        if breaker is not None and not breaker.allow_request():
+            raise CircuitOpenError(u"Circuit breaker of {server_url} is open".format(server_url=self.server_url))
+
+    def _transport_options(self, call_start_time):
+        """
+        Keyword arguments of the transport request of the next attempt, bounding it by the retry policy deadline
+        :param call_start_time: Time the first attempt started
+        :type call_start_time: float
+        :rtype: dict[str, float]
+        """
+        timeout = self.options.retry_policy.attempt_timeout(time() - call_start_time)
+        return {} if timeout is None else {"timeout": timeout}
+
+    def _on_attempt_succeeded(self, request_string, response, elapsed):
+        """
+        Called after each successful request attempt
+        :param request_string: Request string
+        :type request_string: str
+        :param response: Server response, None if not found
+        :type response: requests.Response or None
+        :param elapsed: Duration of the attempt in seconds
+        :type elapsed: float
+        """
+        if self.options.circuit_breaker is not None:
+            self.options.circuit_breaker.record_success()
+        if self._metrics is not None:
+            bytes_received = len(response.content) if response is not None else 0
+            self._metrics.record_request(self._endpoint_name(request_string), elapsed, bytes_received)
+
+    def _on_attempt_failed(self, request_string, attempt, call_start_time, elapsed):
+        """
+        Called after each failed request attempt
+        :param request_string: Request string
+        :type request_string: str
+        :param attempt: Zero based index of the failed attempt
+        :type attempt: int
+        :param call_start_time: Time the first attempt started
+        :type call_start_time: float
+        :param elapsed: Duration of the attempt in seconds
+        :type elapsed: float
+        :return: Delay in seconds before retrying, None if the request should not be retried
+        :rtype: float or None
+        """
+        if self.options.circuit_breaker is not None:
+            self.options.circuit_breaker.record_failure()
+        delay = self.options.retry_policy.next_delay(attempt, time() - call_start_time)
+        if self._metrics is not None:
+            endpoint = self._endpoint_name(request_string)
+            self._metrics.record_request(endpoint, elapsed, failed=True)
+            if delay is not None:
+                self._metrics.record_retry(endpoint)
+        return delay
+
+    def _on_attempt_interrupted(self):
+        """
+        Called when a request attempt is interrupted by an error other than a request error, e.g. cancellation
+        """
+        if self.options.circuit_breaker is not None:
+            self.options.circuit_breaker.release_probe()
+
+    def _endpoint_name(self, request_string):
+        """
+        Extracts the endpoint name (e.g. flag_value) out of a request string
+        :type request_string: str
+        :rtype: str
+        """
+        path = request_string[len(self.server_url):].split(u"?", 1)[0]
+        return path.lstrip(u"/").split(u"/", 1)[0]
+
+    def _add_fetch_latency(self, elapsed):
+        """
+        Accumulates time spent waiting on the server
+        :param elapsed: Time in seconds
+        :type elapsed: float
+        """
+        with self._lock:
+            self._time_spent_fetching_from_server += elapsed
+
+    def _build_query_string(self, extra_params=None):
+        """
+        Creates a query string from the context attributes
+        :param extra_params: Optional extra query parameters to append after the context attributes
+        :type extra_params: list[tuple[str, str]]
+        :return: Query string to attach to the request url
+        :rtype: str
+        """
+        if not extra_params:
+            return self._query_string
+        extra_query_string = self._url_encode(extra_params)
+        return u"?" + (self._context_key + u"&" + extra_query_string if self._context_key else extra_query_string)
+
+    @staticmethod
+    def _url_encode(params):
+        """
+        Encodes the given parameters as a url query string
+        :param params: Query parameters
+        :type params: list[tuple[str, object]]
+        :rtype: str
+        """
+        if six.PY2:
+            return urllib.urlencode(params)  # pylint: disable=maybe-no-member
+        return urllib.parse.urlencode(params)
+
+    def _build_headers(self):
+        """
+        Creates extra headers to pass as part of the request based on given request attributes
+        :return: Request headers, a copy the caller may extend
+        :rtype: dict[str, str]
+        """
+        return dict(self._headers)
+
+    def _warm_up_manifest(self, manifest):
+        """
+        Returns the manifest to warm up, the manifest of the options unless one is given
+        :type manifest: tonga.manifest.FlagManifest or None
+        :rtype: tonga.manifest.FlagManifest
+        :raises ValueError: If neither a manifest is given nor one is set in the options
+        """
+        if manifest is None:
+            manifest = self.options.manifest
+        if manifest is None:
+            raise ValueError(u"No manifest given and none set in the client options")
+        return manifest
+
+    def _warm_up_units(self, manifest, batch_size):
+        """
+        Splits the flags and prefixes of a manifest into the units warmed up concurrently
+        :type manifest: tonga.manifest.FlagManifest
+        :type batch_size: int
+        :return: Flags and prefixes of each unit
+        :rtype: list[tuple[list[str], list[str]]]
+        """
+        if self.options.pre_fetch and not self.options.pre_fetch_prefix_depth and self.options.local_rules is None:
+            # A single pre-fetch resolves everything
+            return [(manifest.flags, manifest.prefixes)]
+        units = [
+            (manifest.flags[start:start + batch_size], []) for start in range(0, len(manifest.flags), batch_size)
+        ]
+        if manifest.prefixes:
+            units.append(([], manifest.prefixes))
+        return units
+
+    def _local_flags_under(self, prefixes):
+        """
+        Returns the flags of the local rules nested under the given prefixes
+        :type prefixes: list[str]
+        :rtype: list[str]
+        """
+        return [
+            flag for flag in self.options.local_rules.rules.flags
+            if any(flag.startswith(prefix + u".") for prefix in prefixes)
+        ]
+
+    def _warm_up_report(self, manifest, unresolved_units, errors, start_time):
+        """
+        Builds the report of a warm up, flattening the resolved prefixes into the cache
+        :type manifest: tonga.manifest.FlagManifest
+        :param unresolved_units: Flags and prefixes of the units not resolved in time or failed
+        :type unresolved_units: list[tuple[list[str], list[str]]]
+        :type errors: list[Exception]
+        :type start_time: float
+        :rtype: tonga.manifest.WarmUpReport
+        """
+        self._resolve_all_pending()
+        unresolved_flags = {flag for flags, _ in unresolved_units for flag in flags}
+        unresolved_prefixes = {prefix for _, prefixes in unresolved_units for prefix in prefixes}
+        # Units still running past the deadline keep filling the cache, iterate over a copy
+        flag_cache = self.dump_state()
+        missing_flags = [
+            flag for flag in manifest.flags if flag not in unresolved_flags and flag_cache.get(flag) is None
+        ]
+        missing_prefixes = [
+            prefix for prefix in manifest.prefixes
+            if prefix not in unresolved_prefixes and not any(flag.startswith(prefix + u".") for flag in flag_cache)
+        ]
+        return WarmUpReport(
+            missing_flags, missing_prefixes, sorted(unresolved_flags), sorted(unresolved_prefixes), errors,
+            time() - start_time,
+        )
+
+    def dump_state(self):
+        """
+        Returns a dump of the current flag state of the client containing all fetched flags. Flag values are treated as
+        immutable and are shared with the client rather than copied, they must not be mutated in place
+        :return: Dump of fetched flag state
+        :rtype: dict[str, Any]
+        """
+        self._resolve_all_pending()
+        return dict(self._flag_cache)
+
+    def frozen_view(self):
+        """
+        Returns an immutable view of the flags currently cached by the client, for inner loops reading flags many times.
+        Flags not fetched yet are not in the view, get_many them first. Expired values are included as they are
+        :rtype: tonga.view.FlagView
+        """
+        return FlagView(self.dump_state())
+
+    def set_state(self, state):
+        """
+        Sets the internal fetched flag state with the given state, this will override any prior fetched flags
+        This is useful for testing purposes when you want to test your code under different flag states. Like in
+        dump_state, flag values are shared rather than copied
+        :param state: Flag state
+        :type state: dict[str, Any]
+        """
+        self._flag_cache = dict(state)
+        self._flag_expiry = {}
+        self._pending_subtrees = {}
+        self._negative_cache = {}
+        self._pre_fetch_deadline = None
+        self._all_flags_etag = None
+        self._shared_store_generation = 0
+        self._state_overridden = True
+
+    def update_state(self, state):
+        """
+        Updates the internal fetched flag state with the given state, this will override any prior fetched flags
+        This is useful for testing purposes when you want to test your code under different flag states
+        :param state: Flag state
+        :type state: dict[str, Any]
+        """
+        self._flag_cache.update(state)
+        self._state_overridden = True
+
+    def clear_state(self):
+        """
+        Clears current state, any following call to get will fetch the state from the backend (or offline mode)
+        """
+        self._flag_cache = {}
+        self._flag_expiry = {}
+        self._pre_fetched = False
+        self._pre_fetch_deadline = None
+        self._all_flags_etag = None
+        self._shared_store_generation = 0
+        self._fetched_prefixes = {}
+        self._pending_subtrees = {}
+        self._negative_cache = {}
+        self._state_overridden = False
+
+    @contextmanager
+    def with_state(self, state):
+        """
+        Override current flag state with given state while inside the with context, once scope is exited previous state
+        is restored. This is useful for tests when the client is a singleton object inside the process and each test
+        should not have a side affect of changing the state for others. The previous state is put aside rather than
+        copied, so entering and exiting costs are proportional to the given state only and nested contexts stack cheaply
+        :param state: Flag state
+        :type state: dict[str, Any]
+        """
+        # set_state replaces these rather than mutating them, so holding on to them keeps the previous state intact
+        prev_state = (
+            self._flag_cache, self._flag_expiry, self._pending_subtrees, self._negative_cache, self._pre_fetch_deadline,
+            self._all_flags_etag, self._shared_store_generation, self._state_overridden,
+        )
+        self.set_state(state)
+        try:
+            yield
+        finally:
+            (
+                self._flag_cache, self._flag_expiry, self._pending_subtrees, self._negative_cache,
+                self._pre_fetch_deadline, self._all_flags_etag, self._shared_store_generation, self._state_overridden,
+            ) = prev_state
+
+    @property
+    def negatively_cached_flags(self):
+        """
+        Returns the flags currently cached as missing on the server, along with the time in seconds until each of them
+        is looked up again
+        :rtype: dict[str, float]
+        """
+        now = time()
+        return {
+            flag: deadline - now for flag, deadline in list(self._negative_cache.items())
+            if deadline > now and flag not in self._flag_cache
+        }
+
+    @property
+    def metrics(self):
+        """
+        Returns the metrics collector of the client, None if metrics are disabled
+        :rtype: tonga.metrics.TongaMetrics
+        """
+        return self._metrics
+
+    @property
+    def accumulated_latency(self):
+        """
+        Returns the accumulated latency of the intercepted client
+        :rtype: float
+        """
+        return self._time_spent_fetching_from_server
+
+
+class TongaClient(BaseTongaClient):
+    __slots__ = ("_transport", "_refresher", "_in_flight", "_snapshot_refresh_thread", "_subscriber")
 
-class TongaClient(object):
     def __init__(self, server_url, context_attributes=None, request_attributes=None, options=None):
         """
         :param server_url: Server connection string
@@ -23,13 +1287,23 @@ class TongaClient(object):
         :param options: Client optional configuration
         :type options: TongaClientOptions
         """
-        self.server_url = server_url
-        self.context_attributes = context_attributes or {}
-        self.request_attributes = request_attributes or {}
-        self.options = options or TongaClientOptions()
-        self._flag_cache = {}
-        self._pre_fetched = False
-        self._time_spent_fetching_from_server = 0
+        super(TongaClient, self).__init__(server_url, context_attributes, request_attributes, options)
+        self._transport = self.options.transport or get_default_transport()
+        self._refresher = None
+        # Server requests in flight, concurrent cache misses of the same flag (or pre-fetch) wait on a single request
+        self._in_flight = SingleFlight()
+        self._snapshot_refresh_thread = None
+        self._subscriber = None
+        if self._load_snapshot() and not self.options.offline_mode:
+            # Serve the snapshot right away while the flags are revalidated against the server
+            self._snapshot_refresh_thread = Thread(target=self._refresh_snapshot, name="tonga-snapshot-refresh")
+            self._snapshot_refresh_thread.daemon = True
+            self._snapshot_refresh_thread.start()
+        if self.options.subscribe and not self.options.offline_mode:
+            self._subscriber = FlagSubscriber(
+                self, self._transport, self.options.poll_interval, self.options.retry_policy
+            )
+            self._subscriber.start()
 
     def get(self, flag, offline_value=None):
         """
@@ -42,12 +1316,268 @@ class TongaClient(object):
         :return: Flag value if defined, otherwise None
         :rtype: Any
         """
-        if flag in self._flag_cache:
-            return self._flag_cache[flag]
+        if self._manifest is not None:
+            self._manifest.record_read(flag)
+        # Hot path, a cached flag costs a single lookup
+        value = self._flag_cache.get(flag, _MISSING)
+        if value is not _MISSING:
+            if self._flag_expiry and self._is_expired(flag):
+                if self._metrics is not None:
+                    self._metrics.record_miss(flag)
+                return self._get_expired_flag_value(flag)
+            if self._metrics is not None:
+                self._metrics.record_hit(flag)
+            return value
 
+        if self._negative_cache and self._is_known_missing(flag):
+            if self._metrics is not None:
+                self._metrics.record_negative_hit(flag)
+            return None
+        if self._metrics is not None:
+            self._metrics.record_miss(flag)
         if self.options.offline_mode:
             return offline_value
-        return self._get_flag_value_through_cache(flag)
+        try:
+            return self._get_flag_value_through_cache(flag)
+        except CircuitOpenError:
+            # The server is failing, fail fast instead of waiting on it
+            return offline_value
+
+    def _get_expired_flag_value(self, flag):
+        """
+        Gets the value of a flag whose cached value has expired. When background refresh is active the stale value is
+        returned while the refresher is woken up to revalidate it, otherwise the flag is fetched again
+        :param flag: Flag name
+        :type flag: str
+        :return: Flag value if defined, otherwise None
+        :rtype: Any
+        """
+        if self.options.offline_mode:
+            # Values loaded from a snapshot are served as is, an offline client never contacts the server
+            return self._flag_cache[flag]
+        if self._is_refreshing_in_background():
+            self._refresher.wake()
+            return self._flag_cache[flag]
+        try:
+            return self._get_flag_value_through_cache(flag)
+        except CircuitOpenError:
+            # The server is failing, fail fast to the last known value
+            return self._flag_cache.get(flag)
+
+    def _is_refreshing_in_background(self):
+        """
+        Whether a background refresher is running, so expired values may be served while it revalidates them
+        :rtype: bool
+        """
+        refresher = self._refresher
+        return refresher is not None and refresher.is_alive
+
+    def get_many(self, flags, offline_values=None):
+        """
+        Gets the values associated to the specified flags, all flags that are not cached yet are fetched from the server
+        in a single request
+        :param flags: Flag names
+        :type flags: list[str]
+        :param offline_values: Which values to return for each flag if client is in offline mode
+        :type offline_values: dict[str, Any]
+        :return: Mapping from each flag to its value if defined, otherwise None
+        :rtype: dict[str, Any]
+        """
+        # With background refresh, expired values are served while the refresher revalidates them
+        refreshing = self._is_refreshing_in_background()
+        missing_flags = self._find_missing_flags(flags, include_expired=not refreshing)
+        if refreshing and self._flag_expiry and any(self._is_expired(flag) for flag in flags):
+            self._refresher.wake()
+        if missing_flags:
+            if self.options.offline_mode:
+                return self._get_offline_values(flags, offline_values)
+            try:
+                if self.options.local_rules is not None:
+                    self._update_local_rules_if_needed()
+                    self._store_local_values(missing_flags)
+                elif self.options.pre_fetch_prefix_depth:
+                    prefixes = self._prefixes_to_pre_fetch(missing_flags)
+                    if prefixes:
+                        self._fetch_prefixes(prefixes)
+                elif self.options.pre_fetch:
+                    if any(self._negative_entry_expired(flag) for flag in missing_flags):
+                        self._in_flight.do(_ALL_FLAGS, self._pre_fetch_and_populate_cache)
+                    else:
+                        self._pre_fetch_once()
+                else:
+                    self._in_flight.do(tuple(missing_flags), lambda: self._fetch_flag_values(missing_flags))
+            except CircuitOpenError:
+                return self._get_offline_values(flags, offline_values)
+        return {flag: self._get_cached_value(flag) for flag in flags}
+
+    def warm_up(self, manifest=None, timeout=None, batch_size=100, max_workers=8):
+        """
+        Resolves the flags and prefixes declared by a manifest into the cache before the service takes traffic, so first
+        reads do not wait on the server. Flags are requested in batches resolved concurrently, along with the prefixes,
+        and requests still running at the deadline keep filling the cache in the background
+        :param manifest: Manifest to warm up, the manifest of the options by default
+        :type manifest: tonga.manifest.FlagManifest
+        :param timeout: Time in seconds to wait for the flags to be resolved, None means waiting until they are
+        :type timeout: float
+        :param batch_size: Number of flags per request
+        :type batch_size: int
+        :param max_workers: Number of requests issued concurrently
+        :type max_workers: int
+        :return: Report of the declared flags missing on the server and of those not resolved in time
+        :rtype: tonga.manifest.WarmUpReport
+        :raises ValueError: If neither a manifest is given nor one is set in the options
+        """
+        manifest = self._warm_up_manifest(manifest)
+        start_time = time()
+        units = self._warm_up_units(manifest, batch_size)
+        pool = ThreadPool(max(1, min(max_workers, len(units))))
+        results = [pool.apply_async(self._warm_up, unit) for unit in units]
+        # Workers exit once they are done, without interrupting requests past the deadline
+        pool.close()
+        unresolved_units = []
+        errors = []
+        for unit, result in zip(units, results):
+            result.wait(None if timeout is None else max(0, start_time + timeout - time()))
+            try:
+                if result.ready():
+                    result.get()
+                    continue
+            except (requests.exceptions.RequestException, ValueError) as error:
+                errors.append(error)
+            unresolved_units.append(unit)
+        return self._warm_up_report(manifest, unresolved_units, errors, start_time)
+
+    def _warm_up(self, flags, prefixes):
+        """
+        Resolves the given flags and the flags nested under the given prefixes into the cache
+        :type flags: list[str]
+        :type prefixes: list[str]
+        """
+        if flags:
+            self.get_many(flags)
+        if not prefixes:
+            return
+        if self.options.local_rules is not None:
+            self._update_local_rules_if_needed()
+            self.get_many(self._local_flags_under(prefixes))
+        elif self.options.pre_fetch and not self.options.pre_fetch_prefix_depth:
+            self._pre_fetch_once()
+        else:
+            self.pre_fetch_prefixes(prefixes)
+            # Flattened right away, reads of clients not pre-fetching prefixes only look at the flattened cache
+            self._resolve_all_pending()
+
+    def get_for_contexts(self, flag, contexts, batch_size=100, max_workers=None, offline_value=None):
+        """
+        Gets the value of a flag for each of many contexts, see get_many_for_contexts
+        :param flag: Flag name
+        :type flag: str
+        :param contexts: Context attributes of each evaluation
+        :type contexts: collections.Iterable[dict[str, object]]
+        :param batch_size: Number of contexts read from the iterable and resolved at a time
+        :type batch_size: int
+        :param max_workers: Number of contexts resolved concurrently, by default they are resolved one after another
+        :type max_workers: int
+        :param offline_value: Which value to return if client is in offline mode
+        :type offline_value: Any
+        :return: Generator of tuples of each context and the flag value for it
+        :rtype: collections.Iterator[tuple[dict[str, object], Any]]
+        """
+        offline_values = {flag: offline_value}
+        for context, values in self.get_many_for_contexts([flag], contexts, batch_size, max_workers, offline_values):
+            yield context, values[flag]
+
+    def get_many_for_contexts(self, flags, contexts, batch_size=100, max_workers=None, offline_values=None):
+        """
+        Gets the values of the given flags for each of many contexts, such as the entities of a batch job. Results are
+        streamed in the order of the contexts while the contexts are read and resolved in batches, so the iterable may
+        be a generator of any length. Each context is merged over the context attributes of this client, and identical
+        contexts are resolved once as long as they are among the most recently seen distinct contexts. Every context
+        costs a single request over the transport of this client, unless local rules are configured in which case no
+        requests are made besides downloading the rules. Values are not written to the shared cache of the options,
+        which would otherwise fill up with one entry per context and evict the values of the long lived clients
+        :param flags: Flag names
+        :type flags: list[str]
+        :param contexts: Context attributes of each evaluation
+        :type contexts: collections.Iterable[dict[str, object]]
+        :param batch_size: Number of contexts read from the iterable and resolved at a time
+        :type batch_size: int
+        :param max_workers: Number of contexts resolved concurrently, by default they are resolved one after another
+        :type max_workers: int
+        :param offline_values: Which values to return for each flag if client is in offline mode
+        :type offline_values: dict[str, Any]
+        :return: Generator of tuples of each context and the mapping from each flag to its value for it
+        :rtype: collections.Iterator[tuple[dict[str, object], dict[str, Any]]]
+        """
+        contexts = iter(contexts)
+        options = self._bulk_options()
+        # Values of the most recently seen contexts by their normalized encoding, least recently seen first
+        resolved = OrderedDict()
+
+        def resolve(item):
+            key, context_attributes = item
+            client = TongaClient(self.server_url, context_attributes, self.request_attributes, options)
+            return key, client.get_many(flags, offline_values)
+
+        pool = ThreadPool(max_workers) if max_workers else None
+        try:
+            batch = [(context, self._merge_context(context)) for context in islice(contexts, batch_size)]
+            while batch:
+                # Merged context attributes of the contexts of the batch not resolved yet, by their encoding
+                unresolved = {key: attributes for _, (key, attributes) in batch if key not in resolved}
+                resolved.update((pool.map if pool is not None else map)(resolve, list(unresolved.items())))
+                for context, (key, _) in batch:
+                    # Re-insert to mark the context as most recently seen
+                    values = resolved.pop(key)
+                    resolved[key] = values
+                    yield context, values
+                # Evicted only once the batch is done, as the whole batch must stay resolved until it is streamed
+                while len(resolved) > _MAX_RESOLVED_CONTEXTS:
+                    resolved.popitem(last=False)
+                batch = [(context, self._merge_context(context)) for context in islice(contexts, batch_size)]
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+    def _merge_context(self, context):
+        """
+        Merges the given context over the context attributes of the client
+        :type context: dict[str, object]
+        :return: Tuple of the normalized encoding of the merged context attributes and the attributes
+        :rtype: tuple[str, dict[str, object]]
+        """
+        context_attributes = dict(self.context_attributes)
+        context_attributes.update(context)
+        return self._encode_context(context_attributes), context_attributes
+
+    def _bulk_options(self):
+        """
+        Options of the short lived clients resolving the contexts of a bulk evaluation, they request only the flags
+        being evaluated and do not start background threads or touch per context snapshots, stores and shared caches
+        :rtype: TongaClientOptions
+        """
+        options = copy(self.options)
+        options.transport = self._transport
+        options.pre_fetch = False
+        options.pre_fetch_prefix_depth = None
+        options.background_refresh = False
+        options.subscribe = False
+        options.snapshot_store = None
+        options.shared_store = None
+        options.shared_cache = None
+        return options
+
+    def _fetch_flag_values(self, flags):
+        """
+        Populates the cache with the values of the given flags from the shared cache or else the server
+        :param flags: Flag names
+        :type flags: list[str]
+        """
+        # Flags may have been fetched by another thread since the caller checked the cache
+        missing_flags = [flag for flag in flags if not self._is_fresh(flag) and not self._is_known_missing(flag)]
+        missing_flags = self._load_shared_values(missing_flags)
+        if missing_flags:
+            self._fetch_and_store_flag_values(missing_flags)
 
     def _get_flag_value_through_cache(self, flag):
         """
@@ -58,12 +1588,58 @@ class TongaClient(object):
         :return: Flag value if defined, otherwise None
         :rtype: Any
         """
+        if self.options.local_rules is not None:
+            self._update_local_rules_if_needed()
+            self._store_local_values([flag])
+            return self._flag_cache.get(flag)
+        if self.options.pre_fetch_prefix_depth:
+            return self._pre_fetch_prefix_if_needed_and_get_flag(flag)
         if self.options.pre_fetch:
             return self._pre_fetch_if_needed_and_get_flag(flag)
+        return self._in_flight.do(flag, lambda: self._fetch_flag_value(flag))
 
-        value = self._get_flag_value_from_server(flag)
-        self._flag_cache[flag] = value
-        return value
+    def _update_local_rules_if_needed(self):
+        """
+        Downloads the flag rules unless they are up to date, clients sharing the rules share a single request. While
+        the server is unavailable the previous rules are kept
+        """
+        local_rules = self.options.local_rules
+        if not local_rules.needs_update:
+            return
+
+        def update_if_needed():
+            # Another client may have updated the rules since the caller checked
+            if local_rules.needs_update:
+                request_string, headers = self._rules_request(local_rules.etag)
+                self._update_local_rules(self._get_response_from_server_with_retries(request_string, headers))
+
+        try:
+            local_rules.in_flight.do(_RULES, update_if_needed)
+        except requests.exceptions.RequestException:
+            if local_rules.rules is None:
+                raise
+
+    def _fetch_flag_value(self, flag):
+        """
+        Gets the value associated to the specified flag from the shared cache or else the server and caches it
+        :param flag: Flag name
+        :type flag: str
+        :return: Flag value if defined, otherwise None
+        :rtype: Any
+        """
+        # The flag may have been fetched by another thread since the caller checked the cache
+        if self._is_fresh(flag):
+            return self._flag_cache[flag]
+        if self._is_known_missing(flag):
+            return None
+
+        entry = self._get_shared_entry(flag)
+        if entry is not None:
+            self._store_fetched_values({flag: entry[0]}, fetched_at=entry[1])
+            return entry[0]
+
+        response_json = self._get_from_server_with_retries(*self._flag_value_request(flag))
+        return self._store_flag_value_response(flag, response_json)
 
     def _pre_fetch_if_needed_and_get_flag(self, flag):
         """
@@ -73,202 +1649,392 @@ class TongaClient(object):
         :return: Flag value if defined, otherwise None
         :rtype: Any
         """
-        # If we are here, it means that the flag is not in the cache, but we are in pre-fetch mode, so we can safely
-        # assume that the flag is not in the cache because it was not available while pre-fetching, so we can return
-        # None without making a request to the server
+        # If we are here, it means that the flag is not in the cache (or expired), but we are in pre-fetch mode, so we
+        # can safely assume that the flag is not in the cache because it was not available while pre-fetching, so we
+        # can return None (or the stale value) without making a request to the server as long as the pre-fetch is valid
         if self._pre_fetched:
-            return None
+            if self._negative_entry_expired(flag):
+                # The flag may have been created since it was found missing, revalidate the pre-fetch
+                self._in_flight.do(_ALL_FLAGS, self._pre_fetch_and_populate_cache)
+                return self._get_cached_value(flag)
+            if not self._is_pre_fetch_expired():
+                return self._get_cached_value(flag)
+            if self._is_refreshing_in_background():
+                self._refresher.wake()
+                return self._get_cached_value(flag)
 
-        self._pre_fetch_and_populate_cache()
-        return self._flag_cache.get(flag)
+        self._pre_fetch_once()
+        return self._get_cached_value(flag)
 
-    def get_all_flags_from_server(self):  # type: () -> Dict[str, Any]
+    def _pre_fetch_prefix_if_needed_and_get_flag(self, flag):
         """
-        Fetch all flags from the server and return them as a dictionary in a flattened structure (no nested
-        dictionaries)
+        Pre-fetches the namespace prefix of the flag unless it is already pre-fetched, and then gets the flag value.
+        Flags missing from a pre-fetched prefix are not defined on the server and are returned as None without a request
+        :param flag: Flag name
+        :type flag: str
+        :return: Flag value if defined, otherwise None
+        :rtype: Any
         """
-        response_json = self._get_all_flag_response_from_server()
-        if not response_json:
-            return {}
-        return self._recursive_squash_response_dict(response_json)
+        for prefix in self._prefixes_to_pre_fetch([flag]):
+
+            def pre_fetch_if_needed(prefix=prefix):
+                # Another thread may have completed the pre-fetch since the caller checked
+                if self._needs_prefix_pre_fetch(flag):
+                    self._fetch_prefixes([prefix])
+
+            self._in_flight.do((_PREFIX, prefix), pre_fetch_if_needed)
+        return self._get_cached_value(flag)
 
-    def _get_all_flag_response_from_server(self):  # type: () -> Dict[str, Any]
+    def pre_fetch_prefixes(self, prefixes):
         """
-        Fetch all flags from the server and return them as a dictionary
+        Pre-fetches all flags nested under the given namespace prefixes (e.g. "routing") in a single request, unless
+        they are already pre-fetched. Reading a flag under a pre-fetched prefix is served from the cache, the flags are
+        flattened lazily on their first read
+        :param prefixes: Namespace prefixes
+        :type prefixes: list[str]
         """
-        request_string = u"{server_url}/all_flags_values".format(server_url=self.server_url)
-        request_string += self._build_query_string()
-        headers = self._build_headers()
-        response_json = self._get_from_server_with_retries(request_string, headers)
-        return response_json if response_json else {}
+        missing_prefixes = [prefix for prefix in self._unique(prefixes) if not self._is_prefix_fetched(prefix)]
+        if missing_prefixes:
+            self._fetch_prefixes(missing_prefixes)
 
-    def _recursive_squash_response_dict(
-            self,
-            flag_response,  # type: Dict[str, Any]
-            prefix="",  # type: str
-    ):  # type: (...) -> Dict[str, Any]
+    def _fetch_prefixes(self, prefixes):
         """
-        Squash a nested response dictionary into a single level dictionary with the full flag names
+        Fetches the flags nested under the given namespace prefixes from the server
+        :param prefixes: Namespace prefixes
+        :type prefixes: list[str]
         """
-        squashed_dict = {}
-        # The pre-fetched is a dictionary with any depth, so we need to recursively populate the cache and add the
-        # prefix to the keys in order to flatten the structure into a single level dictionary with the full flag names
-        for key, value in flag_response.items():
-            if not isinstance(value, dict):
-                squashed_dict[prefix + key] = value
-            else:
-                # Recursively populate the cache
-                squashed_dict.update(self._recursive_squash_response_dict(value, prefix + key + "."))
-        return squashed_dict
+        self._populate_prefixes(
+            prefixes, self._get_from_server_with_retries(*self._all_flags_request(prefixes=prefixes))
+        )
 
-    def _pre_fetch_and_populate_cache(self):  # type: () -> Dict[str, Any]
+    def _pre_fetch_once(self):
         """
-        Populates the cache with the pre-fetched flags
+        Pre-fetches all flags unless there is a valid pre-fetch, concurrent callers share a single request
         """
-        pre_fetched_flags = self.get_all_flags_from_server()
-        self.update_state(pre_fetched_flags)
-        self._pre_fetched = True
-        return pre_fetched_flags
 
-    def _get_flag_value_from_server(self, flag):
+        def pre_fetch_if_needed():
+            # Another thread may have completed a pre-fetch since the caller checked
+            if self._needs_pre_fetch():
+                self._pre_fetch_and_populate_cache()
+
+        self._in_flight.do(_ALL_FLAGS, pre_fetch_if_needed)
+
+    def _start_refresher_if_needed(self):
         """
-        Fetch the flag value from the server
-        :param flag: Flag name
-        :type flag: str
-        :return: Flag value if defined, otherwise None
-        :rtype: Any
+        Starts the background refresher thread the first time values with a ttl are cached if background refresh is
+        enabled
         """
-        request_string = u"{server_url}/flag_value/{flag}".format(server_url=self.server_url, flag=flag)
-        request_string += self._build_query_string()
-        headers = self._build_headers()
-        response_json = self._get_from_server_with_retries(request_string, headers)
-        return response_json.get("value") if response_json else None
+        if not self.options.background_refresh or self.options.offline_mode or self._refresher is not None:
+            return
+        with self._lock:
+            if self._refresher is None:
+                self._refresher = FlagRefresher(self, self.options.min_ttl, self.options.refresh_jitter)
+                self._refresher.start()
 
-    def _get_from_server_with_retries(self, request_string, headers):
+    def _refresh_cache(self, horizon):
         """
-        Fetch request data from the server with retries
-        :param request_string: Request string
-        :type request_string: str
-        :param headers: Request headers
-        :type headers: dict[str, str]
-        :return: Flag value if defined, otherwise None
-        :rtype: dict or None
+        Re-fetches cached values that are about to expire, called by the background refresher
+        :param horizon: Time in seconds until the next refresh, flags expiring before then are refreshed
+        :type horizon: float
         """
-        for attempt in range(self.options.retries + 1):
-            start_time = time()
-            try:
-                response = requests.get(request_string, headers=headers)
-                if response.status_code == 404:
-                    return None
-                # Check for error code
-                response.raise_for_status()
-                return response.json()
-            except requests.exceptions.RequestException:
-                # Upon last retry, raise original error
-                if attempt == self.options.retries:
-                    raise
-                sleep(self.options.retry_delay)
-            finally:
-                self._time_spent_fetching_from_server += time() - start_time
+        if self._subscriber is not None and self._subscriber.connected:
+            # Flags are kept up to date by the stream
+            return
+        deadline = time() + horizon
+        if self.options.local_rules is not None:
+            self._update_local_rules_if_needed()
+            self._store_local_values([flag for flag, expiry in list(self._flag_expiry.items()) if expiry <= deadline])
+            return
+        if self.options.pre_fetch_prefix_depth:
+            due_prefixes = [
+                prefix for prefix, expiry in list(self._fetched_prefixes.items())
+                if expiry is not None and expiry <= deadline
+            ]
+            if due_prefixes:
+                self._fetch_prefixes(due_prefixes)
+            return
+        if self.options.pre_fetch:
+            if self._pre_fetch_deadline is not None:
+                self._in_flight.do(_ALL_FLAGS, self._pre_fetch_and_populate_cache)
+            return
+        due_flags = [flag for flag, expiry in list(self._flag_expiry.items()) if expiry <= deadline]
+        if due_flags:
+            self._fetch_and_store_flag_values(due_flags)
 
-    def _build_query_string(self):
+    def _poll_flags(self):
         """
-        Creates a query string from the context attributes
-        :return: Query string to attach to the request url
-        :rtype: str
+        Revalidates the pre-fetched flags with a conditional request, called by the subscriber when the server does not
+        support streaming
         """
-        if six.PY2:
-            query_string = urllib.urlencode(self.context_attributes)  # pylint: disable=maybe-no-member
-        else:
-            query_string = urllib.parse.urlencode(self.context_attributes)
-        if query_string:
-            return u"?" + query_string
-        return ""
+        self._in_flight.do(_ALL_FLAGS, self._pre_fetch_and_populate_cache)
 
-    def _build_headers(self):
+    def _refresh_snapshot(self):
         """
-        Creates extra headers to pass as part of the request based on given request attributes
-        :return: Request headers
-        :rtype: dict[str, str]
+        Re-fetches the flags loaded from the snapshot, keeping the snapshot values if the server is unavailable
         """
-        return {
-            u"X-Tonga-{key}".format(key=key): six.ensure_str(six.text_type(value))
-            for key, value in self.request_attributes.items()
-            if value is not None
-        }
+        try:
+            if self.options.pre_fetch:
+                self._in_flight.do(_ALL_FLAGS, self._pre_fetch_and_populate_cache)
+            elif self._flag_cache:
+                self._fetch_and_store_flag_values(list(self._flag_cache))
+        except requests.exceptions.RequestException:
+            pass
 
-    def dump_state(self):
+    def get_all_flags_from_server(self):  # type: () -> Dict[str, Any]
         """
-        Returns a dump of the current flag state of the client containing all fetched flags
-        :return: Dump of fetched flag state
-        :rtype: dict[str, Any]
+        Fetch all flags from the server and return them as a dictionary in a flattened structure (no nested
+        dictionaries)
         """
-        return deepcopy(self._flag_cache)
+        return self._decode_flat_tree(self._get_response_from_server_with_retries(*self._all_flags_request()))
 
-    def set_state(self, state):
+    def _fetch_and_store_flag_values(self, flags):
         """
-        Sets the internal fetched flag state with the given state, this will override any prior fetched flags
-        This is useful for testing purposes when you want to test your code under different flag states
-        :param state: Flag state
-        :type state: dict[str, Any]
+        Fetch the values of the given flags from the server in a single request, using the all flags endpoint filtered
+        to the requested flags, and store them in the cache
+        :param flags: Flag names
+        :type flags: list[str]
         """
-        self._flag_cache = deepcopy(state)
+        response_json = self._get_from_server_with_retries(*self._all_flags_request(flags=flags))
+        self._store_flag_values_response(flags, response_json)
 
-    def update_state(self, state):
+    def _pre_fetch_and_populate_cache(self):  # type: () -> None
         """
-        Updates the internal fetched flag state with the given state, this will override any prior fetched flags
-        This is useful for testing purposes when you want to test your code under different flag states
-        :param state: Flag state
-        :type state: dict[str, Any]
+        Populates the cache with the pre-fetched flags, when refreshing an existing pre-fetch the request is conditional
+        and an unchanged response skips decoding, squashing and rewriting the cache. With a shared store, a pre-fetch
+        published by another process is used if it is up to date, otherwise a single process of the host fetches while
+        the others wait for it
         """
-        self._flag_cache.update(state)
+        if self._load_shared_pre_fetch():
+            return
+        if self.options.shared_store is None:
+            self._fetch_all_flags()
+        elif not self._load_shared_store():
+            with self.options.shared_store.refresh_lock(self.server_url, self._context_key):
+                # Another process may have refreshed the flags while this one waited for the lock
+                if not self._load_shared_store():
+                    self._publish_shared_store(self._fetch_all_flags())
 
-    def clear_state(self):
+    def _fetch_all_flags(self):
         """
-        Clears current state, any following call to get will fetch the state from the backend (or offline mode)
+        Fetches all flags from the server into the cache
+        :return: Flattened pre-fetched flags, None if they did not change since the previous pre-fetch
+        :rtype: dict[str, Any] or None
         """
-        self._flag_cache = {}
+        etag = self._all_flags_etag if self._pre_fetched or self._shared_store_generation else None
+        pre_fetched_flags = self._populate_all_flags(
+            self._get_response_from_server_with_retries(*self._all_flags_request(etag))
+        )
+        self._mark_pre_fetched()
+        return pre_fetched_flags
 
-    @contextmanager
-    def with_state(self, state):
+    def _get_from_server_with_retries(self, request_string, headers):
         """
-        Override current flag state with given state while inside the with context, once scope is exited previous state
-        is restored. This is useful for tests when the client is a singleton object inside the process and each test
-        should not have a side affect of changing the state for others
-        :param state: Flag state
-        :type state: dict[str, Any]
+        Fetch request data from the server with retries
+        :param request_string: Request string
+        :type request_string: str
+        :param headers: Request headers
+        :type headers: dict[str, str]
+        :return: Flag value if defined, otherwise None
+        :rtype: dict or None
         """
-        prev_state = self.dump_state()
-        self.set_state(state)
-        try:
-            yield
-        finally:
-            self.set_state(prev_state)
+        return self._response_json(self._get_response_from_server_with_retries(request_string, headers))
 
-    @property
-    def accumulated_latency(self):
+    def _get_response_from_server_with_retries(self, request_string, headers):
         """
-        Returns the accumulated latency of the intercepted client
-        :rtype: float
+        Issue a request to the server, retrying failures according to the retry policy
+        :param request_string: Request string
+        :type request_string: str
+        :param headers: Request headers
+        :type headers: dict[str, str]
+        :return: Server response, None if not found
+        :rtype: requests.Response or None
         """
-        return self._time_spent_fetching_from_server
+        call_start_time = time()
+        for attempt in count():
+            self._before_attempt()
+            start_time = time()
+            try:
+                response = self._checked_response(
+                    self._transport.get(request_string, headers, **self._transport_options(call_start_time))
+                )
+                self._on_attempt_succeeded(request_string, response, time() - start_time)
+                return response
+            except requests.exceptions.RequestException:
+                delay = self._on_attempt_failed(request_string, attempt, call_start_time, time() - start_time)
+                # Upon last retry, raise original error
+                if delay is None:
+                    raise
+                sleep(delay)
+            except BaseException:
+                self._on_attempt_interrupted()
+                raise
+            finally:
+                self._add_fetch_latency(time() - start_time)
+
+    def close(self):
+        """
+        Stops the background refresher and subscriber if running and writes the scheduled snapshot, the client keeps
+        serving cached values
+        """
+        if self._refresher is not None:
+            self._refresher.stop()
+            self._refresher = None
+        if self._subscriber is not None:
+            self._subscriber.stop()
+            self._subscriber = None
+        if self.options.snapshot_store is not None:
+            self.options.snapshot_store.flush()
 
 
-class TongaClientOptions(object):
-    def __init__(self, offline_mode=False, retries=10, retry_delay=1, pre_fetch=False):
+class TongaClientOptions(object):  # pylint: disable=too-many-instance-attributes
+    __slots__ = (
+        "offline_mode", "retries", "retry_delay", "pre_fetch", "transport", "cache_ttl", "flag_ttls",
+        "background_refresh", "refresh_jitter", "shared_cache", "async_transport", "retry_policy", "circuit_breaker",
+        "snapshot_store", "subscribe", "poll_interval", "metrics", "pre_fetch_prefix_depth", "negative_cache_ttl",
+        "shared_store", "local_rules", "compact_encoding", "manifest",
+    )
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-locals
+            self,
+            offline_mode=False,
+            retries=10,
+            retry_delay=1,
+            pre_fetch=False,
+            transport=None,
+            cache_ttl=None,
+            flag_ttls=None,
+            background_refresh=False,
+            refresh_jitter=0.1,
+            shared_cache=None,
+            async_transport=None,
+            retry_policy=None,
+            circuit_breaker=None,
+            snapshot_store=None,
+            subscribe=False,
+            poll_interval=30,
+            metrics=None,
+            pre_fetch_prefix_depth=None,
+            negative_cache_ttl=None,
+            shared_store=None,
+            local_rules=None,
+            compact_encoding=False,
+            manifest=None,
+    ):
         """
         :param offline_mode: Whether to operate in offline mode, not interacting with the server for fetching values.
         This is useful for when running tests and there is no backend available or it should not be used
         :type offline_mode: bool
-        :param retries: Number of retries when failing to get a flag
+        :param retries: Number of retries when failing to get a flag, ignored if retry_policy is given
         :type retries: int
-        :param retry_delay: Delay between each retry attempt in seconds
+        :param retry_delay: Delay between each retry attempt in seconds, ignored if retry_policy is given
         :type retry_delay: float
         :param pre_fetch: Whether to pre-fetch all flags when a flag is requested, this is useful when you want to
         avoid multiple requests to the server when you know you will need multiple flags
         :type pre_fetch: bool
+        :param transport: Transport used to issue requests to the server, when not specified a process wide pooled
+        transport shared by all clients is used
+        :type transport: tonga.transport.TongaTransport
+        :param cache_ttl: Time in seconds after which a value fetched from the server is considered stale and is fetched
+        again, None means values are cached forever
+        :type cache_ttl: float
+        :param flag_ttls: Optional ttl in seconds per flag name, overriding cache_ttl for these flags. Flags fetched
+        together by a pre-fetch are refreshed together, as often as the shortest ttl among them requires
+        :type flag_ttls: dict[str, float]
+        :param background_refresh: Whether to refresh cached values in a background thread before they expire, stale
+        values are served while being refreshed so get never waits on the server once a flag is cached
+        :type background_refresh: bool
+        :param refresh_jitter: Fraction by which background refresh intervals are randomly stretched or shrunk, so
+        multiple processes do not refresh in lockstep
+        :type refresh_jitter: float
+        :param shared_cache: Optional cache shared between clients, values fetched by one client are reused by other
+        clients of the same server and context attributes
+        :type shared_cache: tonga.cache.SharedFlagCache
+        :param async_transport: Transport used by the asynchronous client, when not specified requests of the
+        synchronous transport are run in the default executor of the event loop
+        :type async_transport: tonga.async_transport.AsyncTongaTransport
+        :param retry_policy: Policy for retrying failed requests, when not specified failed requests are retried the
+        given number of retries with a constant retry delay
+        :type retry_policy: tonga.retry.RetryPolicy
+        :param circuit_breaker: Optional circuit breaker, while it is open requests are not issued and get returns the
+        last known value of the flag or else the offline value
+        :type circuit_breaker: tonga.retry.CircuitBreaker
+        :param snapshot_store: Optional store persisting fetched flags to disk, a new client starts with the flags of
+        the last snapshot of its server and context and revalidates them in the background
+        :type snapshot_store: tonga.snapshot.FlagSnapshotStore
+        :param subscribe: Whether to subscribe to flag updates pushed by the server over a server-sent events stream,
+        implies pre_fetch. Dropped streams are resumed from the last received update, and if the server does not
+        support streaming the flags are polled instead. The server must send heartbeats more often than the transport
+        read timeout. Not supported by the async client
+        :type subscribe: bool
+        :param poll_interval: Time in seconds between polls when subscribing to a server that does not support streaming
+        :type poll_interval: float
+        :param metrics: Optional collector of cache and server request metrics, can be shared between clients
+        :type metrics: tonga.metrics.TongaMetrics
+        :param pre_fetch_prefix_depth: Scopes pre-fetching to namespaces, implies pre_fetch. Reading a flag pre-fetches
+        only the flags sharing its first pre_fetch_prefix_depth name parts, e.g. with 1 reading routing.eu.timeout
+        pre-fetches everything under routing. Pre-fetched namespaces are flattened lazily as their flags are read.
+        Ignored when subscribing, as the stream keeps all flags up to date
+        :type pre_fetch_prefix_depth: int
+        :param negative_cache_ttl: Time in seconds for which a flag found to be missing on the server is remembered as
+        missing, get returns None for it without a request and looks it up again once the ttl passes, so newly created
+        flags show up. When not specified missing flags are cached as None like any other value. Ignored when
+        subscribing, as the stream pushes newly created flags
+        :type negative_cache_ttl: float
+        :param shared_store: Optional store sharing the pre-fetched flags between the processes of the host, such as
+        pre-fork server workers, implies pre_fetch. A single process refreshes the flags from the server once the
+        cache ttl passes, the other processes load what it published. Not supported by the async client
+        :type shared_store: tonga.shared_store.SharedFlagStore
+        :param local_rules: Optional flag rules shared between clients, when given the flag definitions and targeting
+        rules are downloaded from the server once (and again whenever their ttl passes) and flags are evaluated locally
+        for the context of each client instead of being requested from the server. Takes precedence over pre-fetching
+        :type local_rules: tonga.rules.LocalFlagRules
+        :param compact_encoding: Whether to ask the server for msgpack encoded flag trees, which are smaller and faster
+        to decode than json. Requires msgpack (installed with the msgpack extra), the client falls back to json if it
+        is not installed or the server does not support it
+        :type compact_encoding: bool
+        :param manifest: Optional manifest of the flags the service uses, warmed up by warm_up when not given one. Reads
+        of flags it does not declare are reported to it
+        :type manifest: tonga.manifest.FlagManifest
         """
         self.offline_mode = offline_mode
         self.retries = retries
         self.retry_delay = retry_delay
-        self.pre_fetch = pre_fetch
+        self.pre_fetch = pre_fetch or subscribe or pre_fetch_prefix_depth is not None or shared_store is not None
+        self.transport = transport
+        self.cache_ttl = cache_ttl
+        self.flag_ttls = flag_ttls or {}
+        self.background_refresh = background_refresh
+        self.refresh_jitter = refresh_jitter
+        self.shared_cache = shared_cache
+        self.async_transport = async_transport
+        self.retry_policy = retry_policy or RetryPolicy.constant(retries, retry_delay)
+        self.circuit_breaker = circuit_breaker
+        self.snapshot_store = snapshot_store
+        self.subscribe = subscribe
+        self.poll_interval = poll_interval
+        self.metrics = metrics
+        self.pre_fetch_prefix_depth = None if subscribe else pre_fetch_prefix_depth
+        self.negative_cache_ttl = None if subscribe else negative_cache_ttl
+        self.shared_store = shared_store
+        self.local_rules = local_rules
+        self.compact_encoding = compact_encoding
+        self.manifest = manifest
+
+    @property
+    def has_ttl(self):
+        """
+        Whether any of the fetched values can expire
+        :rtype: bool
+        """
+        return self.cache_ttl is not None or bool(self.flag_ttls)
+
+    @property
+    def min_ttl(self):
+        """
+        Shortest configured ttl in seconds, None if values never expire
+        :rtype: float or None
+        """
+        ttls = list(self.flag_ttls.values())
+        if self.cache_ttl is not None:
+            ttls.append(self.cache_ttl)
+        return min(ttls) if ttls else None
@@ -0,0 +1,55 @@
+import sys
+from threading import Event, Lock
+
+import six
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+    """
+    Collapses concurrent calls sharing the same key into a single execution, callers arriving while a call is in flight
+    wait for it and receive its result (or its error)
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        """
+        Executes the given function unless a call with the same key is already in flight, in which case waits for it
+        :param key: Call key
+        :type key: collections.Hashable
+        :param func: Function to execute
+        :type func: () -> Any
+        :return: Result of the function
+        :rtype: Any
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+
+        if not is_leader:
+            call.done.wait()
+            if call.exc_info is not None:
+                six.reraise(*call.exc_info)
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except BaseException:
+            call.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
@@ -0,0 +1,118 @@
+import json
+from collections import Counter
+from threading import Lock
+
+
+class FlagManifest(object):
+    """
+    Declares the flags a service uses, as flag names and namespace prefixes covering every flag nested under them.
+    Clients warm up the declared flags before taking traffic (see TongaClient.warm_up), and clients given the manifest
+    through their options report the flags they read that it does not declare, so it can be kept accurate
+    """
+
+    def __init__(self, flags=(), prefixes=()):
+        """
+        :param flags: Declared flag names
+        :type flags: collections.Iterable[str]
+        :param prefixes: Declared namespace prefixes, e.g. "routing" declares routing.eu.timeout
+        :type prefixes: collections.Iterable[str]
+        """
+        self.flags = sorted(set(flags))
+        self.prefixes = sorted(set(prefixes))
+        # Whether each flag read so far is declared, so checking a read is a single lookup once a flag was seen
+        self._declared = dict.fromkeys(self.flags, True)
+        self._undeclared_reads = Counter()
+        self._lock = Lock()
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Loads a manifest from a json file of the form {"flags": [...], "prefixes": [...]}
+        :param path: File path
+        :type path: str
+        :rtype: FlagManifest
+        :raises ValueError: If the file is not a valid manifest
+        """
+        with open(path, "rb") as manifest_file:
+            document = json.loads(manifest_file.read().decode("utf-8"))
+        if not isinstance(document, dict) or not set(document) <= {"flags", "prefixes"} or \
+                not all(isinstance(names, list) for names in document.values()):
+            raise ValueError(u"Invalid flag manifest {}".format(path))
+        return cls(document.get("flags", ()), document.get("prefixes", ()))
+
+    def declares(self, flag):
+        """
+        Whether the given flag is declared, by name or by one of the prefixes it is nested under
+        :param flag: Flag name
+        :type flag: str
+        :rtype: bool
+        """
+        declared = self._declared.get(flag)
+        if declared is None:
+            declared = any(flag.startswith(prefix + u".") for prefix in self.prefixes)
+            self._declared[flag] = declared
+        return declared
+
+    def record_read(self, flag):
+        """
+        Records that a client read the given flag, counting it if it is not declared
+        :param flag: Flag name
+        :type flag: str
+        """
+        if not self.declares(flag):
+            with self._lock:
+                self._undeclared_reads[flag] += 1
+
+    @property
+    def undeclared_reads(self):
+        """
+        Flags read by clients that the manifest does not declare, with the number of reads of each
+        :rtype: dict[str, int]
+        """
+        with self._lock:
+            return dict(self._undeclared_reads)
+
+
+class WarmUpReport(object):
+    """
+    Outcome of warming up the flags of a manifest
+    """
+
+    def __init__(self, missing_flags, missing_prefixes, unresolved_flags, unresolved_prefixes, errors, elapsed):
+        """
+        :param missing_flags: Declared flags the server does not define (or defines as null)
+        :type missing_flags: list[str]
+        :param missing_prefixes: Declared prefixes the server has no flags under
+        :type missing_prefixes: list[str]
+        :param unresolved_flags: Declared flags not resolved before the deadline or whose request failed
+        :type unresolved_flags: list[str]
+        :param unresolved_prefixes: Declared prefixes not resolved before the deadline or whose request failed
+        :type unresolved_prefixes: list[str]
+        :param errors: Errors of the failed requests
+        :type errors: list[Exception]
+        :param elapsed: Time in seconds the warm up took
+        :type elapsed: float
+        """
+        self.missing_flags = missing_flags
+        self.missing_prefixes = missing_prefixes
+        self.unresolved_flags = unresolved_flags
+        self.unresolved_prefixes = unresolved_prefixes
+        self.errors = errors
+        self.elapsed = elapsed
+
+    @property
+    def complete(self):
+        """
+        Whether all declared flags and prefixes were resolved in time
+        :rtype: bool
+        """
+        return not self.unresolved_flags and not self.unresolved_prefixes
+
+    def __repr__(self):
+        return (
+            u"WarmUpReport(missing_flags={!r}, missing_prefixes={!r}, unresolved_flags={!r}, unresolved_prefixes={!r}, "
+            u"elapsed={:.3f})".format(
+                self.missing_flags, self.missing_prefixes, self.unresolved_flags, self.unresolved_prefixes,
+                self.elapsed,
+            )
+        )
@@ -0,0 +1,211 @@
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from threading import Lock
+
+# Upper bounds in seconds of the latency histogram buckets, latencies above the last bound fall into an overflow bucket
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class LatencyHistogram(object):
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        """
+        Histogram of latencies over fixed buckets
+        :param buckets: Sorted upper bounds in seconds of the buckets
+        :type buckets: tuple[float]
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        """
+        Records a single latency
+        :param value: Latency in seconds
+        :type value: float
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+
+    @property
+    def mean(self):
+        """
+        Mean of the recorded latencies, None if nothing was recorded
+        :rtype: float or None
+        """
+        return self.total / self.count if self.count else None
+
+    def as_dict(self):
+        """
+        :return: Bucket counts keyed by their upper bound (None for the overflow bucket), with the total count and sum
+        :rtype: dict[str, Any]
+        """
+        return dict(
+            buckets=dict(zip(self.buckets + (None,), self.counts)),
+            count=self.count,
+            total=self.total,
+        )
+
+
+class TongaMetrics(object):  # pylint: disable=too-many-instance-attributes
+    """
+    Collects cache and server request metrics of the clients it is given to through their options, a single instance
+    can be shared by many clients. Metrics are kept in memory and every recorded value is also passed to the registered
+    hooks, which can forward them to an external metrics pipeline
+    """
+
+    def __init__(self, latency_buckets=DEFAULT_LATENCY_BUCKETS):
+        """
+        :param latency_buckets: Sorted upper bounds in seconds of the latency histogram buckets
+        :type latency_buckets: tuple[float]
+        """
+        self.latency_buckets = latency_buckets
+        # Cache hits and misses by flag, an expired value counts as a miss
+        self.hits = Counter()
+        self.misses = Counter()
+        # Gets of flags cached as missing on the server, answered without a request
+        self.negative_hits = Counter()
+        # Server request attempts, retries and failed attempts by endpoint
+        self.calls = Counter()
+        self.retries = Counter()
+        self.failures = Counter()
+        self.latency = defaultdict(lambda: LatencyHistogram(self.latency_buckets))
+        self.bytes_received = 0
+        # Time spent decoding and squashing server responses
+        self.parse_time = 0.0
+        self.circuit_breaker_transitions = Counter()
+        self._hooks = []
+        self._lock = Lock()
+
+    def add_hook(self, hook):
+        """
+        Registers a callback invoked with every recorded value, for example to forward metrics to statsd
+        :param hook: Callback receiving the metric name, the value and a dict of tags
+        :type hook: (str, float, dict[str, str]) -> None
+        """
+        self._hooks.append(hook)
+
+    def _emit(self, name, value, tags):
+        for hook in self._hooks:
+            hook(name, value, tags)
+
+    def record_hit(self, flag):
+        """
+        Records a get served from the cache
+        :type flag: str
+        """
+        with self._lock:
+            self.hits[flag] += 1
+        if self._hooks:
+            self._emit("cache.hit", 1, dict(flag=flag))
+
+    def record_miss(self, flag):
+        """
+        Records a get that was not served from the cache
+        :type flag: str
+        """
+        with self._lock:
+            self.misses[flag] += 1
+        if self._hooks:
+            self._emit("cache.miss", 1, dict(flag=flag))
+
+    def record_negative_hit(self, flag):
+        """
+        Records a get of a flag cached as missing on the server
+        :type flag: str
+        """
+        with self._lock:
+            self.negative_hits[flag] += 1
+        if self._hooks:
+            self._emit("cache.negative_hit", 1, dict(flag=flag))
+
+    def record_request(self, endpoint, elapsed, bytes_received=0, failed=False):
+        """
+        Records a single server request attempt
+        :param endpoint: Endpoint name, e.g. flag_value or all_flags_values
+        :type endpoint: str
+        :param elapsed: Latency in seconds
+        :type elapsed: float
+        :param bytes_received: Size of the response body
+        :type bytes_received: int
+        :param failed: Whether the attempt failed
+        :type failed: bool
+        """
+        with self._lock:
+            self.calls[endpoint] += 1
+            if failed:
+                self.failures[endpoint] += 1
+            self.latency[endpoint].observe(elapsed)
+            self.bytes_received += bytes_received
+        if self._hooks:
+            tags = dict(endpoint=endpoint)
+            self._emit("request.latency", elapsed, tags)
+            self._emit("request.bytes", bytes_received, tags)
+            if failed:
+                self._emit("request.failure", 1, tags)
+
+    def record_retry(self, endpoint):
+        """
+        Records that a failed request is about to be retried
+        :type endpoint: str
+        """
+        with self._lock:
+            self.retries[endpoint] += 1
+        if self._hooks:
+            self._emit("request.retry", 1, dict(endpoint=endpoint))
+
+    def record_parse(self, elapsed):
+        """
+        Records time spent decoding or squashing a server response
+        :type elapsed: float
+        """
+        with self._lock:
+            self.parse_time += elapsed
+        if self._hooks:
+            self._emit("response.parse_time", elapsed, {})
+
+    def track_circuit_breaker(self, breaker):
+        """
+        Records the state transitions of the given circuit breaker
+        :type breaker: tonga.retry.CircuitBreaker
+        """
+        breaker.add_listener(self._record_circuit_breaker_transition)
+
+    def _record_circuit_breaker_transition(self, previous_state, state):
+        with self._lock:
+            self.circuit_breaker_transitions[(previous_state, state)] += 1
+        if self._hooks:
+            self._emit("circuit_breaker.transition", 1, dict(previous_state=previous_state, state=state))
+
+    @property
+    def hit_rate(self):
+        """
+        Fraction of gets served from the cache, including negatively cached flags, None if nothing was recorded
+        :rtype: float or None
+        """
+        hits = sum(self.hits.values()) + sum(self.negative_hits.values())
+        misses = sum(self.misses.values())
+        return float(hits) / (hits + misses) if hits + misses else None
+
+    def as_dict(self):
+        """
+        :return: Plain dict of all collected metrics, suitable for serialization
+        :rtype: dict[str, Any]
+        """
+        with self._lock:
+            return dict(
+                hits=dict(self.hits),
+                misses=dict(self.misses),
+                negative_hits=dict(self.negative_hits),
+                calls=dict(self.calls),
+                retries=dict(self.retries),
+                failures=dict(self.failures),
+                latency={endpoint: histogram.as_dict() for endpoint, histogram in self.latency.items()},
+                bytes_received=self.bytes_received,
+                parse_time=self.parse_time,
+                circuit_breaker_transitions={
+                    u"{}->{}".format(*transition): count
+                    for transition, count in self.circuit_breaker_transitions.items()
+                },
+            )
@@ -0,0 +1,93 @@
+import random
+import weakref
+from threading import Event, Thread
+from time import time
+
+# Refresh cached flags once this fraction of their ttl has passed, leaving room for the refresh to complete before they
+# expire
+REFRESH_AHEAD_RATIO = 0.75
+# Minimal time between refreshes triggered by stale reads as a fraction of the ttl, so a failing server is not
+# hammered by every read of a stale value
+MIN_WAKE_INTERVAL_RATIO = 0.1
+
+
+class FlagRefresher(object):
+    """
+    Background daemon thread that periodically re-fetches the flags cached by a client before they expire, so reads
+    keep being served from the cache. The refresher only holds a weak reference to the client and stops once the client
+    is garbage collected
+    """
+
+    def __init__(self, client, ttl, jitter):
+        """
+        :param client: Client whose cache should be refreshed
+        :type client: tonga.client.TongaClient
+        :param ttl: Shortest ttl of the cached flags in seconds
+        :type ttl: float
+        :param jitter: Fraction by which each refresh interval is randomly stretched or shrunk, so multiple processes do
+        not refresh in lockstep
+        :type jitter: float
+        """
+        self._client_ref = weakref.ref(client)
+        self.ttl = ttl
+        self.jitter = jitter
+        self._wake_event = Event()
+        self._last_refresh = 0
+        self._stopped = False
+        self._thread = Thread(target=self._run, name="tonga-flag-refresher")
+        self._thread.daemon = True
+
+    def start(self):
+        """
+        Starts the refresher thread
+        """
+        self._thread.start()
+
+    def stop(self):
+        """
+        Signals the refresher thread to exit, an in progress refresh is completed first
+        """
+        self._stopped = True
+        self._wake_event.set()
+
+    def wake(self):
+        """
+        Triggers an immediate refresh, used when a client notices it is serving stale values
+        """
+        if time() - self._last_refresh >= self.ttl * MIN_WAKE_INTERVAL_RATIO:
+            self._wake_event.set()
+
+    @property
+    def is_alive(self):
+        """
+        Whether the refresher thread is running
+        :rtype: bool
+        """
+        return self._thread.is_alive()
+
+    def next_delay(self):
+        """
+        Time in seconds to wait until the next refresh
+        :rtype: float
+        """
+        delay = self.ttl * REFRESH_AHEAD_RATIO
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _run(self):
+        delay = self.next_delay()
+        while not self._stopped:
+            self._wake_event.wait(delay)
+            self._wake_event.clear()
+            client = self._client_ref()
+            if self._stopped or client is None:
+                return
+            delay = self.next_delay()
+            self._last_refresh = time()
+            try:
+                client._refresh_cache(horizon=delay)  # pylint: disable=protected-access
+            except Exception:  # pylint: disable=broad-except
+                # Any failure (server errors, malformed responses) must not kill the thread, keep serving the stale
+                # values and try again on the next cycle
+                pass
+            # Do not keep the client alive while waiting
+            del client
@@ -0,0 +1,179 @@
+import random
+from collections import Counter
+from threading import Lock
+from time import time
+
+import requests
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """
+    Raised instead of issuing a request while the circuit breaker is open
+    """
+    pass
+
+
+class RetryPolicy(object):
+    def __init__(self, retries=10, base_delay=1, multiplier=2, max_delay=30, jitter=0.5, deadline=None):
+        """
+        Exponential backoff policy for retrying failed server requests
+        :param retries: Maximal number of retries after the first attempt
+        :type retries: int
+        :param base_delay: Delay in seconds before the first retry
+        :type base_delay: float
+        :param multiplier: Factor by which the delay grows after each retry, 1 means a constant delay
+        :type multiplier: float
+        :param max_delay: Upper bound in seconds for a single delay
+        :type max_delay: float
+        :param jitter: Fraction of each delay that is randomized, so clients failing together do not retry in lockstep
+        :type jitter: float
+        :param deadline: Optional total time in seconds a call may spend including all retries, each attempt times out
+        once the deadline passes and no retry is attempted if its delay would pass the deadline
+        :type deadline: float
+        """
+        self.retries = retries
+        self.base_delay = base_delay
+        self.multiplier = multiplier
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.deadline = deadline
+
+    @classmethod
+    def constant(cls, retries, delay):
+        """
+        Creates a policy retrying with a fixed delay
+        :type retries: int
+        :type delay: float
+        :rtype: RetryPolicy
+        """
+        return cls(retries=retries, base_delay=delay, multiplier=1, max_delay=delay, jitter=0)
+
+    def backoff(self, attempt):
+        """
+        Delay in seconds before retrying after the given failed attempt
+        :param attempt: Zero based index of the failed attempt
+        :type attempt: int
+        :rtype: float
+        """
+        delay = min(self.base_delay * self.multiplier ** attempt, self.max_delay)
+        return delay * (1 - random.uniform(0, self.jitter))
+
+    def next_delay(self, attempt, elapsed):
+        """
+        Delay in seconds before retrying after the given failed attempt, None if the call should not be retried
+        :param attempt: Zero based index of the failed attempt
+        :type attempt: int
+        :param elapsed: Time in seconds spent in the call so far
+        :type elapsed: float
+        :rtype: float or None
+        """
+        if attempt >= self.retries:
+            return None
+        delay = self.backoff(attempt)
+        if self.deadline is not None and elapsed + delay >= self.deadline:
+            return None
+        return delay
+
+    def attempt_timeout(self, elapsed):
+        """
+        Time in seconds the next attempt may take before the deadline passes
+        :param elapsed: Time in seconds spent in the call so far
+        :type elapsed: float
+        :return: Remaining time, None if there is no deadline
+        :rtype: float or None
+        """
+        if self.deadline is None:
+            return None
+        return max(self.deadline - elapsed, 0)
+
+
+class CircuitBreaker(object):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        """
+        Stops issuing requests to a failing server. After failure_threshold consecutive failed requests the breaker
+        opens and requests fail fast, once reset_timeout passes a single probe request is let through (half open), its
+        success closes the breaker and its failure opens it again. Share the breaker between clients of the same server
+        by sharing their options
+        :param failure_threshold: Number of consecutive failed requests opening the breaker
+        :type failure_threshold: int
+        :param reset_timeout: Time in seconds the breaker stays open before probing the server
+        :type reset_timeout: float
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        # Count of state transitions by (from state, to state)
+        self.transitions = Counter()
+        self._listeners = []
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+        self._lock = Lock()
+
+    def add_listener(self, listener):
+        """
+        Registers a callback invoked on every state transition
+        :param listener: Callback receiving the previous and the new state
+        :type listener: (str, str) -> None
+        """
+        self._listeners.append(listener)
+
+    def allow_request(self):
+        """
+        Checks whether a request may be issued, moving an open breaker to half open once the reset timeout passes
+        :rtype: bool
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time() - self._opened_at < self.reset_timeout:
+                    return False
+                self._transition(self.HALF_OPEN)
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        """
+        Records a successful request
+        """
+        with self._lock:
+            self._failures = 0
+            self._probe_in_flight = False
+            if self.state != self.CLOSED:
+                self._transition(self.CLOSED)
+
+    def record_failure(self):
+        """
+        Records a failed request
+        """
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self._failures >= self.failure_threshold):
+                self._opened_at = time()
+                self._transition(self.OPEN)
+
+    def release_probe(self):
+        """
+        Releases the half open probe without recording an outcome, to be called when the probing request was
+        interrupted, so that a later request may probe the server again
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+    def _transition(self, state):
+        """
+        Moves to the given state, must be called while holding the lock
+        :type state: str
+        """
+        previous_state, self.state = self.state, state
+        self.transitions[(previous_state, state)] += 1
+        for listener in self._listeners:
+            listener(previous_state, state)
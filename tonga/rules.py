@@ -0,0 +1,259 @@
+import re
+from threading import Lock
+from time import time
+
+import six
+
+from tonga.coalescing import SingleFlight
+
+
+def _to_number(value):
+    """
+    Parses a context value as a number
+    :rtype: float or None
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _compile_numeric(compare, operand):
+    operand = float(operand)
+
+    def predicate(value):
+        number = _to_number(value)
+        return number is not None and compare(number, operand)
+
+    return predicate
+
+
+def _compile_condition(condition):
+    """
+    Compiles a single rule condition into a predicate over the string value of its attribute
+    :param condition: Condition definition
+    :type condition: dict[str, Any]
+    :return: Predicate receiving the attribute value, None if the context does not have the attribute
+    :rtype: (str or None) -> bool
+    :raises ValueError: If the condition is malformed
+    """
+    operator = condition.get("operator", "in")
+    operands = condition.get("values")
+    if operands is None:
+        operands = [condition["value"]] if "value" in condition else []
+    operands = [six.text_type(operand) for operand in operands]
+
+    if operator == "in":
+        values = frozenset(operands)
+        return lambda value: value is not None and value in values
+    if operator == "not_in":
+        values = frozenset(operands)
+        return lambda value: value is None or value not in values
+    if operator == "starts_with":
+        prefixes = tuple(operands)
+        return lambda value: value is not None and value.startswith(prefixes)
+    if operator == "matches":
+        pattern = re.compile(u"|".join(u"(?:{})".format(operand) for operand in operands))
+        return lambda value: value is not None and pattern.match(value) is not None
+    numeric_operators = {
+        "lt": lambda left, right: left < right,
+        "lte": lambda left, right: left <= right,
+        "gt": lambda left, right: left > right,
+        "gte": lambda left, right: left >= right,
+    }
+    if operator in numeric_operators and len(operands) == 1:
+        return _compile_numeric(numeric_operators[operator], operands[0])
+    raise ValueError(u"Invalid condition {!r}".format(condition))
+
+
+class _CompiledRule(object):
+    __slots__ = ("conditions", "value")
+
+    def __init__(self, definition):
+        # Conditions as pairs of attribute name and predicate
+        self.conditions = [
+            (condition["attribute"], _compile_condition(condition)) for condition in definition.get("conditions", ())
+        ]
+        self.value = definition.get("value")
+
+    def matches(self, context):
+        """
+        Whether all conditions of the rule match the given normalized context
+        :rtype: bool
+        """
+        return all(predicate(context.get(attribute)) for attribute, predicate in self.conditions)
+
+
+class _CompiledFlag(object):
+    __slots__ = ("rules", "has_default", "default", "index", "unindexed")
+
+    def __init__(self, definition):
+        self.rules = [_CompiledRule(rule) for rule in definition.get("rules", ())]
+        self.has_default = "value" in definition
+        self.default = definition.get("value")
+        # Rules whose first condition is an "in" condition are indexed by its attribute and values, only rules indexed
+        # under the values of the evaluated context (and unindexed rules) can match it
+        self.index = {}
+        self.unindexed = []
+        for position, (rule, rule_definition) in enumerate(zip(self.rules, definition.get("rules", ()))):
+            conditions = rule_definition.get("conditions") or ()
+            first = conditions[0] if conditions else None
+            if first is None or first.get("operator", "in") != "in":
+                self.unindexed.append(position)
+                continue
+            values = first.get("values")
+            values = values if values is not None else [first.get("value")]
+            attribute_index = self.index.setdefault(first["attribute"], {})
+            for value in values:
+                attribute_index.setdefault(six.text_type(value), []).append(position)
+
+    def candidates(self, context):
+        """
+        Returns the positions of the rules that may match the given context, in rule order
+        :type context: dict[str, str]
+        :rtype: list[int]
+        """
+        candidates = self.unindexed
+        for attribute, attribute_index in self.index.items():
+            positions = attribute_index.get(context.get(attribute))
+            if positions:
+                candidates = candidates + positions
+        if candidates is self.unindexed:
+            return candidates
+        return sorted(set(candidates))
+
+    def evaluate(self, context, default):
+        """
+        Returns the value of the first matching rule, otherwise the flag value or the given default
+        :rtype: Any
+        """
+        for position in self.candidates(context):
+            rule = self.rules[position]
+            if rule.matches(context):
+                return rule.value
+        return self.default if self.has_default else default
+
+
+class FlagRules(object):
+    """
+    Compiled flag definitions and targeting rules, evaluating flags for a context the same way the server does. The
+    rules document maps each dotted flag name to its definition:
+
+        {"flags": {"routing.timeout": {
+            "value": 5,
+            "rules": [
+                {"conditions": [{"attribute": "region", "operator": "in", "values": ["eu", "uk"]}], "value": 7},
+                {"conditions": [{"attribute": "vehicle_id", "operator": "matches", "values": ["bus-.*"]}], "value": 9}
+            ]
+        }}}
+
+    The value of the first rule all of whose conditions match is returned, otherwise the flag value, and a flag without
+    a value matching no rule is not defined for the context. Context values are compared as the strings the client sends
+    in the query string. Operators are in, not_in, starts_with, matches (regular expressions), and lt, lte, gt and gte
+    which compare numerically. A context missing an attribute only matches not_in conditions on it
+    """
+
+    def __init__(self, document):
+        """
+        :param document: Rules document as returned by the flags_rules endpoint
+        :type document: dict[str, Any]
+        :raises ValueError: If the document is malformed
+        """
+        try:
+            self._flags = {flag: _CompiledFlag(definition) for flag, definition in document["flags"].items()}
+        except (KeyError, TypeError, AttributeError, re.error) as e:
+            raise ValueError(u"Invalid flag rules: {!r}".format(e))
+
+    @property
+    def flags(self):
+        """
+        Names of all defined flags
+        :rtype: list[str]
+        """
+        return list(self._flags)
+
+    @staticmethod
+    def normalize_context(context_attributes):
+        """
+        Converts context attributes to the strings they are compared as, a normalized context can be reused across
+        evaluations
+        :type context_attributes: dict[str, object]
+        :rtype: dict[str, str]
+        """
+        return {key: six.text_type(value) for key, value in context_attributes.items()}
+
+    def evaluate(self, flag, context, default=None):
+        """
+        Evaluates a flag for a normalized context
+        :param flag: Flag name
+        :type flag: str
+        :param context: Context as returned by normalize_context
+        :type context: dict[str, str]
+        :param default: Value to return if the flag is not defined for the context
+        :type default: Any
+        :rtype: Any
+        """
+        compiled_flag = self._flags.get(flag)
+        if compiled_flag is None:
+            return default
+        return compiled_flag.evaluate(context, default)
+
+    def evaluate_all(self, context):
+        """
+        Evaluates all flags for a normalized context
+        :param context: Context as returned by normalize_context
+        :type context: dict[str, str]
+        :return: Values of the flags defined for the context
+        :rtype: dict[str, Any]
+        """
+        missing = object()
+        values = {}
+        for flag, compiled_flag in self._flags.items():
+            value = compiled_flag.evaluate(context, missing)
+            if value is not missing:
+                values[flag] = value
+        return values
+
+
+class LocalFlagRules(object):
+    """
+    Flag rules downloaded from the server by the clients given it through their options, and shared by them to evaluate
+    flags locally for any context instead of requesting the values of each context from the server
+    """
+
+    def __init__(self, ttl=None):
+        """
+        :param ttl: Time in seconds after which the rules are downloaded again, None means they are downloaded once
+        :type ttl: float
+        """
+        self.ttl = ttl
+        self.rules = None
+        self.etag = None
+        self._deadline = None
+        self._lock = Lock()
+        # Clients downloading the rules concurrently share a single request
+        self.in_flight = SingleFlight()
+
+    @property
+    def needs_update(self):
+        """
+        Whether the rules were not downloaded yet or have passed their ttl
+        :rtype: bool
+        """
+        return self.rules is None or (self._deadline is not None and self._deadline <= time())
+
+    def update(self, document, etag=None):
+        """
+        Replaces the rules with a newly downloaded rules document
+        :param document: Rules document, None if unchanged since the rules with the current etag were downloaded
+        :type document: dict[str, Any] or None
+        :param etag: ETag of the rules response
+        :type etag: str
+        :raises ValueError: If the document is malformed
+        """
+        rules = FlagRules(document) if document is not None else self.rules
+        with self._lock:
+            self.rules = rules
+            if document is not None:
+                self.etag = etag
+            self._deadline = time() + self.ttl if self.ttl is not None else None
@@ -0,0 +1,218 @@
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+from threading import Lock
+from time import time
+
+from tonga.snapshot import FlagSnapshot, _encode_snapshot, _key_digest, _read_snapshot, _write_atomically
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where refreshes are not coordinated between processes
+    fcntl = None
+
+# Header of the control file mapped into memory by every process: a sequence number that is odd while the header is
+# being written, the generation of the published pre-fetch and the last time it was verified against the server
+_HEADER = struct.Struct("<QQd")
+_SEQUENCE = struct.Struct("<Q")
+
+# Number of attempts at reading a consistent header before giving up, only exceeded if a writer died mid update
+_MAX_HEADER_READS = 1000
+
+
+class SharedFlagStore(object):
+    """
+    Shares the pre-fetched flags between all processes of a host, such as the workers of a pre-fork server, so they
+    refresh them from the server once instead of once per process. Each published pre-fetch is written to a file of
+    its own generation, and swapped in by bumping the generation in a small control file that every process maps into
+    memory, so checking for a newer pre-fetch is a lock free memory read. Refreshes are coordinated through a file lock,
+    a single process fetches from the server while the others wait for it and load what it published
+    """
+
+    def __init__(self, directory):
+        """
+        :param directory: Directory to keep the shared files in, created if missing. A memory backed file system such
+        as /dev/shm avoids disk writes
+        :type directory: str
+        """
+        self.directory = directory
+        # Control file mapping by base path
+        self._controls = {}
+        # Last loaded generation and its snapshot by base path, shared by the clients of the process
+        self._snapshots = {}
+        self._lock = Lock()
+
+    def _ensure_directory(self):
+        """
+        Creates the directory if missing, tolerating other processes creating it concurrently
+        """
+        try:
+            os.makedirs(self.directory)
+        except EnvironmentError:
+            if not os.path.isdir(self.directory):
+                raise
+
+    def _base_path(self, server_url, context_key):
+        """
+        Returns the path all files of the given server and context start with
+        :rtype: str
+        """
+        return os.path.join(self.directory, "tonga-shared-{}".format(_key_digest(server_url, context_key)))
+
+    @staticmethod
+    def _generation_path(base_path, generation):
+        return "{}-{}.json".format(base_path, generation)
+
+    def _control(self, base_path):
+        """
+        Returns the memory mapping of the control file, creating the file if missing
+        :rtype: mmap.mmap
+        """
+        with self._lock:
+            control = self._controls.get(base_path)
+            if control is None:
+                self._ensure_directory()
+                fd = os.open(base_path + ".ctl", os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    # Concurrent creators may all extend the file, a new file reads as no published generation
+                    if os.fstat(fd).st_size < _HEADER.size:
+                        os.ftruncate(fd, _HEADER.size)
+                    control = mmap.mmap(fd, _HEADER.size)
+                finally:
+                    os.close(fd)
+                self._controls[base_path] = control
+            return control
+
+    @staticmethod
+    def _read_header(control):
+        """
+        Reads a consistent header, retrying while a writer is updating it
+        :return: Tuple of the published generation and the time it was last verified, generation 0 if nothing was
+        published
+        :rtype: tuple[int, float]
+        """
+        for _ in range(_MAX_HEADER_READS):
+            sequence, generation, verified_at = _HEADER.unpack(control[:_HEADER.size])
+            if sequence % 2 == 0 and _SEQUENCE.unpack(control[:_SEQUENCE.size])[0] == sequence:
+                return generation, verified_at
+        return 0, 0.0
+
+    @staticmethod
+    def _write_header(control, generation, verified_at):
+        """
+        Writes the header, must be called while holding the refresh lock
+        """
+        sequence = _SEQUENCE.unpack(control[:_SEQUENCE.size])[0]
+        # An odd sequence is left behind by a writer that died mid update
+        sequence += 1 if sequence % 2 == 0 else 2
+        control[:_SEQUENCE.size] = _SEQUENCE.pack(sequence)
+        control[_SEQUENCE.size:_HEADER.size] = _HEADER.pack(sequence, generation, verified_at)[_SEQUENCE.size:]
+        control[:_SEQUENCE.size] = _SEQUENCE.pack(sequence + 1)
+
+    def read(self, server_url, context_key, known_generation=0):
+        """
+        Reads the pre-fetch published for the given server and context
+        :param server_url: Server connection string
+        :type server_url: str
+        :param context_key: Normalized url encoded context attributes
+        :type context_key: str
+        :param known_generation: Generation the caller already holds, its snapshot is not loaded again
+        :type known_generation: int
+        :return: Tuple of the published generation, the last time it was verified against the server and its snapshot,
+        the snapshot is None if it is of the known generation. The generation is 0 if nothing was published or the
+        store is unreadable
+        :rtype: tuple[int, float, tonga.snapshot.FlagSnapshot or None]
+        """
+        base_path = self._base_path(server_url, context_key)
+        try:
+            generation, verified_at = self._read_header(self._control(base_path))
+        except (EnvironmentError, ValueError):
+            return 0, 0.0, None
+        if not generation or generation == known_generation:
+            return generation, verified_at, None
+        loaded_generation, snapshot = self._snapshots.get(base_path, (None, None))
+        if loaded_generation != generation:
+            snapshot = _read_snapshot(self._generation_path(base_path, generation), server_url, context_key)
+            if snapshot is None:
+                return 0, 0.0, None
+            self._snapshots[base_path] = generation, snapshot
+        return generation, verified_at, snapshot
+
+    def publish(self, server_url, context_key, flags, etag):
+        """
+        Publishes a new pre-fetch of the given server and context, must be called while holding the refresh lock
+        :param server_url: Server connection string
+        :type server_url: str
+        :param context_key: Normalized url encoded context attributes
+        :type context_key: str
+        :param flags: Flattened pre-fetched flag values
+        :type flags: dict[str, Any]
+        :param etag: ETag of the all flags response
+        :type etag: str
+        :return: Published generation, 0 if publishing failed
+        :rtype: int
+        """
+        base_path = self._base_path(server_url, context_key)
+        now = time()
+        try:
+            control = self._control(base_path)
+            generation = self._read_header(control)[0] + 1
+            snapshot = FlagSnapshot(flags, now, pre_fetched=True, etag=etag)
+            _write_atomically(
+                self._generation_path(base_path, generation), _encode_snapshot(server_url, context_key, snapshot)
+            )
+            self._write_header(control, generation, now)
+        except (EnvironmentError, ValueError):
+            return 0
+        self._snapshots[base_path] = generation, snapshot
+        # Readers may still be loading the previous generation, older ones are no longer referenced
+        try:
+            os.remove(self._generation_path(base_path, generation - 2))
+        except EnvironmentError:
+            pass
+        return generation
+
+    def touch(self, server_url, context_key):
+        """
+        Marks the published pre-fetch as verified against the server now, must be called while holding the refresh lock
+        :param server_url: Server connection string
+        :type server_url: str
+        :param context_key: Normalized url encoded context attributes
+        :type context_key: str
+        """
+        try:
+            control = self._control(self._base_path(server_url, context_key))
+            generation = self._read_header(control)[0]
+            if generation:
+                self._write_header(control, generation, time())
+        except (EnvironmentError, ValueError):
+            pass
+
+    @contextmanager
+    def refresh_lock(self, server_url, context_key):
+        """
+        Holds the host wide lock of refreshing the flags of the given server and context, blocking until it is
+        available. Without file locking support or if the lock file cannot be opened the refresh is not coordinated
+        :param server_url: Server connection string
+        :type server_url: str
+        :param context_key: Normalized url encoded context attributes
+        :type context_key: str
+        """
+        fd = None
+        if fcntl is not None:
+            try:
+                self._ensure_directory()
+                fd = os.open(self._base_path(server_url, context_key) + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            except EnvironmentError:
+                if fd is not None:
+                    os.close(fd)
+                fd = None
+        try:
+            yield
+        finally:
+            if fd is not None:
+                # Closing the file releases the lock
+                os.close(fd)
@@ -0,0 +1,222 @@
+import atexit
+import hashlib
+import json
+import os
+import tempfile
+import weakref
+from threading import Lock, Timer
+from time import time
+
+# Bumped whenever the snapshot format changes, snapshots of other versions are ignored
+SNAPSHOT_VERSION = 1
+
+# Default time in seconds a scheduled snapshot write is delayed by, so a burst of cache updates is written once
+SAVE_DELAY = 1.0
+
+# Stores with scheduled writes are flushed when the process exits, as the writes run on daemon threads
+_stores = weakref.WeakSet()
+
+# os.replace is not available on python 2, where os.rename already replaces the target atomically on POSIX
+_replace = getattr(os, "replace", os.rename)
+
+
+def _key_digest(server_url, context_key):
+    """
+    Digest identifying the files of the given server and context
+    :rtype: str
+    """
+    return hashlib.sha1(u"{}?{}".format(server_url, context_key).encode("utf-8")).hexdigest()
+
+
+def _encode_snapshot(server_url, context_key, snapshot):
+    """
+    Serializes a snapshot of the given server and context
+    :type snapshot: FlagSnapshot
+    :rtype: bytes
+    """
+    return json.dumps(dict(
+        version=SNAPSHOT_VERSION,
+        timestamp=snapshot.timestamp,
+        server_url=server_url,
+        context=context_key,
+        pre_fetched=snapshot.pre_fetched,
+        etag=snapshot.etag,
+        flags=snapshot.flags,
+    )).encode("utf-8")
+
+
+def _read_snapshot(path, server_url, context_key):
+    """
+    Reads a snapshot of the given server and context from a file
+    :return: The snapshot, None if the file is missing, unreadable or of another version
+    :rtype: FlagSnapshot or None
+    """
+    try:
+        with open(path, "rb") as snapshot_file:
+            content = json.loads(snapshot_file.read().decode("utf-8"))
+    except (EnvironmentError, ValueError):
+        return None
+    # Guard against hash collisions and files written by other versions
+    if not isinstance(content, dict) or content.get("version") != SNAPSHOT_VERSION or \
+            content.get("server_url") != server_url or content.get("context") != context_key:
+        return None
+    return FlagSnapshot(content["flags"], content["timestamp"], content.get("pre_fetched", False), content.get("etag"))
+
+
+def _write_atomically(path, content):
+    """
+    Atomically replaces the content of a file, readers either see the previous content or the new one
+    :raises EnvironmentError: If writing fails
+    """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    # The temporary file must be on the same file system for the rename to be atomic
+    fd, temp_path = tempfile.mkstemp(prefix=".tonga-", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            temp_file.write(content)
+        _replace(temp_path, path)
+    except EnvironmentError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class FlagSnapshot(object):
+    def __init__(self, flags, timestamp, pre_fetched=False, etag=None):
+        """
+        Flag state of a client persisted to disk
+        :param flags: Flattened flag values, as returned by dump_state
+        :type flags: dict[str, Any]
+        :param timestamp: Time the snapshot was taken
+        :type timestamp: float
+        :param pre_fetched: Whether the flags are a pre-fetch of all flags
+        :type pre_fetched: bool
+        :param etag: ETag of the pre-fetched all flags response
+        :type etag: str
+        """
+        self.flags = flags
+        self.timestamp = timestamp
+        self.pre_fetched = pre_fetched
+        self.etag = etag
+
+    @property
+    def age(self):
+        """
+        Time in seconds since the snapshot was taken
+        :rtype: float
+        """
+        return time() - self.timestamp
+
+
+class FlagSnapshotStore(object):
+    def __init__(self, directory, max_age=None, save_delay=SAVE_DELAY):
+        """
+        Persists flag snapshots to a local directory so a starting client can serve flags before reaching the server, or
+        while the server is down. Each snapshot file is keyed by the server url and the context attributes
+        :param directory: Directory to keep the snapshot files in, created if missing
+        :type directory: str
+        :param max_age: Optional age in seconds after which a snapshot is considered stale and is not loaded
+        :type max_age: float
+        :param save_delay: Time in seconds clients' snapshot writes are delayed by, writes scheduled meanwhile for the
+        same server and context are coalesced into a single write
+        :type save_delay: float
+        """
+        self.directory = directory
+        self.max_age = max_age
+        self.save_delay = save_delay
+        # Snapshot builders of the scheduled writes, by server url and context key
+        self._scheduled = {}
+        self._lock = Lock()
+        _stores.add(self)
+
+    def path(self, server_url, context_key):
+        """
+        Returns the snapshot file path of the given server and context
+        :param server_url: Server connection string
+        :type server_url: str
+        :param context_key: Normalized url encoded context attributes
+        :type context_key: str
+        :rtype: str
+        """
+        return os.path.join(self.directory, "tonga-{}.json".format(_key_digest(server_url, context_key)))
+
+    def load(self, server_url, context_key):
+        """
+        Loads the snapshot of the given server and context
+        :param server_url: Server connection string
+        :type server_url: str
+        :param context_key: Normalized url encoded context attributes
+        :type context_key: str
+        :return: The snapshot, None if there is no snapshot or it is unreadable, of another version or stale
+        :rtype: FlagSnapshot or None
+        """
+        snapshot = _read_snapshot(self.path(server_url, context_key), server_url, context_key)
+        if snapshot is None:
+            return None
+        if self.max_age is not None and snapshot.age > self.max_age:
+            return None
+        return snapshot
+
+    def save(self, server_url, context_key, snapshot):
+        """
+        Atomically replaces the snapshot of the given server and context, readers either see the previous snapshot or
+        the new one. Failing to write is ignored as the snapshot is only an optimization
+        :param server_url: Server connection string
+        :type server_url: str
+        :param context_key: Normalized url encoded context attributes
+        :type context_key: str
+        :param snapshot: Snapshot to save
+        :type snapshot: FlagSnapshot
+        """
+        try:
+            _write_atomically(self.path(server_url, context_key), _encode_snapshot(server_url, context_key, snapshot))
+        except EnvironmentError:
+            pass
+
+    def schedule_save(self, server_url, context_key, build_snapshot):
+        """
+        Schedules saving the snapshot of the given server and context on a background thread once the save delay
+        passes. The snapshot is built when it is written, so a burst of updates costs a single write of the latest state
+        :param server_url: Server connection string
+        :type server_url: str
+        :param context_key: Normalized url encoded context attributes
+        :type context_key: str
+        :param build_snapshot: Builds the snapshot to save, may return None to skip the write
+        :type build_snapshot: () -> FlagSnapshot or None
+        """
+        key = (server_url, context_key)
+        with self._lock:
+            scheduled = key in self._scheduled
+            self._scheduled[key] = build_snapshot
+        if not scheduled:
+            timer = Timer(self.save_delay, self._save_scheduled, args=(key,))
+            timer.daemon = True
+            timer.start()
+
+    def _save_scheduled(self, key):
+        """
+        Writes the scheduled snapshot of the given server url and context key, if still scheduled
+        :type key: tuple[str, str]
+        """
+        with self._lock:
+            build_snapshot = self._scheduled.pop(key, None)
+        snapshot = build_snapshot() if build_snapshot is not None else None
+        if snapshot is not None:
+            self.save(key[0], key[1], snapshot)
+
+    def flush(self):
+        """
+        Writes all scheduled snapshots right away
+        """
+        with self._lock:
+            keys = list(self._scheduled)
+        for key in keys:
+            self._save_scheduled(key)
+
+
+@atexit.register
+def _flush_stores():
+    for store in list(_stores):
+        store.flush()
@@ -0,0 +1,207 @@
+import json
+import weakref
+from collections import namedtuple
+from threading import Event, Thread
+
+# Event types of the flags stream, a snapshot carries the full flag tree and a diff carries an incremental update
+SNAPSHOT_EVENT = "snapshot"
+DIFF_EVENT = "diff"
+# Comment lines sent by the server to keep an idle stream alive
+HEARTBEAT_EVENT = "heartbeat"
+
+ServerSentEvent = namedtuple("ServerSentEvent", ["id", "type", "data"])
+
+
+def iter_events(lines):
+    """
+    Parses server-sent events out of the lines of an event stream, heartbeat comments are reported as events as well so
+    the consumer knows the stream is alive
+    :param lines: Decoded lines of the stream without line terminators
+    :type lines: collections.Iterable[str]
+    :rtype: collections.Iterator[ServerSentEvent]
+    """
+    event_id, event_type, data = None, None, []
+    for line in lines:
+        if not line:
+            if data:
+                yield ServerSentEvent(event_id, event_type or "message", u"\n".join(data))
+            event_id, event_type, data = None, None, []
+            continue
+        if line.startswith(u":"):
+            yield ServerSentEvent(None, HEARTBEAT_EVENT, u"")
+            continue
+        field, _, value = line.partition(u":")
+        if value.startswith(u" "):
+            value = value[1:]
+        if field == u"id":
+            event_id = value
+        elif field == u"event":
+            event_type = value
+        elif field == u"data":
+            data.append(value)
+
+
+def _load_payload(event):
+    """
+    Decodes the flag tree carried by a snapshot or diff event
+    :type event: ServerSentEvent
+    :rtype: dict[str, Any]
+    :raises ValueError: If the payload is not a JSON object
+    """
+    payload = json.loads(event.data)
+    if not isinstance(payload, dict):
+        raise ValueError(u"Malformed {} event {}".format(event.type, event.id))
+    return payload
+
+
+class FlagSubscriber(object):
+    """
+    Background daemon thread holding a long lived server-sent events connection to the server and applying the pushed
+    flag updates to the cache of a client. Dropped connections are resumed from the last received event, and if the
+    server does not support streaming the subscriber falls back to polling. Like the refresher, the subscriber only
+    holds a weak reference to the client and stops once the client is garbage collected
+    """
+
+    def __init__(self, client, transport, poll_interval, retry_policy):
+        """
+        :param client: Client whose cache should be updated
+        :type client: tonga.client.TongaClient
+        :param transport: Transport to open the stream with
+        :type transport: tonga.transport.TongaTransport
+        :param poll_interval: Time in seconds between polls when the server does not support streaming
+        :type poll_interval: float
+        :param retry_policy: Policy used for the delay before reconnecting after a failure
+        :type retry_policy: tonga.retry.RetryPolicy
+        """
+        self._client_ref = weakref.ref(client)
+        self._transport = transport
+        self.poll_interval = poll_interval
+        self.retry_policy = retry_policy
+        # Id of the last received event, sent when reconnecting so the server can resume from it
+        self.last_event_id = None
+        self.connected = False
+        self.streaming_supported = True
+        self._stopped = False
+        self._stop_event = Event()
+        self._thread = Thread(target=self._run, name="tonga-flag-subscriber")
+        self._thread.daemon = True
+
+    def start(self):
+        """
+        Starts the subscriber thread
+        """
+        self._thread.start()
+
+    def stop(self):
+        """
+        Signals the subscriber thread to exit, an open stream is closed once its next event or heartbeat arrives
+        """
+        self._stopped = True
+        self._stop_event.set()
+
+    @property
+    def is_alive(self):
+        """
+        Whether the subscriber thread is running
+        :rtype: bool
+        """
+        return self._thread.is_alive()
+
+    def _run(self):
+        failures = 0
+        while not self._stopped:
+            try:
+                if self.streaming_supported:
+                    failures = 0 if self._consume_stream() else failures + 1
+                else:
+                    self._poll()
+            except Exception:  # pylint: disable=broad-except
+                # Connection errors, timeouts, malformed events and any unexpected error all end up reconnecting, the
+                # subscriber must outlive them
+                failures += 1
+            finally:
+                self.connected = False
+            self._stop_event.wait(self._next_delay(failures))
+
+    def _next_delay(self, failures):
+        """
+        Time in seconds to wait before reconnecting or polling again
+        :param failures: Number of consecutive failed connections
+        :type failures: int
+        :rtype: float
+        """
+        if not self.streaming_supported:
+            return self.poll_interval
+        if not failures:
+            return 0
+        return min(self.retry_policy.backoff(failures - 1), self.poll_interval)
+
+    def _consume_stream(self):
+        """
+        Opens the stream and applies its events until it ends
+        :return: Whether any event was received
+        :rtype: bool
+        """
+        client = self._client_ref()
+        if client is None:
+            self._stopped = True
+            return False
+        url, headers = client._stream_request(self.last_event_id)  # pylint: disable=protected-access
+        # Do not keep the client alive while blocked on the stream
+        del client
+        try:
+            response = self._transport.stream(url, headers)
+        except NotImplementedError:
+            self.streaming_supported = False
+            return False
+
+        received = False
+        try:
+            if response.status_code == 404:
+                self.streaming_supported = False
+                return False
+            response.raise_for_status()
+            self.connected = True
+            # Event streams are always utf-8 encoded
+            response.encoding = "utf-8"
+            for event in iter_events(response.iter_lines(chunk_size=None, decode_unicode=True)):
+                client = self._client_ref()
+                if self._stopped or client is None:
+                    self._stopped = True
+                    break
+                self._apply_event(client, event)
+                del client
+                received = True
+        finally:
+            response.close()
+        return received
+
+    def _apply_event(self, client, event):
+        """
+        Applies a single stream event to the client cache
+        :type client: tonga.client.TongaClient
+        :type event: ServerSentEvent
+        :raises ValueError: If the event payload is malformed
+        """
+        # pylint: disable=protected-access
+        if event.type == SNAPSHOT_EVENT:
+            client._replace_pre_fetch(_load_payload(event))
+        elif event.type == DIFF_EVENT:
+            diff = _load_payload(event)
+            if not isinstance(diff.get("set") or {}, dict) or not isinstance(diff.get("unset") or [], list):
+                raise ValueError(u"Malformed {} event {}".format(event.type, event.id))
+            client._apply_flag_diff(diff)
+        elif event.type == HEARTBEAT_EVENT:
+            client._extend_pre_fetch()
+        if event.id is not None:
+            self.last_event_id = event.id
+
+    def _poll(self):
+        """
+        Revalidates the flags of the client the same way a pre-fetch refresh does
+        """
+        client = self._client_ref()
+        if client is None:
+            self._stopped = True
+            return
+        client._poll_flags()  # pylint: disable=protected-access
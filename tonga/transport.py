@@ -0,0 +1,127 @@
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class TongaTransport(object):
+    """
+    Base class for the HTTP layer used by the client to talk with the Tonga server, implementations must be safe to
+    share between clients and threads
+    """
+
+    def get(self, url, headers, timeout=None):
+        """
+        Issues a GET request
+        :param url: Full request url including the query string
+        :type url: str
+        :param headers: Request headers
+        :type headers: dict[str, str]
+        :param timeout: Optional time in seconds the request may take, when shorter than the transport timeouts. Only
+        passed by clients whose retry policy has a deadline
+        :type timeout: float
+        :return: Server response
+        :rtype: requests.Response
+        :raises requests.exceptions.Timeout: If the request times out
+        """
+        raise NotImplementedError()
+
+    def stream(self, url, headers):
+        """
+        Issues a long lived GET request whose body is consumed as it arrives, used for flag updates pushed by the server
+        :param url: Full request url including the query string
+        :type url: str
+        :param headers: Request headers
+        :type headers: dict[str, str]
+        :return: Server response with a streamed body, the caller is responsible for closing it
+        :rtype: requests.Response
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        """
+        Releases any resources (open connections) held by the transport
+        """
+        pass
+
+
+class PooledSessionTransport(TongaTransport):
+    def __init__(self, pool_size=10, pool_connections=10, connect_timeout=5, read_timeout=30, keep_alive=True):
+        """
+        :param pool_size: Maximal number of connections kept open per server host
+        :type pool_size: int
+        :param pool_connections: Number of distinct server hosts to keep connection pools for
+        :type pool_connections: int
+        :param connect_timeout: Timeout in seconds for establishing a connection to the server, None means no timeout
+        :type connect_timeout: float
+        :param read_timeout: Timeout in seconds for waiting on server response data, None means no timeout
+        :type read_timeout: float
+        :param keep_alive: Whether to keep connections open between requests, disabling it will ask the server to close
+        the connection after each response
+        :type keep_alive: bool
+        """
+        self.pool_size = pool_size
+        self.pool_connections = pool_connections
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keep_alive = keep_alive
+        self._session = self._create_session()
+
+    def _create_session(self):
+        """
+        Creates the underlying requests session, connection pools are held by its adapters and are thread safe
+        :rtype: requests.Session
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if not self.keep_alive:
+            session.headers["Connection"] = "close"
+        return session
+
+    @property
+    def timeout(self):
+        """
+        Timeout tuple as expected by requests
+        :rtype: tuple[float, float]
+        """
+        return self.connect_timeout, self.read_timeout
+
+    def _bounded_timeout(self, timeout):
+        """
+        Timeout tuple as expected by requests, with each timeout capped to the given time
+        :type timeout: float or None
+        :rtype: tuple[float, float]
+        """
+        if timeout is None:
+            return self.timeout
+        return tuple(timeout if limit is None else min(limit, timeout) for limit in self.timeout)
+
+    def get(self, url, headers, timeout=None):
+        # requests applies the read timeout to each socket read rather than to the whole response, which bounds waiting
+        # on a slow server but not a response trickling in
+        return self._session.get(url, headers=headers, timeout=self._bounded_timeout(timeout))
+
+    def stream(self, url, headers):
+        return self._session.get(url, headers=headers, timeout=self.timeout, stream=True)
+
+    def close(self):
+        self._session.close()
+
+
+_default_transport = None  # pylint: disable=invalid-name
+_default_transport_lock = Lock()
+
+
+def get_default_transport():
+    """
+    Returns the process wide transport shared by all clients that were not given an explicit transport
+    :rtype: TongaTransport
+    """
+    global _default_transport  # pylint: disable=global-statement
+    if _default_transport is None:
+        with _default_transport_lock:
+            if _default_transport is None:
+                _default_transport = PooledSessionTransport()
+    return _default_transport
@@ -0,0 +1,176 @@
+import six
+
+_MISSING = object()
+
+_TRUE_STRINGS = frozenset([u"true", u"yes", u"on", u"1"])
+_FALSE_STRINGS = frozenset([u"false", u"no", u"off", u"0"])
+
+
+def _to_bool(value):
+    """
+    Coerces a flag value to a bool, booleans, numbers and the usual true/false strings are accepted
+    :return: Coerced value, _MISSING if the value cannot be coerced
+    :rtype: bool
+    """
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, six.integer_types + (float,)):
+        return value != 0
+    if isinstance(value, six.string_types):
+        lowered = value.strip().lower()
+        if lowered in _TRUE_STRINGS:
+            return True
+        if lowered in _FALSE_STRINGS:
+            return False
+    return _MISSING
+
+
+def _to_int(value):
+    """
+    Coerces a flag value to an int, integral numbers and strings of integers are accepted
+    :return: Coerced value, _MISSING if the value cannot be coerced
+    :rtype: int
+    """
+    if isinstance(value, bool):
+        return _MISSING
+    if isinstance(value, six.integer_types):
+        return value
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else _MISSING
+    if isinstance(value, six.string_types):
+        try:
+            return int(value)
+        except ValueError:
+            return _MISSING
+    return _MISSING
+
+
+def _to_float(value):
+    """
+    Coerces a flag value to a float, numbers and numeric strings are accepted
+    :return: Coerced value, _MISSING if the value cannot be coerced
+    :rtype: float
+    """
+    if isinstance(value, bool):
+        return _MISSING
+    if isinstance(value, six.integer_types + (float,)):
+        return float(value)
+    if isinstance(value, six.string_types):
+        try:
+            return float(value)
+        except ValueError:
+            return _MISSING
+    return _MISSING
+
+
+def _to_str(value):
+    """
+    Coerces a flag value to a string, only strings are accepted
+    :return: Coerced value, _MISSING if the value is not a string
+    :rtype: str
+    """
+    return value if isinstance(value, six.string_types) else _MISSING
+
+
+class FlagView(object):
+    """
+    Immutable view of flag values taken from a client, for inner loops checking flags many times. Reading a flag is a
+    single dict lookup that never touches the server, expiry, metrics or locks, and the typed accessors return values
+    coerced once per view. A view does not see later changes of the client, take a new view to pick them up
+    """
+
+    __slots__ = ("_values", "_coerced")
+
+    _COERCIONS = {"bool": _to_bool, "int": _to_int, "float": _to_float, "str": _to_str}
+
+    def __init__(self, values):
+        """
+        :param values: Flattened flag values
+        :type values: dict[str, Any]
+        """
+        self._values = dict(values)
+        # Coercible values by type name, compiled on first use of each typed accessor
+        self._coerced = {}
+
+    def __contains__(self, flag):
+        return flag in self._values
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def get(self, flag, default=None):
+        """
+        Gets the value of a flag
+        :param flag: Flag name
+        :type flag: str
+        :param default: Value to return if the flag is not in the view
+        :type default: Any
+        :rtype: Any
+        """
+        return self._values.get(flag, default)
+
+    def _typed(self, type_name):
+        """
+        Returns the values that can be coerced to the given type, coerced
+        :rtype: dict[str, Any]
+        """
+        coerced = self._coerced.get(type_name)
+        if coerced is None:
+            coerce = self._COERCIONS[type_name]
+            coerced = {}
+            for flag, value in self._values.items():
+                value = coerce(value)
+                if value is not _MISSING:
+                    coerced[flag] = value
+            self._coerced[type_name] = coerced
+        return coerced
+
+    def get_bool(self, flag, default=False):
+        """
+        Gets the value of a flag as a bool. Booleans, numbers (true unless zero) and the strings true/false, yes/no,
+        on/off and 1/0 are coerced, otherwise the default is returned
+        :param flag: Flag name
+        :type flag: str
+        :param default: Value to return if the flag is not in the view or cannot be coerced
+        :type default: Any
+        :rtype: bool
+        """
+        return self._typed("bool").get(flag, default)
+
+    def get_int(self, flag, default=0):
+        """
+        Gets the value of a flag as an int. Integers, floats without a fractional part and strings of integers are
+        coerced, otherwise (including for booleans) the default is returned
+        :param flag: Flag name
+        :type flag: str
+        :param default: Value to return if the flag is not in the view or cannot be coerced
+        :type default: Any
+        :rtype: int
+        """
+        return self._typed("int").get(flag, default)
+
+    def get_float(self, flag, default=0.0):
+        """
+        Gets the value of a flag as a float. Numbers and numeric strings are coerced, otherwise (including for
+        booleans) the default is returned
+        :param flag: Flag name
+        :type flag: str
+        :param default: Value to return if the flag is not in the view or cannot be coerced
+        :type default: Any
+        :rtype: float
+        """
+        return self._typed("float").get(flag, default)
+
+    def get_str(self, flag, default=None):
+        """
+        Gets the value of a flag if it is a string, otherwise the default is returned
+        :param flag: Flag name
+        :type flag: str
+        :param default: Value to return if the flag is not in the view or is not a string
+        :type default: Any
+        :rtype: str
+        """
+        return self._typed("str").get(flag, default)
@@ -0,0 +1,125 @@
+import json
+
+import six
+
+try:
+    import msgpack
+except ImportError:
+    # Optional, installed with the msgpack extra. Without it responses are always requested as json
+    msgpack = None
+
+MSGPACK_CONTENT_TYPES = ("application/msgpack", "application/x-msgpack")
+
+# Accept header of flag tree requests when the compact encoding is enabled, json remains acceptable as a fallback
+COMPACT_ACCEPT = u"application/msgpack, application/x-msgpack;q=0.9, application/json;q=0.5"
+
+
+# Objects are decoded into tuples of their key value pairs rather than dicts, arrays are decoded into lists so a tuple
+# is always an object. Building tuples is cheaper than building dicts that would be discarded once flattened
+_PAIRS = tuple
+
+
+def _to_value(value):
+    """
+    Restores the objects nested in a list value into dicts, only objects nested in objects are flattened
+    :rtype: Any
+    """
+    if type(value) is _PAIRS:  # pylint: disable=unidiomatic-typecheck
+        return {key: _to_value(item) for key, item in value}
+    if type(value) is list:  # pylint: disable=unidiomatic-typecheck
+        return [_to_value(item) for item in value]
+    return value
+
+
+def _flatten_into(flat, pairs, prefix):
+    """
+    Flattens the pairs of a decoded object into the given dict under dotted names
+    :type flat: dict[str, Any]
+    :type pairs: tuple[tuple[str, Any]]
+    :type prefix: str
+    """
+    for key, value in pairs:
+        if type(value) is _PAIRS:  # pylint: disable=unidiomatic-typecheck
+            _flatten_into(flat, value, prefix + key + u".")
+        elif type(value) is list:  # pylint: disable=unidiomatic-typecheck
+            flat[prefix + key] = _to_value(value)
+        else:
+            flat[prefix + key] = value
+
+
+def is_msgpack(response):
+    """
+    Whether the given response is msgpack encoded
+    :type response: requests.Response
+    :rtype: bool
+    """
+    content_type = response.headers.get("Content-Type")
+    if not isinstance(content_type, six.string_types):
+        return False
+    return content_type.split(";", 1)[0].strip().lower() in MSGPACK_CONTENT_TYPES
+
+
+def _decode(content, msgpack_encoded, object_pairs_hook=None):
+    """
+    Decodes a response body
+    :type content: bytes
+    :type msgpack_encoded: bool
+    :rtype: Any
+    """
+    if msgpack_encoded:
+        if msgpack is None:
+            raise ValueError(u"Received a msgpack encoded response but msgpack is not installed")
+        return msgpack.unpackb(content, raw=False, strict_map_key=False, object_pairs_hook=object_pairs_hook)
+    if not isinstance(content, str):
+        # Json bodies of the server are utf-8 encoded
+        content = content.decode("utf-8")
+    return json.loads(content, object_pairs_hook=object_pairs_hook)
+
+
+def decode_response(response):
+    """
+    Decodes a json or msgpack response body
+    :type response: requests.Response
+    :rtype: Any
+    """
+    if not is_msgpack(response):
+        return response.json()
+    return _decode(response.content, True)
+
+
+def decode_flat_tree(response):
+    """
+    Decodes a flag tree response straight into flattened dotted flag names, without building the nested tree of dicts.
+    Response objects not exposing their raw content (such as custom transports implementing only json) are decoded and
+    flattened in two steps
+    :type response: requests.Response
+    :return: Flattened flag values
+    :rtype: dict[str, Any]
+    :raises ValueError: If the body is not a flag tree
+    """
+    content = getattr(response, "content", None)
+    if isinstance(content, bytes):
+        tree = _decode(content, is_msgpack(response), _PAIRS)
+    else:
+        tree = _to_pairs(response.json())
+    if not tree:
+        return {}
+    if type(tree) is not _PAIRS:  # pylint: disable=unidiomatic-typecheck
+        raise ValueError(u"Invalid flag tree {!r}".format(tree))
+    # Namespaces are popped off as they are flattened, so the decoded pairs are released while the flat dict grows
+    namespaces = list(reversed(tree))
+    del tree
+    flat = {}
+    while namespaces:
+        _flatten_into(flat, (namespaces.pop(),), u"")
+    return flat
+
+
+def _to_pairs(tree):
+    """
+    Converts the dicts of a decoded tree into pairs
+    :rtype: Any
+    """
+    if isinstance(tree, dict):
+        return _PAIRS((key, _to_pairs(value)) for key, value in tree.items())
+    return tree